@@ -3,46 +3,115 @@
 # ----------------------------------------------------------------------------#
 
 import logging
+import math
 import sys
+import time
+from datetime import datetime, timedelta, timezone
 from logging import Formatter, FileHandler
 
 import babel
 import dateutil.parser
 from flask import (
+    Response,
+    abort,
+    g,
+    jsonify,
+    make_response,
     render_template,
     request,
     redirect,
+    send_file,
+    send_from_directory,
+    stream_with_context,
     url_for
 )
 from flask_moment import Moment
-from sqlalchemy.exc import SQLAlchemyError
-
-from config import DatabaseURI, AppConfig
+from sqlalchemy import and_, func, literal, select, union_all
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import contains_eager
+
+from autocomplete import PrefixIndex
+from benchmarks import bench_read_paths_command
+from config import load_config
+from dbreport import db_report_command
+from dedup import find_duplicates_command
+from ical import stream_calendar
+from imageproxy import THUMBNAIL_SIZES, ImageProxy, ImageUnavailable
+from matching import matching_artists, matching_venues
+from metrics import init_metrics, metrics_command
+from outbox import event, outbox_prune_command, outbox_tail_command, record
 from forms import *
 from models import (
     app,
     db,
+    is_postgresql,
     Venue,
     Show,
     Artist
 )
+from profiling import init_profiling, profile_token_command
+from querybudget import check_query_budgets_command
+from purge import purge_deleted_command, purge_in_background
+from ratelimit import bench_rate_limit_command, init_rate_limits
+from seed import seed_command
+from sitemap import INDEX, is_shard, sitemaps_command
+from sessions import init_session_store
+from slowlog import init_slow_query_log, slow_queries_command
+from templating import init_template_cache, precompile_templates
+from unitofwork import run_in_transaction
 
 # ----------------------------------------------------------------------------#
 # App Config.
 # ----------------------------------------------------------------------------#
 
-app.config.from_object(DatabaseURI())
-app.config.from_object(AppConfig())
+load_config(app)
 moment = Moment(app)
 db.init_app(app)
 
+# embedded sqlite databases have no migrations, create the schema directly
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    with app.app_context():
+        db.create_all()
+
+init_template_cache(app)
+init_profiling(app)
+init_metrics(app)
+init_slow_query_log(app)
+init_rate_limits(app)
+init_session_store(app)
+image_proxy = ImageProxy(app)
+
+app.cli.add_command(seed_command)
+app.cli.add_command(check_query_budgets_command)
+app.cli.add_command(profile_token_command)
+app.cli.add_command(slow_queries_command)
+app.cli.add_command(purge_deleted_command)
+app.cli.add_command(bench_read_paths_command)
+app.cli.add_command(bench_rate_limit_command)
+app.cli.add_command(outbox_tail_command)
+app.cli.add_command(outbox_prune_command)
+app.cli.add_command(sitemaps_command)
+app.cli.add_command(db_report_command)
+app.cli.add_command(find_duplicates_command)
+app.cli.add_command(metrics_command)
+
+
+# in-process name indexes backing the show form autocomplete, loaded on first
+# lookup, kept current by the create/edit/delete handlers below and reloaded
+# every AUTOCOMPLETE_MAX_AGE seconds to pick up the other workers' changes
+artist_index = PrefixIndex(lambda: db.session.query(Artist.id, Artist.name).all(),
+                           max_age=app.config['AUTOCOMPLETE_MAX_AGE'])
+venue_index = PrefixIndex(lambda: db.session.query(Venue.id, Venue.name).filter(Venue.deleted_at.is_(None)).all(),
+                          max_age=app.config['AUTOCOMPLETE_MAX_AGE'])
+
 
 # ----------------------------------------------------------------------------#
 # Filters.
 # ----------------------------------------------------------------------------#
 
 def format_datetime(value, format='medium'):
-    date = dateutil.parser.parse(value)
+    # rows from the database already hold datetimes, only parse strings
+    date = value if isinstance(value, datetime) else dateutil.parser.parse(value)
     if format == 'full':
         format = "EEEE MMMM, d, y 'at' h:mma"
     elif format == 'medium':
@@ -50,7 +119,174 @@ def format_datetime(value, format='medium'):
     return babel.dates.format_datetime(date, format)
 
 
+def thumbnail(url, size):
+    # served from the local image cache instead of hot-linking the source
+    if not url:
+        return url
+    return url_for('image', size=size, token=image_proxy.token(url))
+
+
 app.jinja_env.filters['datetime'] = format_datetime
+app.jinja_env.filters['thumbnail'] = thumbnail
+
+# filters have to be registered before templates can be compiled
+if app.config['PRECOMPILE_TEMPLATES']:
+    precompile_templates(app)
+
+
+# ----------------------------------------------------------------------------#
+# Helpers.
+# ----------------------------------------------------------------------------#
+
+def is_booking_conflict(error):
+    # 23P01 is exclusion_violation, raised by the show overlap constraints,
+    # sqlite's stand-in trigger aborts with its name
+    return getattr(error.orig, 'pgcode', None) == '23P01' or 'show_no_overlap' in str(error.orig)
+
+
+def is_duplicate(error):
+    # the unique name_key indexes, a venue or artist of that name is already
+    # listed in the city
+    return 'name_key' in str(error.orig)
+
+
+def unmerged_duplicate(model, id):
+    # duplicates listed before the unique name_key indexes were added kept a
+    # null key, editing one collides with the listing it duplicates until
+    # `flask find-duplicates` has them merged
+    return db.session.query(model.name_key).filter_by(id=id).scalar() is None
+
+
+def show_duration(minutes):
+    # zero or negative durations would book empty or inverted ranges
+    if minutes in (None, ''):
+        return None
+    minutes = int(minutes)
+    if not 1 <= minutes <= MAX_SHOW_DURATION:
+        raise ValueError(f'duration must be 1 to {MAX_SHOW_DURATION} minutes, got {minutes}')
+    return timedelta(minutes=minutes)
+
+
+def changed_values(form):
+    # the edit pages post a comma separated list of the fields the user touched,
+    # without it (no javascript) every field is treated as changed
+    if 'changed' in request.form:
+        changed = set(filter(None, request.form['changed'].split(',')))
+    else:
+        changed = set(form._fields)
+    # the seeking description validators clear the description when seeking is unticked
+    if changed & {'seeking_venue', 'seeking_talent'}:
+        changed.add('seeking_description')
+    return {name: field.data for name, field in form._fields.items() if name in changed}
+
+
+def update_versioned(model, id, version, values):
+    # a single UPDATE ... WHERE id = :id AND version = :version of just the
+    # given columns, aborts with 409 if someone else saved in between
+    # deleted venues stay hidden until purged, they can't be edited meanwhile
+    live = (model.id == id) & model.deleted_at.is_(None) if model is Venue else model.id == id
+    if values:
+        result = db.session.execute(
+            model.__table__.update().
+            where(live & (model.version == version)).
+            values(version=model.version + 1, **values)
+        )
+        if result.rowcount == 1:
+            if values.keys() & {'name', 'image_link'}:
+                # the detail pages on the other side of its shows list its name and image
+                if model is Artist:
+                    touch(Venue, select([Show.venue_id]).where(Show.artist_id == id))
+                else:
+                    touch(Artist, select([Show.artist_id]).where(Show.venue_id == id))
+            record(event(model.__tablename__, 'updated', id, values))
+            return
+        db.session.rollback()
+
+    # nothing changed or the update missed, a resubmit of an unchanged form
+    # still has to be current and of a listed row
+    current = db.session.query(model.version).filter(live).scalar()
+    if current is None:
+        abort(404)
+    if current == version:
+        return
+    flash('This page was changed by someone else while you were editing it, reload it and try again.')
+    abort(409)
+
+
+def detail_validators(record):
+    # detail pages change when the record or its shows change (updated_date)
+    # and when shows move from upcoming to past, which we don't track, so the
+    # validators also roll over every DETAIL_VALIDATOR_WINDOW seconds
+    window = app.config['DETAIL_VALIDATOR_WINDOW']
+    window_start = datetime.utcfromtimestamp(time.time() // window * window)
+    last_modified = max(record.updated_date, window_start).replace(microsecond=0)
+    etag = f'{record.__tablename__}-{record.id}-{int(last_modified.replace(tzinfo=timezone.utc).timestamp())}'
+    return etag, last_modified
+
+
+def is_not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    since = request.if_modified_since
+    return since is not None and since.replace(tzinfo=None) >= last_modified
+
+
+def with_validators(body, etag, last_modified):
+    response = make_response(body)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # let browsers and proxies keep the page but always revalidate it
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(etag, last_modified):
+    return with_validators(Response(status=304), etag, last_modified)
+
+
+def touch(model, ids):
+    # shows are listed on both detail pages, creating or removing them has
+    # to invalidate the pages' validators. `ids` is a collection or a select
+    if isinstance(ids, (list, set)) and not ids:
+        return
+    db.session.execute(model.__table__.update().where(model.id.in_(ids)).values(updated_date=datetime.utcnow()))
+
+
+def venue_rows(*criteria):
+    # id, name, city, state and number of upcoming shows per venue as plain
+    # rows, counted by postgres instead of loading every show
+    now = datetime.utcnow()
+    return db.session.execute(
+        select([
+            Venue.id,
+            Venue.name,
+            Venue.city,
+            Venue.state,
+            func.count(Show.id).filter(Show.start_time > now).label('num_upcoming_shows')
+        ]).
+        select_from(Venue.__table__.outerjoin(Show.__table__)).
+        where(and_(Venue.deleted_at.is_(None), *criteria)).
+        group_by(Venue.id).
+        order_by(Venue.state, Venue.city, Venue.id)
+    ).fetchall()
+
+
+def artist_rows(*criteria):
+    # shows at deleted venues are hidden from the artist's page, don't count them
+    now = datetime.utcnow()
+    return db.session.execute(
+        select([
+            Artist.id,
+            Artist.name,
+            func.count(Venue.id).filter(Show.start_time > now).label('num_upcoming_shows')
+        ]).
+        select_from(Artist.__table__.outerjoin(Show.__table__).outerjoin(
+            Venue.__table__, (Venue.id == Show.venue_id) & Venue.deleted_at.is_(None)
+        )).
+        where(and_(*criteria)).
+        group_by(Artist.id).
+        order_by(Artist.id)
+    ).fetchall()
 
 
 # ----------------------------------------------------------------------------#
@@ -59,9 +295,13 @@ app.jinja_env.filters['datetime'] = format_datetime
 
 @app.route('/')
 def index():
-    venues = Venue.query.order_by(Venue.created_date.desc()).limit(10).all()
-    artists = Artist.query.order_by(Artist.created_date).limit(10).all()
-    return render_template('pages/home.html', venues=venues, artists=artists)
+    venues = db.session.execute(
+        select([Venue.id, Venue.name]).where(Venue.deleted_at.is_(None)).order_by(Venue.created_date.desc()).limit(10)
+    ).fetchall()
+    artists = db.session.execute(
+        select([Artist.id, Artist.name]).order_by(Artist.created_date).limit(10)
+    ).fetchall()
+    return render_template('pages/home.html', venues=venues, artists=artists, feed_url=app.config['FEED_URL'])
 
 
 #  Venues
@@ -69,48 +309,21 @@ def index():
 
 @app.route('/venues')
 def venues():
-    # get data from database
-    all_venues = Venue.query.all()
-
-    # use a dict to speed up finding venues with same (city, state)
-    # each (city, state) maps to a list
-    venues_dict = {}
-
-    # loop over all data from database
-    for venue in all_venues:
-        # create groups of (city, state) tuple
-        key = (venue.city, venue.state)
-
-        # create a list of venues if one wasn't found for current (city, state) group
-        if key not in venues_dict:
-            venues_dict[key] = []
-
-        # choose only data we want and append to dictionary's list
-        time_now = datetime.utcnow()
-
-        # either this or aggregate using postgres but I thought I'd decrease the calls to database
-        upcoming_shows = list(filter(lambda show: show.start_time > time_now, venue.shows))
-
-        curr_venue = {
-            "id": venue.id,
-            "name": venue.name,
-            "num_upcoming_shows": len(upcoming_shows)
-        }
-        venues_dict[key].append(curr_venue)
+    # one aggregate query, rows come back ordered so venues of a city are adjacent
+    all_venues = venue_rows()
 
     # areas will be sent to view to be shown to user
     areas = []
 
-    for key, venues_in_city in venues_dict.items():
-        # destructure the key
-        city, state = key
-
-        new_area = {
-            "city": city,
-            "state": state,
-            "venues": venues_in_city
-        }
-        areas.append(new_area)
+    for venue in all_venues:
+        # start a new (city, state) group whenever it changes
+        if not areas or (areas[-1]["city"], areas[-1]["state"]) != (venue.city, venue.state):
+            areas.append({
+                "city": venue.city,
+                "state": venue.state,
+                "venues": []
+            })
+        areas[-1]["venues"].append(venue)
 
     return render_template('pages/venues.html', areas=areas)
 
@@ -118,22 +331,11 @@ def venues():
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
     search_term = request.form.get('search_term', '')
-    venues = Venue.query.filter(Venue.name.ilike(f'%{search_term}%')).all()
-    time_now = datetime.utcnow()
-    data = []
-
-    for venue in venues:
-        upcoming_shows = list(filter(lambda show: show.start_time > time_now, venue.shows))
-        cur = {
-            "id": venue.id,
-            "name": venue.name,
-            "num_upcoming_shows": len(upcoming_shows),
-        }
-        data.append(cur)
+    venues = venue_rows(Venue.name.ilike(f'%{search_term}%'))
 
     response = {
         "count": len(venues),
-        "data": data
+        "data": venues
     }
 
     return render_template('pages/search_venues.html', results=response,
@@ -142,7 +344,13 @@ def search_venues():
 
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
-    venue = Venue.query.filter_by(id=venue_id).first_or_404()
+    venue = Venue.query.filter_by(id=venue_id, deleted_at=None).first_or_404()
+
+    # answer revalidations from the primary key lookup alone
+    etag, last_modified = detail_validators(venue)
+    if is_not_modified(etag, last_modified):
+        return not_modified(etag, last_modified)
+
     time_now = datetime.utcnow()
 
     """
@@ -221,7 +429,7 @@ def show_venue(venue_id):
         "past_shows_count": len(past_shows),
         "upcoming_shows_count": len(upcoming_shows),
     }
-    return render_template('pages/show_venue.html', venue=data)
+    return with_validators(render_template('pages/show_venue.html', venue=data), etag, last_modified)
 
 
 #  Create Venue
@@ -242,20 +450,32 @@ def create_venue_submission():
         flash('error validating venue form ' + str(venue_form.errors))
         return render_template('pages/home.html')
 
-    try:
+    def insert_venue():
         venue = Venue()
         venue_form.populate_obj(venue)
+        db.session.add(venue)
+        # the event needs the new id
+        db.session.flush()
+        record(event('venue', 'created', venue.id, {"name": venue.name, "city": venue.city, "state": venue.state}))
+        return venue
 
+    try:
         # try to insert into database
-        db.session.add(venue)
-        db.session.commit()
+        venue = run_in_transaction(insert_venue)
+        venue_index.add(venue.id, venue.name)
 
         # on successful db insert, flash success
         flash('Venue ' + request.form['name'] + ' was successfully listed!')
+    except IntegrityError as e:
+        if not is_duplicate(e):
+            print(sys.exc_info())
+            flash('An error occurred. Venue ' + request.form['name'] + ' could not be listed.')
+            return render_template('pages/home.html')
+        flash('Venue ' + request.form['name'] + ' is already listed in ' + request.form['city'] + '.')
+        abort(409)
     except SQLAlchemyError:
         # source: https://stackoverflow.com/questions/2193670/catching-sqlalchemy-exceptions/4430982
         # unsuccessful db insert, flash an error instead.
-        db.session.rollback()
         print(sys.exc_info())
         flash('An error occurred. Venue ' + request.form['name'] + ' could not be listed.')
     finally:
@@ -269,17 +489,37 @@ def delete_venue(venue_id):
     # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
     # clicking that button delete it from the db then redirect the user to the homepage
     venue_name = ''
-    try:
-        venue = Venue.query.get(venue_id)
+
+    def remove_venue():
+        nonlocal venue_name
+        venue = Venue.query.filter_by(id=venue_id, deleted_at=None).first_or_404()
         venue_name = venue.name
-        db.session.delete(venue)
-        db.session.commit()
+
+        # only look as far as the threshold instead of counting every show
+        large_history = db.session.query(Show.id).filter(Show.venue_id == venue.id). \
+            offset(app.config['PURGE_SYNC_MAX_SHOWS']).limit(1).first() is not None
+
+        # the artists' pages lose these shows
+        touch(Artist, select([Show.artist_id]).where(Show.venue_id == venue.id))
+        if large_history:
+            # hide it now and delete its shows in small chunks outside the request
+            venue.deleted_at = datetime.utcnow()
+        else:
+            # the database cascade removes the shows, see Venue.shows
+            db.session.delete(venue)
+        # consumers drop the venue's shows along with it
+        record(event('venue', 'deleted', venue.id))
+        return large_history
+
+    try:
+        if run_in_transaction(remove_venue):
+            purge_in_background(app, int(venue_id))
+        venue_index.remove(int(venue_id))
 
         # on successful db delete, flash success
         flash('Venue ' + venue_name + ' was successfully deleted!')
     except SQLAlchemyError:
         # unsuccessful db delete, flash an error instead.
-        db.session.rollback()
         print(sys.exc_info())
         flash('An error occurred. Venue ' + venue_name + ' could not be deleted.')
     finally:
@@ -292,29 +532,19 @@ def delete_venue(venue_id):
 #  ----------------------------------------------------------------
 @app.route('/artists')
 def artists():
-    data = Artist.query.all()
+    # the page only prints id and name, skip building Artist instances
+    data = db.session.execute(select([Artist.id, Artist.name]).order_by(Artist.id)).fetchall()
     return render_template('pages/artists.html', artists=data)
 
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
     search_term = request.form.get('search_term', '')
-    artists = Artist.query.filter(Artist.name.ilike(f'%{search_term}%')).all()
-    time_now = datetime.utcnow()
-    data = []
-
-    for artist in artists:
-        upcoming_shows = list(filter(lambda show: show.start_time > time_now, artist.shows))
-        cur = {
-            "id": artist.id,
-            "name": artist.name,
-            "num_upcoming_shows": len(upcoming_shows),
-        }
-        data.append(cur)
+    artists = artist_rows(Artist.name.ilike(f'%{search_term}%'))
 
     response = {
         "count": len(artists),
-        "data": data
+        "data": artists
     }
 
     return render_template('pages/search_artists.html', results=response,
@@ -323,7 +553,12 @@ def search_artists():
 
 @app.route('/artists/<int:artist_id>')
 def show_artist(artist_id):
-    artist = Artist.query.get(artist_id)
+    artist = Artist.query.get_or_404(artist_id)
+
+    etag, last_modified = detail_validators(artist)
+    if is_not_modified(etag, last_modified):
+        return not_modified(etag, last_modified)
+
     time_now = datetime.utcnow()
 
     # equivalent postgres code
@@ -339,10 +574,11 @@ def show_artist(artist_id):
         artist.id = %(id_1)s AND show.start_time < %(start_time_1)s
     """
 
-    past_shows = db.session.query(Show).join(Artist).join(Venue).filter(Artist.id == artist_id,
-                                                                        Show.start_time < time_now).all()
-    upcoming_shows = db.session.query(Show).join(Artist).join(Venue).filter(Artist.id == artist_id,
-                                                                            Show.start_time > time_now).all()
+    # contains_eager fills show.venue from the join so the loops below don't lazy load it
+    past_shows = db.session.query(Show).join(Artist).join(Venue).options(contains_eager(Show.venue)). \
+        filter(Artist.id == artist_id, Show.start_time < time_now, Venue.deleted_at.is_(None)).all()
+    upcoming_shows = db.session.query(Show).join(Artist).join(Venue).options(contains_eager(Show.venue)). \
+        filter(Artist.id == artist_id, Show.start_time > time_now, Venue.deleted_at.is_(None)).all()
 
     past_shows_formatted = []
     for show in past_shows:
@@ -380,15 +616,16 @@ def show_artist(artist_id):
         "past_shows_count": len(past_shows),
         "upcoming_shows_count": len(upcoming_shows),
     }
-    return render_template('pages/show_artist.html', artist=data)
+    return with_validators(render_template('pages/show_artist.html', artist=data), etag, last_modified)
 
 
 #  Update
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
-    form = ArtistForm()
-    artist = Artist.query.get(artist_id)
+    artist = Artist.query.get_or_404(artist_id)
+    # prefill the form, the page diffs against these values to find changed fields
+    form = ArtistForm(obj=artist)
     return render_template('forms/edit_artist.html', form=form, artist=artist)
 
 
@@ -404,20 +641,27 @@ def edit_artist_submission(artist_id):
         return render_template('pages/home.html')
 
     try:
-        # get artist from database
-        artist = Artist.query.get(artist_id)
-
-        # update attributes
-        artist_form.populate_obj(artist)
+        # update only the changed attributes, guarded by the version the form was rendered with
+        values = changed_values(artist_form)
+        version = request.form.get('version', type=int)
+        run_in_transaction(lambda: update_versioned(Artist, artist_id, version, values))
 
-        # commit
-        db.session.commit()
+        if 'name' in values:
+            artist_index.add(artist_id, values['name'])
 
         # on successful db edit, flash success
-        flash('Artist ' + artist.name + ' was successfully edited!')
+        flash('Artist ' + request.form['name'] + ' was successfully edited!')
+    except IntegrityError as e:
+        if not is_duplicate(e):
+            print(sys.exc_info())
+            flash('An error occurred. Artist ' + request.form.get('name') + ' could not be edited.')
+            return redirect(url_for('show_artist', artist_id=artist_id))
+        flash('Another artist named ' + request.form['name'] + ' is already listed in ' + request.form['city'] + '.')
+        if unmerged_duplicate(Artist, artist_id):
+            flash('This artist duplicates that listing, the two have to be merged before it can be edited.')
+        abort(409)
     except SQLAlchemyError:
         # unsuccessful db edit, flash an error instead.
-        db.session.rollback()
         print(sys.exc_info())
         flash('An error occurred. Artist ' + request.form.get('name') + ' could not be edited.')
     finally:
@@ -428,8 +672,8 @@ def edit_artist_submission(artist_id):
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
-    form = VenueForm()
-    venue = Venue.query.get(venue_id)
+    venue = Venue.query.filter_by(id=venue_id, deleted_at=None).first_or_404()
+    form = VenueForm(obj=venue)
     return render_template('forms/edit_venue.html', form=form, venue=venue)
 
 
@@ -445,19 +689,27 @@ def edit_venue_submission(venue_id):
         return render_template('pages/home.html')
 
     try:
-        venue = Venue.query.get(venue_id)
-        venue_form.populate_obj(venue)
+        values = changed_values(venue_form)
+        version = request.form.get('version', type=int)
+        run_in_transaction(lambda: update_versioned(Venue, venue_id, version, values))
 
-        # try to insert into database
-        db.session.add(venue)
-        db.session.commit()
+        if 'name' in values:
+            venue_index.add(venue_id, values['name'])
 
         # on successful db insert, flash success
         flash('Venue ' + request.form['name'] + ' was successfully edited!')
+    except IntegrityError as e:
+        if not is_duplicate(e):
+            print(sys.exc_info())
+            flash('An error occurred. Venue ' + request.form['name'] + ' could not be edited.')
+            return redirect(url_for('show_venue', venue_id=venue_id))
+        flash('Another venue named ' + request.form['name'] + ' is already listed in ' + request.form['city'] + '.')
+        if unmerged_duplicate(Venue, venue_id):
+            flash('This venue duplicates that listing, the two have to be merged before it can be edited.')
+        abort(409)
     except SQLAlchemyError:
         # source: https://stackoverflow.com/questions/2193670/catching-sqlalchemy-exceptions/4430982
         # unsuccessful db insert, flash an error instead.
-        db.session.rollback()
         print(sys.exc_info())
         flash('An error occurred. Venue ' + request.form['name'] + ' could not be edited.')
     finally:
@@ -484,20 +736,31 @@ def create_artist_submission():
         flash('error validating artist form ' + str(artist_form.errors))
         return render_template('pages/home.html')
 
-    try:
+    def insert_artist():
         # create a new artist
         artist = Artist()
         artist_form.populate_obj(artist)
+        db.session.add(artist)
+        db.session.flush()
+        record(event('artist', 'created', artist.id, {"name": artist.name, "city": artist.city, "state": artist.state}))
+        return artist
 
+    try:
         # try to insert into database
-        db.session.add(artist)
-        db.session.commit()
+        artist = run_in_transaction(insert_artist)
+        artist_index.add(artist.id, artist.name)
 
         # on successful db insert, flash success
         flash('Artist ' + request.form['name'] + ' was successfully listed!')
+    except IntegrityError as e:
+        if not is_duplicate(e):
+            print(sys.exc_info())
+            flash('An error occurred. Artist ' + request.form['name'] + ' could not be listed.', category='error')
+            return render_template('pages/home.html')
+        flash('Artist ' + request.form['name'] + ' is already listed in ' + request.form['city'] + '.')
+        abort(409)
     except SQLAlchemyError:
         # unsuccessful db insert, flash an error instead.
-        db.session.rollback()
         print(sys.exc_info())
         flash('An error occurred. Artist ' + request.form['name'] + ' could not be listed.', category='error')
     finally:
@@ -511,18 +774,19 @@ def create_artist_submission():
 
 @app.route('/shows')
 def shows():
-    all_shows = Show.query.all()
-    data = []
-    for show in all_shows:
-        cur = {
-            "venue_id": show.venue.id,
-            "venue_name": show.venue.name,
-            "artist_id": show.artist.id,
-            "artist_name": show.artist.name,
-            "artist_image_link": show.artist.image_link,
-            "start_time": str(show.start_time)
-        }
-        data.append(cur)
+    data = db.session.execute(
+        select([
+            Show.venue_id,
+            Venue.name.label('venue_name'),
+            Show.artist_id,
+            Artist.name.label('artist_name'),
+            Artist.image_link.label('artist_image_link'),
+            Show.start_time
+        ]).
+        select_from(Show.__table__.join(Venue.__table__).join(Artist.__table__)).
+        where(Venue.deleted_at.is_(None)).
+        order_by(Show.start_time)
+    ).fetchall()
     return render_template('pages/shows.html', shows=data)
 
 
@@ -536,24 +800,57 @@ def create_shows():
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
     # called to create new shows in the db, upon submitting new show listing form
+    show_form = ShowForm(request.form, meta={"csrf": False})
+
+    # start_time is parsed leniently instead of by the form, only the duration goes through it
+    if not show_form.duration.validate(show_form):
+        flash('error validating show form ' + str({"duration": show_form.duration.errors}))
+        abort(400)
+    try:
+        start_time = dateutil.parser.parse(request.form.get('start_time', ''))
+    except (ValueError, OverflowError):
+        flash('error validating show form ' + str({"start_time": ['Not a valid datetime value']}))
+        abort(400)
 
     try:
         # get data from post request
         artist_id = request.form['artist_id']
         venue_id = request.form['venue_id']
-        start_time = request.form['start_time']
-
-        show = Show(venue_id=venue_id, artist_id=artist_id, start_time=format_datetime(start_time))
+        duration = show_duration(show_form.duration.data)
 
         # try to insert into database
-        db.session.add(show)
-        db.session.commit()
+        def insert_show():
+            # touching the venue first locks it against a concurrent delete,
+            # and tells a deleted one apart from a listed one
+            touched = db.session.execute(
+                Venue.__table__.update().where((Venue.id == venue_id) & Venue.deleted_at.is_(None)).
+                values(updated_date=datetime.utcnow())
+            )
+            if touched.rowcount == 0:
+                flash('The venue is not listed anymore.')
+                abort(400)
+            show = Show(venue_id=venue_id, artist_id=artist_id, start_time=start_time, duration=duration)
+            db.session.add(show)
+            db.session.flush()
+            record(event('show', 'created', show.id, {
+                "venue_id": show.venue_id, "artist_id": show.artist_id, "start_time": start_time.isoformat()
+            }))
+            touch(Artist, [artist_id])
+
+        run_in_transaction(insert_show)
 
         # on successful db insert, flash success
         flash('Show was successfully listed!')
+    except IntegrityError as e:
+        if not is_booking_conflict(e):
+            print(sys.exc_info())
+            flash('An error occurred. Show could not be listed.')
+            return render_template('pages/home.html')
+        # the exclusion constraints found an overlapping show
+        flash('The venue or the artist already has a show booked at that time.')
+        abort(409)
     except SQLAlchemyError:
         # unsuccessful db insert, flash an error instead.
-        db.session.rollback()
         print(sys.exc_info())
         flash('An error occurred. Show could not be listed.')
     finally:
@@ -562,6 +859,286 @@ def create_show_submission():
     return render_template('pages/home.html')
 
 
+#  Calendar
+#  ----------------------------------------------------------------
+
+def naive_utc(value):
+    # start times are stored as naive utc, values with an offset are converted
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def calendar_window():
+    # [from, to) window from the query string, defaults to the next 30 days
+    try:
+        start = naive_utc(dateutil.parser.parse(request.args['from'])) if 'from' in request.args else datetime.utcnow()
+        end = naive_utc(dateutil.parser.parse(request.args['to'])) if 'to' in request.args else start + timedelta(days=30)
+    except (ValueError, OverflowError):
+        abort(400)
+
+    if end <= start or end - start > timedelta(days=app.config['CALENDAR_MAX_DAYS']):
+        abort(400)
+
+    return start, end
+
+
+def calendar_query():
+    return db.session.query(
+        Show.id,
+        Show.start_time,
+        Show.artist_id,
+        Artist.name.label('artist_name'),
+        Show.venue_id,
+        Venue.name.label('venue_name'),
+        Show.duration
+    ).join(Artist, Artist.id == Show.artist_id).join(Venue, Venue.id == Show.venue_id). \
+        filter(Venue.deleted_at.is_(None))
+
+
+def calendar_response(query):
+    start, end = calendar_window()
+    limit = app.config['CALENDAR_MAX_SHOWS']
+
+    # fetch one extra row to know whether the window was cut short
+    rows = query.filter(Show.start_time >= start, Show.start_time < end). \
+        order_by(Show.start_time, Show.id).limit(limit + 1).all()
+
+    shows = [{
+        "id": row.id,
+        "start_time": row.start_time.isoformat(),
+        "artist_id": row.artist_id,
+        "artist_name": row.artist_name,
+        "venue_id": row.venue_id,
+        "venue_name": row.venue_name
+    } for row in rows[:limit]]
+
+    return jsonify({
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "shows": shows,
+        # clients continue from the last start_time to page through the window
+        "truncated": len(rows) > limit
+    })
+
+
+@app.route('/calendar')
+def calendar():
+    query = calendar_query()
+    if 'city' in request.args:
+        query = query.filter(Venue.city == request.args['city'])
+    if 'state' in request.args:
+        query = query.filter(Venue.state == request.args['state'])
+    return calendar_response(query)
+
+
+@app.route('/venues/<int:venue_id>/calendar')
+def venue_calendar(venue_id):
+    return calendar_response(calendar_query().filter(Show.venue_id == venue_id))
+
+
+@app.route('/artists/<int:artist_id>/calendar')
+def artist_calendar(artist_id):
+    return calendar_response(calendar_query().filter(Show.artist_id == artist_id))
+
+
+def ical_feed(name, column, id):
+    # cheap fingerprint of the feed: any new, removed or moved show changes
+    # it, and so does renaming or deleting a venue or artist the events name
+    count, last_id, last_start, venues_updated, artists_updated = db.session.query(
+        func.count(Show.id), func.max(Show.id), func.max(Show.start_time),
+        func.max(Venue.updated_date), func.max(Artist.updated_date)
+    ).join(Artist, Artist.id == Show.artist_id).join(Venue, Venue.id == Show.venue_id). \
+        filter(Venue.deleted_at.is_(None), column == id).one()
+    etag = f'{id}-{count}-{last_id}-{last_start}-{venues_updated}-{artists_updated}'
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    since = datetime.utcnow() - timedelta(days=app.config['ICAL_HISTORY_DAYS'])
+    shows = calendar_query().filter(column == id, Show.start_time >= since). \
+        order_by(Show.start_time).yield_per(500)
+
+    response = Response(stream_with_context(stream_calendar(name, shows, request.host)),
+                        mimetype='text/calendar')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.route('/venues/<int:venue_id>/shows.ics')
+def venue_ical(venue_id):
+    venue = db.session.query(Venue.name).filter(Venue.id == venue_id, Venue.deleted_at.is_(None)).first_or_404()
+    return ical_feed(venue.name, Show.venue_id, venue_id)
+
+
+@app.route('/artists/<int:artist_id>/shows.ics')
+def artist_ical(artist_id):
+    artist = db.session.query(Artist.name).filter(Artist.id == artist_id).first_or_404()
+    return ical_feed(artist.name, Show.artist_id, artist_id)
+
+
+#  Matchmaking
+#  ----------------------------------------------------------------
+
+@app.route('/venues/<int:venue_id>/matches')
+def venue_matches(venue_id):
+    venue = db.session.query(Venue.state, Venue.genres). \
+        filter(Venue.id == venue_id, Venue.deleted_at.is_(None)).first_or_404()
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    return jsonify(matching_artists(venue, limit))
+
+
+@app.route('/artists/<int:artist_id>/matches')
+def artist_matches(artist_id):
+    artist = db.session.query(Artist.state, Artist.genres).filter(Artist.id == artist_id).first_or_404()
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    return jsonify(matching_venues(artist, limit))
+
+
+#  Images
+#  ----------------------------------------------------------------
+
+@app.route('/images/<size>/<token>')
+def image(size, token):
+    url = image_proxy.source_url(token)
+    if size not in THUMBNAIL_SIZES or url is None:
+        abort(404)
+
+    try:
+        thumb, digest = image_proxy.thumbnail(url, size)
+    except ImageUnavailable as e:
+        # not cached, the next request tries again
+        app.logger.warning('%s', e)
+        return redirect(url)
+
+    response = send_file(thumb, mimetype='image/jpeg', add_etags=False)
+    response.set_etag(f'{digest}-{size}')
+    # the token pins the source url, so the response never changes
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response.make_conditional(request)
+
+
+#  Sitemaps
+#  ----------------------------------------------------------------
+
+@app.route('/sitemap.xml')
+def sitemap_index():
+    # written by `flask sitemaps`, no database work here
+    return send_from_directory(app.config['SITEMAP_DIR'], INDEX, mimetype='application/xml', cache_timeout=3600)
+
+
+@app.route('/sitemaps/<filename>')
+def sitemap(filename):
+    if not is_shard(filename):
+        abort(404)
+    return send_from_directory(app.config['SITEMAP_DIR'], filename, mimetype='application/gzip', cache_timeout=3600)
+
+
+#  Autocomplete
+#  ----------------------------------------------------------------
+
+@app.route('/autocomplete/artists')
+def autocomplete_artists():
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    return jsonify(artist_index.search(request.args.get('q', ''), limit))
+
+
+@app.route('/autocomplete/venues')
+def autocomplete_venues():
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    return jsonify(venue_index.search(request.args.get('q', ''), limit))
+
+
+@app.route('/shows/batch', methods=['POST'])
+def create_shows_batch():
+    # schedule a whole tour in one request
+    # body: {"shows": [{"artist_id": 1, "venue_id": 2, "start_time": "2021-05-01 20:00"}, ...]}
+    payload = request.get_json(silent=True)
+    # any valid json parses, only an object can hold the shows
+    rows = payload.get('shows') if isinstance(payload, dict) else None
+
+    if not isinstance(rows, list):
+        return jsonify({"error": "expected a list of shows"}), 400
+
+    if len(rows) > app.config['MAX_BATCH_SHOWS']:
+        return jsonify({"error": f"at most {app.config['MAX_BATCH_SHOWS']} shows per request"}), 400
+
+    errors = []
+    candidates = []
+
+    # validate the shape of each row before touching the database
+    for index, row in enumerate(rows):
+        try:
+            candidates.append((index, {
+                "artist_id": int(row['artist_id']),
+                "venue_id": int(row['venue_id']),
+                "start_time": dateutil.parser.parse(row['start_time']),
+                "duration": show_duration(row.get('duration'))
+            }))
+        except (TypeError, KeyError, ValueError, OverflowError) as e:
+            errors.append({"index": index, "error": f"invalid show: {e!r}"})
+
+    artist_ids = {show['artist_id'] for _, show in candidates}
+    venue_ids = {show['venue_id'] for _, show in candidates}
+
+    def insert_shows():
+        # check every referenced artist and venue in a single round trip
+        existing = db.session.execute(union_all(
+            select([literal('artist').label('kind'), Artist.id]).where(Artist.id.in_(artist_ids)),
+            select([literal('venue').label('kind'), Venue.id]).where(Venue.id.in_(venue_ids) & Venue.deleted_at.is_(None))
+        )).fetchall()
+        found = {(kind, id) for kind, id in existing}
+
+        valid = []
+        missing = []
+        for index, show in candidates:
+            if ('artist', show['artist_id']) not in found:
+                missing.append({"index": index, "error": f"artist {show['artist_id']} does not exist"})
+            elif ('venue', show['venue_id']) not in found:
+                missing.append({"index": index, "error": f"venue {show['venue_id']} does not exist"})
+            else:
+                valid.append(show)
+
+        if valid:
+            if is_postgresql():
+                # a single multi-row insert, returning the new ids for the outbox events
+                inserted = db.session.execute(
+                    Show.__table__.insert().values(valid).
+                    returning(Show.id, Show.venue_id, Show.artist_id, Show.start_time)
+                ).fetchall()
+            else:
+                # no RETURNING for sqlite here, insert them one at a time
+                inserted = [dict(show, id=db.session.execute(Show.__table__.insert(), show).inserted_primary_key[0])
+                            for show in valid]
+            record(*(event('show', 'created', show['id'], {
+                "venue_id": show['venue_id'], "artist_id": show['artist_id'], "start_time": show['start_time'].isoformat()
+            }) for show in inserted))
+            touch(Venue, {show['venue_id'] for show in valid})
+            touch(Artist, {show['artist_id'] for show in valid})
+        return valid, missing
+
+    try:
+        valid, missing = run_in_transaction(insert_shows)
+        errors.extend(missing)
+    except IntegrityError as e:
+        if not is_booking_conflict(e):
+            print(sys.exc_info())
+            return jsonify({"inserted": 0, "errors": errors, "error": "shows could not be listed"}), 500
+        # the batch is one transaction, a single overlap rejects all of it
+        return jsonify({"inserted": 0, "errors": errors, "error": "shows overlap existing bookings"}), 409
+    except SQLAlchemyError:
+        print(sys.exc_info())
+        return jsonify({"inserted": 0, "errors": errors, "error": "shows could not be listed"}), 500
+    finally:
+        db.session.close()
+
+    errors.sort(key=lambda error: error['index'])
+    return jsonify({"inserted": len(valid), "errors": errors}), 201 if valid else 400
+
+
 @app.errorhandler(400)
 def bad_request_error(error):
     return render_template('errors/400.html', message='Bad Request'), 400
@@ -592,6 +1169,13 @@ def duplicate_resource_error(error):
     return render_template('errors/409.html', message='Duplicate Resource'), 409
 
 
+@app.errorhandler(429)
+def rate_limited_error(error):
+    response = make_response(render_template('errors/429.html', message='Too Many Requests'), 429)
+    response.headers['Retry-After'] = str(math.ceil(g.get('retry_after', 1)))
+    return response
+
+
 @app.errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
@@ -0,0 +1,134 @@
+import bisect
+import re
+import threading
+import time
+import unicodedata
+
+
+# ----------------------------------------------------------------------------#
+# Prefix index.
+# ----------------------------------------------------------------------------#
+
+def normalize(text):
+    # fold case and accents and squash whitespace so "  Café  Rio" ~ "cafe rio"
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r'\s+', ' ', text.casefold()).strip()
+
+
+class PrefixIndex:
+    """
+    Sorted array of normalized names answering prefix lookups with bisect.
+
+    Every word of a name is indexed as a prefix start, so "blues" finds
+    "The Blues Bar". The index lives in the worker process and is kept up to
+    date by the create/edit/delete handlers of that worker. Changes made
+    through other workers show up once it's reloaded, at most `max_age`
+    seconds after the last load.
+    """
+
+    def __init__(self, loader, max_age=None):
+        # loader returns (id, name) pairs, called on first use and once stale
+        self._loader = loader
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._refreshing = threading.Lock()
+        self._loaded = False
+        self._loaded_at = 0.0
+        self._keys = []
+        self._names = {}
+        # adds and removes made while a reload's snapshot is being read, the
+        # snapshot may predate them so they're applied again to the new index
+        self._pending = None
+
+    def _entries(self, id, name):
+        words = normalize(name).split(' ')
+        return [(' '.join(words[i:]), id) for i in range(len(words)) if words[i]]
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            if self.max_age is None or time.monotonic() - self._loaded_at < self.max_age:
+                return
+            # stale, one request reloads it while the others keep answering from the old one
+            if self._refreshing.acquire(blocking=False):
+                try:
+                    with self._lock:
+                        self._pending = []
+                    self.rebuild(self._loader())
+                finally:
+                    with self._lock:
+                        self._pending = None
+                    self._refreshing.release()
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self.rebuild(self._loader())
+
+    def rebuild(self, rows):
+        keys = []
+        names = {}
+        for id, name in rows:
+            names[id] = name
+            keys.extend(self._entries(id, name))
+        keys.sort()
+
+        with self._lock:
+            self._keys = keys
+            self._names = names
+            self._loaded = True
+            self._loaded_at = time.monotonic()
+            for change, args in self._pending or ():
+                change(*args)
+            self._pending = None
+
+    def add(self, id, name):
+        with self._lock:
+            if not self._loaded:
+                # the first lookup will load it from the database anyway
+                return
+            if self._pending is not None:
+                self._pending.append((self._add, (id, name)))
+            self._add(id, name)
+
+    def _add(self, id, name):
+        self._remove(id)
+        self._names[id] = name
+        for entry in self._entries(id, name):
+            bisect.insort(self._keys, entry)
+
+    def remove(self, id):
+        with self._lock:
+            if self._loaded:
+                if self._pending is not None:
+                    self._pending.append((self._remove, (id,)))
+                self._remove(id)
+
+    def _remove(self, id):
+        name = self._names.pop(id, None)
+        if name is None:
+            return
+        for entry in self._entries(id, name):
+            position = bisect.bisect_left(self._keys, entry)
+            if position < len(self._keys) and self._keys[position] == entry:
+                del self._keys[position]
+
+    def search(self, prefix, limit=10):
+        self._ensure_loaded()
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        results = []
+        seen = set()
+        with self._lock:
+            position = bisect.bisect_left(self._keys, (prefix,))
+            while position < len(self._keys) and len(results) < limit:
+                key, id = self._keys[position]
+                if not key.startswith(prefix):
+                    break
+                if id not in seen:
+                    seen.add(id)
+                    results.append({"id": id, "name": self._names[id]})
+                position += 1
+        return results
@@ -0,0 +1,82 @@
+import gc
+import time
+import tracemalloc
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+from models import db, Venue, Artist, Show
+
+# ----------------------------------------------------------------------------#
+# Read path benchmarks.
+# ----------------------------------------------------------------------------#
+
+# name -> (orm path, core path), each takes a row limit and returns a list.
+# The orm paths are what artists() and shows() used to do.
+READ_PATHS = {
+    'artists': (
+        lambda limit: [(artist.id, artist.name) for artist in Artist.query.limit(limit).all()],
+        lambda limit: db.session.execute(select([Artist.id, Artist.name]).limit(limit)).fetchall(),
+    ),
+    'shows': (
+        lambda limit: [{
+            "venue_id": show.venue.id,
+            "venue_name": show.venue.name,
+            "artist_id": show.artist.id,
+            "artist_name": show.artist.name,
+            "artist_image_link": show.artist.image_link,
+            "start_time": str(show.start_time)
+        } for show in Show.query.options(joinedload(Show.venue), joinedload(Show.artist)).limit(limit).all()],
+        lambda limit: db.session.execute(
+            select([
+                Show.venue_id,
+                Venue.name.label('venue_name'),
+                Show.artist_id,
+                Artist.name.label('artist_name'),
+                Artist.image_link.label('artist_image_link'),
+                Show.start_time
+            ]).select_from(Show.__table__.join(Venue.__table__).join(Artist.__table__)).limit(limit)
+        ).fetchall(),
+    ),
+}
+
+
+def measure(path, limit):
+    # time and memory are measured in separate runs, tracemalloc slows things down
+    db.session.remove()
+    gc.collect()
+    started = time.perf_counter()
+    rows = path(limit)
+    elapsed = time.perf_counter() - started
+    count = len(rows)
+    del rows
+
+    db.session.remove()
+    gc.collect()
+    tracemalloc.start()
+    rows = path(limit)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del rows
+    db.session.remove()
+
+    return count, elapsed, peak
+
+
+@click.command('bench-read-paths')
+@click.option('--rows', default=100000, show_default=True, help='Rows to read per path.')
+@with_appcontext
+def bench_read_paths_command(rows):
+    """Compare ORM and Core read paths of the list pages, seed with `flask seed` first."""
+    for name, (orm_path, core_path) in READ_PATHS.items():
+        for label, path in (('orm', orm_path), ('core', core_path)):
+            count, elapsed, peak = measure(path, rows)
+            if not count:
+                click.echo(f'{name:8} {label:5} no rows')
+                continue
+            scale = 100000 / count
+            click.echo(f'{name:8} {label:5} {count:7} rows  '
+                       f'{elapsed * scale * 1000:9.1f}ms per 100k  '
+                       f'{peak * scale / 1024 / 1024:8.1f}MiB peak per 100k')
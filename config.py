@@ -1,22 +1,239 @@
 import os
+import secrets
+import threading
 
 
 class AppConfig:
-    SECRET_KEY = os.urandom(32)
+    # Signs the session cookie, every worker and node has to use the same key.
+    # Set SECRET_KEY, or SECRET_KEY_FILE pointing at a file holding it.
+    SECRET_KEY = os.environ.get('SECRET_KEY')
+    SECRET_KEY_FILE = os.environ.get('SECRET_KEY_FILE')
     # Grabs the folder where the script runs.
     basedir = os.path.abspath(os.path.dirname(__file__))
 
     # Enable debug mode.
-    DEBUG = True
+    DEBUG = False
+
+    # Compiled templates are shared by all workers through this directory.
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR', os.path.join(basedir, '.jinja_cache'))
+    # Compile every template when the app starts instead of on first use.
+    PRECOMPILE_TEMPLATES = True
+    # Templates only change on deploy outside of development.
+    TEMPLATES_AUTO_RELOAD = False
+
+    # Upper bound on the number of shows accepted by /shows/batch.
+    MAX_BATCH_SHOWS = 5000
+
+    # Autocomplete indexes live in each worker, edits through other workers
+    # show up once the index is reloaded, after at most this many seconds.
+    AUTOCOMPLETE_MAX_AGE = 60
+
+    # Calendar windows are capped in length and in number of shows returned.
+    CALENDAR_MAX_DAYS = 366
+    CALENDAR_MAX_SHOWS = 500
+    # How far back the .ics feeds go.
+    ICAL_HISTORY_DAYS = 30
+
+    # Detail page validators roll over this often (seconds) so that shows
+    # which started in the meantime move from upcoming to past.
+    DETAIL_VALIDATOR_WINDOW = 900
+
+    # Requests are profiled when they carry a header signed with this key
+    # (see `flask profile-token`) or at random with PROFILE_SAMPLE_RATE.
+    PROFILE_SIGNING_KEY = os.environ.get('PROFILE_SIGNING_KEY')
+    PROFILE_TOKEN_MAX_AGE = 3600
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_SAMPLE_INTERVAL = 0.001
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(basedir, 'profiles'))
+    # Only the most recent profiles are kept.
+    PROFILE_MAX_FILES = 200
+
+    # Statements slower than this are logged with their plan, None turns it off.
+    # Every process writes its own SLOW_QUERY_LOG.<pid>, those of exited
+    # processes are pruned down to the newest few.
+    SLOW_QUERY_THRESHOLD_MS = 200
+    SLOW_QUERY_LOG = os.path.join(basedir, 'slow_queries.log')
+    SLOW_QUERY_EXPLAIN = True
+    # Normalized statement -> routes, written by `flask check-query-budgets`
+    # and read by `flask db-report`.
+    STATEMENT_ROUTE_MAP = os.path.join(basedir, 'statement_routes.json')
+
+    # Venues with more shows than this are soft-deleted and purged in the background.
+    PURGE_SYNC_MAX_SHOWS = 1000
+    PURGE_CHUNK_SIZE = 1000
+    PURGE_PAUSE = 0.05
+
+    # Thumbnails of image links are cached here, least recently served first out.
+    IMAGE_CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR', os.path.join(basedir, '.image_cache'))
+    IMAGE_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+    IMAGE_FETCH_TIMEOUT = 5
+    IMAGE_MAX_SOURCE_BYTES = 10 * 1024 * 1024
+    # Signs proxied image urls, they stay cacheable across restarts only if this is set.
+    IMAGE_PROXY_SIGNING_KEY = os.environ.get('IMAGE_PROXY_SIGNING_KEY')
+    # Lets image links point at private addresses, e.g. a local origin in development.
+    IMAGE_PROXY_ALLOW_PRIVATE = os.environ.get('IMAGE_PROXY_ALLOW_PRIVATE') == '1'
+
+    # Per client token buckets, endpoint -> (requests, per seconds). Buckets
+    # live in a memory mapped file shared by the workers on a host, or in
+    # redis when this is a redis:// url. Empty turns rate limiting off.
+    RATE_LIMIT_STORAGE = os.environ.get('RATE_LIMIT_STORAGE', os.path.join(basedir, '.ratelimit'))
+    RATE_LIMITS = {
+        'search_venues': (20, 60),
+        'search_artists': (20, 60),
+        'create_venue_submission': (30, 60),
+        'edit_venue_submission': (30, 60),
+        'delete_venue': (30, 60),
+        'create_artist_submission': (30, 60),
+        'edit_artist_submission': (30, 60),
+        'create_show_submission': (30, 60),
+        'create_shows_batch': (5, 60),
+    }
+
+    # Server-Sent Events feed of new listings served by feed.py, the home page
+    # subscribes to it when set.
+    FEED_URL = os.environ.get('FEED_URL')
+
+    # Sharded, gzipped sitemaps written by `flask sitemaps` and served from here.
+    SITEMAP_DIR = os.environ.get('SITEMAP_DIR', os.path.join(basedir, 'sitemaps'))
+    SITEMAP_BASE_URL = os.environ.get('SITEMAP_BASE_URL')
+    SITEMAP_SHARD_SIZE = 50000
+
+    # Keep sessions in redis instead of the cookie when set, e.g. redis://sessions:6379/0.
+    SESSION_STORE_URL = os.environ.get('SESSION_STORE_URL')
+    SESSION_COOKIE_SAMESITE = 'Lax'
+
+    # Every worker dumps its counters here at most this often (seconds), read
+    # by `flask metrics`. Empty turns the dumps off.
+    METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(basedir, '.metrics'))
+    METRICS_DUMP_INTERVAL = 10
+
+    # Transactions failing for transient reasons (failover, serialization
+    # failure, deadlock) are retried with jittered exponential backoff.
+    DB_RETRY_ATTEMPTS = 3
+    DB_RETRY_BACKOFF = 0.1
+
+
+def engine_options(uri, statement_timeout, lock_timeout):
+    if not uri.startswith('postgres'):
+        # embedded sqlite, Flask-SQLAlchemy already shares one connection
+        # between threads for in memory databases
+        return {}
+    return {
+        # Let psycopg2 batch executemany() inserts into multi-row VALUES statements.
+        'executemany_mode': 'values',
+        # Check connections on checkout so a failover doesn't hand out dead ones.
+        'pool_pre_ping': True,
+        'connect_args': {'options': f'-c statement_timeout={statement_timeout} -c lock_timeout={lock_timeout}'},
+    }
+
+
+def database_uri(default_password=None):
+    # DATABASE_URL wins, e.g. sqlite:// (in memory) or sqlite:///fyyur.db runs
+    # without a postgres server. Otherwise it's put together from DB_* variables
+    if os.environ.get('DATABASE_URL'):
+        return os.environ['DATABASE_URL']
+    password = os.environ.get('DB_PASSWORD', default_password)
+    if password is None:
+        return None
+    username = os.environ.get('DB_USER', 'postgres')
+    host = os.environ.get('DB_HOST', 'localhost:5432')
+    name = os.environ.get('DB_NAME', 'fyyur')
+    return f'postgres://{username}:{password}@{host}/{name}'
 
 
 # Connect to the database
 class DatabaseURI:
-    # Just change the names of your database and crendtials and all to connect to your local system
-    DATABASE_NAME = "fyyur"
-    username = 'postgres'
-    password = 'changeme'
-    url = 'localhost:5432'
-    db_dialect = 'postgres'
-    SQLALCHEMY_DATABASE_URI = f"{db_dialect}://{username}:{password}@{url}/{DATABASE_NAME}"
+    SQLALCHEMY_DATABASE_URI = None
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Postgres cancels statements / lock waits running longer than this (ms).
+    STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 5000))
+    LOCK_TIMEOUT = int(os.environ.get('DB_LOCK_TIMEOUT', 2000))
+    # Migrations give up on locks they can't get quickly, the statement timeout
+    # is off as batched backfills and concurrent builds keep statements short.
+    MIGRATION_LOCK_TIMEOUT = os.environ.get('MIGRATION_LOCK_TIMEOUT', '5s')
+    MIGRATION_STATEMENT_TIMEOUT = os.environ.get('MIGRATION_STATEMENT_TIMEOUT', '0')
+
+
+# ----------------------------------------------------------------------------#
+# Profiles, picked with FYYUR_ENV (or FLASK_ENV), production when neither is set.
+# ----------------------------------------------------------------------------#
+
+class DevelopmentConfig(DatabaseURI, AppConfig):
+    DEBUG = True
+    TEMPLATES_AUTO_RELOAD = True
+    # generated on first start and shared by the local workers
+    SECRET_KEY_FILE = os.environ.get('SECRET_KEY_FILE', os.path.join(AppConfig.basedir, '.secret_key'))
+    # the local database everyone sets up for the project
+    SQLALCHEMY_DATABASE_URI = database_uri(default_password='changeme')
+
+
+class TestConfig(DatabaseURI, AppConfig):
+    TESTING = True
+    SECRET_KEY = 'test'
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite://')
+    PRECOMPILE_TEMPLATES = False
+    RATE_LIMIT_STORAGE = ''
+    SLOW_QUERY_THRESHOLD_MS = None
+    METRICS_DIR = None
+
+
+class ProductionConfig(DatabaseURI, AppConfig):
+    # no defaults, credentials only ever come from the environment
+    SQLALCHEMY_DATABASE_URI = database_uri()
+    SESSION_COOKIE_SECURE = True
+
+
+PROFILES = {
+    'development': DevelopmentConfig,
+    'test': TestConfig,
+    'production': ProductionConfig,
+}
+
+
+def read_secret_key(path, create=False):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        if not create:
+            raise
+
+    # written in full to a temporary file and linked into place, which fails
+    # if it exists: workers starting at the same time never read a partial key
+    # and all end up with the first one
+    key = secrets.token_hex(32)
+    temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with os.fdopen(os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+        f.write(key)
+    try:
+        os.link(temporary, path)
+    except FileExistsError:
+        return read_secret_key(path)
+    finally:
+        os.remove(temporary)
+    return key
+
+
+def load_config(app, profile=None):
+    """Configure `app` from the development, test or production profile."""
+    # never fall back to the debug profile and its default credentials, a
+    # server started without the variable has to be configured for production
+    profile = profile or os.environ.get('FYYUR_ENV') or os.environ.get('FLASK_ENV') or 'production'
+    if profile not in PROFILES:
+        raise RuntimeError(f'unknown profile {profile!r}, expected one of {", ".join(PROFILES)}')
+
+    config = app.config
+    config.from_object(PROFILES[profile])
+    config['CONFIG_PROFILE'] = profile
+
+    if not config['SECRET_KEY'] and config['SECRET_KEY_FILE']:
+        config['SECRET_KEY'] = read_secret_key(config['SECRET_KEY_FILE'], create=profile == 'development')
+
+    missing = [name for name in ('SECRET_KEY', 'SQLALCHEMY_DATABASE_URI') if not config[name]]
+    if missing:
+        raise RuntimeError(f'{" and ".join(missing)} must be set for the {profile} profile, '
+                           f'see config.py for the environment variables')
+
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+        config['SQLALCHEMY_DATABASE_URI'], config['STATEMENT_TIMEOUT'], config['LOCK_TIMEOUT']
+    )
@@ -0,0 +1,173 @@
+import json
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, text
+
+from models import db, is_postgresql
+from slowlog import normalize_statement, read_slow_log
+
+# ----------------------------------------------------------------------------#
+# Database report.
+# ----------------------------------------------------------------------------#
+
+TABLES = ('venue', 'artist', 'show')
+
+TABLE_STATS = text("""
+    SELECT relname AS name, n_live_tup, n_dead_tup, seq_scan, seq_tup_read, coalesce(idx_scan, 0) AS idx_scan,
+           pg_relation_size(relid) AS table_bytes, pg_indexes_size(relid) AS index_bytes,
+           last_autovacuum, last_autoanalyze
+    FROM pg_stat_user_tables
+    WHERE relname IN :tables
+    ORDER BY relname
+""").bindparams(bindparam('tables', expanding=True))
+
+# Expected heap size from the planner's row count and average column widths
+# (tuple header and line pointer included), compared to the pages actually
+# used. Only as good as the last ANALYZE, but needs no extension.
+TABLE_BLOAT = text("""
+    SELECT c.relname AS name,
+           c.relpages::bigint * current_setting('block_size')::int AS bytes,
+           (c.reltuples * (28 + coalesce(sum(s.avg_width), 0)))::bigint AS expected_bytes
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    LEFT JOIN pg_stats s ON s.schemaname = n.nspname AND s.tablename = c.relname
+    WHERE c.relname IN :tables AND c.relkind = 'r' AND n.nspname = current_schema()
+    GROUP BY c.relname, c.relpages, c.reltuples
+""").bindparams(bindparam('tables', expanding=True))
+
+INDEX_STATS = text("""
+    SELECT s.relname AS table_name, s.indexrelname AS name, s.idx_scan, s.idx_tup_read,
+           pg_relation_size(s.indexrelid) AS bytes, i.indisunique OR i.indisprimary AS enforces
+    FROM pg_stat_user_indexes s
+    JOIN pg_index i ON i.indexrelid = s.indexrelid
+    WHERE s.relname IN :tables
+    ORDER BY s.relname, bytes DESC
+""").bindparams(bindparam('tables', expanding=True))
+
+STATS_RESET = text("SELECT stats_reset FROM pg_stat_database WHERE datname = current_database()")
+
+HAS_STATEMENTS = text("SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'")
+
+# total_time / mean_time were renamed in postgres 13
+TOP_STATEMENTS = """
+    SELECT calls, {total} AS total_ms, {mean} AS mean_ms, rows,
+           shared_blks_hit, shared_blks_read, query
+    FROM pg_stat_statements
+    WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+      AND query ~* :pattern
+    ORDER BY total_ms DESC
+    LIMIT :limit
+"""
+
+
+def size(value):
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if abs(value) < 1024 or unit == 'GB':
+            return f'{value:.0f}{unit}' if unit == 'B' else f'{value:.1f}{unit}'
+        value /= 1024
+
+
+def ratio(part, whole):
+    return part / whole if whole else 0.0
+
+
+def load_route_map(path):
+    # recorded by `flask check-query-budgets`, missing before its first run
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def statement_routes(statement, route_map, slow_log):
+    key = normalize_statement(statement)
+    routes = set(route_map.get(key, ()))
+    if key in slow_log:
+        # routes seen issuing it slowly in production
+        routes.update(route for route in slow_log[key]['routes'] if route != '-')
+    return sorted(routes)
+
+
+def report_tables(connection):
+    bloat = {row.name: row for row in connection.execute(TABLE_BLOAT, {"tables": TABLES})}
+
+    click.echo('Tables')
+    click.echo(f"  {'table':8} {'rows':>10} {'dead':>8} {'heap':>9} {'indexes':>9} {'bloat':>9} "
+               f"{'seq scans':>10} {'seq ratio':>9}  last autovacuum")
+    for table in connection.execute(TABLE_STATS, {"tables": TABLES}):
+        estimate = bloat.get(table.name)
+        wasted = max(0, estimate.bytes - estimate.expected_bytes) if estimate else 0
+        scans = ratio(table.seq_scan, table.seq_scan + table.idx_scan)
+        click.echo(f'  {table.name:8} {table.n_live_tup:10} {table.n_dead_tup:8} {size(table.table_bytes):>9} '
+                   f'{size(table.index_bytes):>9} {size(wasted):>9} {table.seq_scan:10} {scans:9.1%}  '
+                   f'{table.last_autovacuum or "never"}')
+    click.echo()
+
+
+def report_indexes(connection):
+    indexes = connection.execute(INDEX_STATS, {"tables": TABLES}).fetchall()
+
+    click.echo('Indexes')
+    for index in indexes:
+        click.echo(f'  {index.table_name:8} {index.name:40} {size(index.bytes):>9} {index.idx_scan:10} scans')
+
+    # unique and primary key indexes enforce constraints even when never scanned
+    unused = [index for index in indexes if index.idx_scan == 0 and not index.enforces]
+    click.echo()
+    click.echo(f'Unused indexes ({size(sum(index.bytes for index in unused))})')
+    for index in unused:
+        click.echo(f'  {index.table_name:8} {index.name:40} {size(index.bytes):>9}')
+    if not unused:
+        click.echo('  none')
+    click.echo()
+
+
+def report_statements(connection, limit, route_map, slow_log):
+    click.echo('Top statements by total time')
+    if connection.execute(HAS_STATEMENTS).first() is None:
+        click.echo('  pg_stat_statements is not installed, add it to shared_preload_libraries '
+                   'and run CREATE EXTENSION pg_stat_statements')
+        return
+
+    modern = connection.dialect.server_version_info >= (13,)
+    query = text(TOP_STATEMENTS.format(
+        total='total_exec_time' if modern else 'total_time',
+        mean='mean_exec_time' if modern else 'mean_time',
+    ))
+    statements = connection.execute(query, {
+        "pattern": r'\m(' + '|'.join(TABLES) + r')\M', "limit": limit
+    }).fetchall()
+
+    for statement in statements:
+        hit_ratio = ratio(statement.shared_blks_hit, statement.shared_blks_hit + statement.shared_blks_read)
+        routes = statement_routes(statement.query, route_map, slow_log)
+        click.echo(f'{statement.total_ms:12.1f}ms total  {statement.calls:8} calls  '
+                   f'{statement.mean_ms:8.2f}ms avg  {statement.rows:9} rows  {hit_ratio:6.1%} cache hits')
+        click.echo(f"  routes: {', '.join(routes) or 'unknown'}")
+        click.echo(f'  {normalize_statement(statement.query)}')
+        click.echo()
+
+
+@click.command('db-report')
+@click.option('--limit', default=15, show_default=True, help='Number of statements to show.')
+@with_appcontext
+def db_report_command(limit):
+    """Report table and index health and the costliest statements of venue, artist and show."""
+    if not is_postgresql():
+        raise click.UsageError('db-report reads the postgres statistics views')
+
+    config = current_app.config
+    route_map = load_route_map(config['STATEMENT_ROUTE_MAP'])
+    slow_log = read_slow_log(config['SLOW_QUERY_LOG'])
+
+    with db.engine.connect() as connection:
+        click.echo(f'Statistics since {connection.execute(STATS_RESET).scalar() or "the cluster started"}\n')
+        report_tables(connection)
+        report_indexes(connection)
+        report_statements(connection, limit, route_map, slow_log)
+
+    if not route_map:
+        click.echo('Run `flask check-query-budgets` to map statements to routes.')
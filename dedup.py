@@ -0,0 +1,101 @@
+from difflib import SequenceMatcher
+from itertools import combinations, groupby
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from models import db, fold_name, is_postgresql
+
+# ----------------------------------------------------------------------------#
+# Duplicate detection.
+# ----------------------------------------------------------------------------#
+
+# Only rows in the same block (folded city and state) are compared, and
+# within a block the trigram index on fold_name(name) finds the similar
+# names, so no pair of rows from different cities is ever looked at.
+SIMILAR_PAIRS = """
+    SELECT a.id, b.id AS duplicate_id, a.name, b.name AS duplicate_name, a.city, a.state,
+           similarity(fold_name(a.name), fold_name(b.name)) AS score
+    FROM {table} a
+    JOIN {table} b ON fold_name(b.name) % fold_name(a.name)
+                  AND fold_name(b.city) = fold_name(a.city)
+                  AND fold_name(b.state) = fold_name(a.state)
+                  AND b.id > a.id
+    WHERE {live}
+    ORDER BY a.state, a.city, a.id, score DESC
+"""
+
+ROWS = "SELECT id, name, city, state FROM {table} WHERE {live}"
+
+# Duplicates listed before the unique name_key indexes kept a null key, any
+# edit of their name, city or state collides with the listing they duplicate
+# until the two are merged.
+UNKEYED_PAIRS = """
+    SELECT a.id, b.id AS duplicate_id, a.name, b.name AS duplicate_name, a.city, a.state
+    FROM {table} a
+    JOIN {table} b ON b.name_key IS NULL
+                  AND fold_name(b.name) || '|' || fold_name(b.city) || '|' || fold_name(b.state) = a.name_key
+    WHERE {live}
+    ORDER BY a.id, b.id
+"""
+
+# name -> (table, live pairs, live rows)
+TABLES = {
+    'venues': ('venue', 'a.deleted_at IS NULL AND b.deleted_at IS NULL', 'deleted_at IS NULL'),
+    'artists': ('artist', '1 = 1', '1 = 1'),
+}
+
+
+def unkeyed_pairs(table):
+    """Yield (id, duplicate id, name, duplicate name, city, state) of the duplicates left without a name_key."""
+    name, pair_filter, _ = TABLES[table]
+    yield from db.session.execute(text(UNKEYED_PAIRS.format(table=name, live=pair_filter)))
+
+
+def similar_pairs(table, threshold):
+    """Yield (id, duplicate id, name, duplicate name, city, state, score), ids ascending within a pair."""
+    name, pair_filter, row_filter = TABLES[table]
+
+    if is_postgresql():
+        connection = db.session.connection().execution_options(stream_results=True)
+        # the threshold of the % operator
+        connection.execute(text("SELECT set_config('pg_trgm.similarity_threshold', :threshold, true)"),
+                           threshold=str(threshold))
+        yield from connection.execute(text(SIMILAR_PAIRS.format(table=name, live=pair_filter)))
+        return
+
+    # sqlite: the same blocking, pairs within a block compared here
+    rows = db.session.execute(text(ROWS.format(table=name, live=row_filter))).fetchall()
+
+    def block(row):
+        return fold_name(row.state), fold_name(row.city)
+
+    for _, members in groupby(sorted(rows, key=lambda row: (block(row), row.id)), key=block):
+        for a, b in combinations(list(members), 2):
+            score = SequenceMatcher(None, fold_name(a.name), fold_name(b.name)).ratio()
+            if score >= threshold:
+                yield a.id, b.id, a.name, b.name, a.city, a.state, score
+
+
+@click.command('find-duplicates')
+@click.argument('table', type=click.Choice(sorted(TABLES)))
+@click.option('--threshold', default=0.6, show_default=True, help='Minimum name similarity, 0 to 1.')
+@with_appcontext
+def find_duplicates_command(table, threshold):
+    """
+    List likely duplicate venues or artists in the same city, tab separated.
+    Exact duplicates that can't be edited until merged come first, scored `merge`.
+    """
+    merges = set()
+    for id, duplicate_id, name, duplicate_name, city, state in unkeyed_pairs(table):
+        click.echo(f'merge\t{id}\t{duplicate_id}\t{name}\t{duplicate_name}\t{city}, {state}')
+        merges.add((id, duplicate_id))
+    found = len(merges)
+    for id, duplicate_id, name, duplicate_name, city, state, score in similar_pairs(table, threshold):
+        if (id, duplicate_id) in merges:
+            continue
+        click.echo(f'{score:.2f}\t{id}\t{duplicate_id}\t{name}\t{duplicate_name}\t{city}, {state}')
+        found += 1
+    db.session.rollback()
+    click.echo(f'{found} possible duplicates.', err=True)
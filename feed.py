@@ -0,0 +1,239 @@
+"""
+Server-Sent Events feed of new listings for Fyyur.
+
+One asyncio process holds the browsers' EventSource connections and fans
+out from a single LISTEN connection on the outbox (see outbox.py), so the
+database sees one consumer however many pages are open. Idle connections
+only cost a coroutine and a small queue each:
+
+    python feed.py --port 5001 --allow-origin http://localhost:5000
+    FEED_URL=http://localhost:5001/events flask run
+"""
+import argparse
+import asyncio
+import json
+import logging
+import resource
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import text
+
+logger = logging.getLogger('fyyur.feed')
+
+HEADERS = (
+    'HTTP/1.1 200 OK\r\n'
+    'Content-Type: text/event-stream\r\n'
+    'Cache-Control: no-cache\r\n'
+    'Connection: keep-alive\r\n'
+    # don't let nginx buffer the stream
+    'X-Accel-Buffering: no\r\n'
+    'Access-Control-Allow-Origin: {origin}\r\n'
+    '\r\n'
+    # EventSource reconnects after this many ms, sending Last-Event-ID
+    'retry: 5000\n\n'
+)
+
+NOT_FOUND = 'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+
+UPCOMING_SHOWS = text("""
+    SELECT show.id, show.start_time, venue.id AS venue_id, venue.name AS venue_name,
+           artist.id AS artist_id, artist.name AS artist_name
+    FROM show
+    JOIN venue ON venue.id = show.venue_id
+    JOIN artist ON artist.id = show.artist_id
+    WHERE show.id IN :ids AND show.start_time > :now AND venue.deleted_at IS NULL
+""")
+
+
+# ----------------------------------------------------------------------------#
+# Fan out.
+# ----------------------------------------------------------------------------#
+
+def sse(id, kind, data):
+    # encoded once, the same bytes are written to every client
+    return f'id: {id}\nevent: {kind}\ndata: {json.dumps(data, default=str)}\n\n'.encode()
+
+
+class Feed:
+    def __init__(self, consumer, engine, history=1000, queue_size=100, heartbeat=15, allow_origin='*'):
+        self.consumer = consumer
+        self.engine = engine
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        self.allow_origin = allow_origin
+        self.clients = set()
+        # recent (id, message) pairs, replayed to clients reconnecting with Last-Event-ID
+        self.history = deque(maxlen=history)
+
+    def messages(self, events):
+        # runs in a thread, turns created events into feed messages
+        messages = []
+        show_events = {}
+        for event in events:
+            if event.action != 'created':
+                continue
+            id = f'{event.txid}-{event.id}'
+            if event.entity == 'show':
+                show_events[event.entity_id] = id
+            else:
+                messages.append((id, sse(id, event.entity, dict(event.payload or {}, id=event.entity_id))))
+
+        if show_events:
+            # only upcoming shows, with the names the page shows
+            with self.engine.connect() as connection:
+                shows = connection.execute(UPCOMING_SHOWS, {
+                    "ids": tuple(show_events), "now": datetime.utcnow()
+                }).fetchall()
+            for show in shows:
+                id = show_events[show.id]
+                messages.append((id, sse(id, 'show', dict(show))))
+
+        # keep outbox order across kinds
+        order = {f'{event.txid}-{event.id}': position for position, event in enumerate(events)}
+        return sorted(messages, key=lambda message: order[message[0]])
+
+    def broadcast(self, id, message):
+        self.history.append((id, message))
+        for queue in list(self.clients):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # stuck or gone, its handler notices and closes the connection,
+                # the browser reconnects and catches up from the history
+                self.clients.discard(queue)
+
+    async def pump(self):
+        # start with what gets listed from now on
+        await asyncio.get_running_loop().run_in_executor(None, self.consumer.skip_to_end)
+        while True:
+            try:
+                await self._pump()
+            except Exception:
+                # e.g. a database restart, clients stay connected meanwhile
+                logger.exception('feed listener failed, reconnecting')
+                await asyncio.sleep(5)
+
+    async def _pump(self):
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+
+        with self.consumer.listener() as listener:
+            def notified():
+                listener.poll()
+                del listener.notifies[:]
+                wake.set()
+
+            loop.add_reader(listener.fileno(), notified)
+            try:
+                await self._forward(wake)
+            finally:
+                loop.remove_reader(listener.fileno())
+
+    async def _forward(self, wake):
+        loop = asyncio.get_running_loop()
+        while True:
+            events = await loop.run_in_executor(None, self.consumer.poll)
+            if events:
+                for id, message in await loop.run_in_executor(None, self.messages, events):
+                    self.broadcast(id, message)
+                if len(events) == self.consumer.batch_size:
+                    continue
+            try:
+                await asyncio.wait_for(wake.wait(), self.consumer.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            wake.clear()
+
+    def replay(self, last_event_id):
+        ids = [id for id, _ in self.history]
+        if last_event_id not in ids:
+            return []
+        return [message for _, message in list(self.history)[ids.index(last_event_id) + 1:]]
+
+    async def handle(self, reader, writer):
+        queue = None
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 10)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            if method != 'GET' or target.split('?', 1)[0] != '/events':
+                writer.write(NOT_FOUND.encode())
+                await writer.drain()
+                return
+
+            queue = asyncio.Queue(self.queue_size)
+            self.clients.add(queue)
+            writer.write(HEADERS.format(origin=self.allow_origin).encode())
+            for message in self.replay(headers.get('last-event-id')):
+                writer.write(message)
+            await writer.drain()
+
+            while queue in self.clients:
+                try:
+                    message = await asyncio.wait_for(queue.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    # comments keep proxies from closing idle streams and
+                    # surface clients that went away
+                    message = b': ping\n\n'
+                writer.write(message)
+                await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError, ValueError):
+            pass
+        finally:
+            self.clients.discard(queue)
+            writer.close()
+
+
+# ----------------------------------------------------------------------------#
+# Launch.
+# ----------------------------------------------------------------------------#
+
+def raise_file_limit():
+    # every idle client holds a socket
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+async def serve(feed, host, port):
+    server = await asyncio.start_server(feed.handle, host, port, backlog=2048)
+    print(f'feed listening on http://{host}:{port}/events')
+    async with server:
+        await asyncio.gather(server.serve_forever(), feed.pump())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--allow-origin', default='*', help='Origin of the pages opening the feed.')
+    parser.add_argument('--history', type=int, default=1000, help='Messages kept for reconnecting clients.')
+    args = parser.parse_args()
+
+    # same configuration as the app
+    from app import app
+    from models import db
+    from outbox import OutboxConsumer
+
+    with app.app_context():
+        engine = db.engine
+
+    logging.basicConfig(level=logging.INFO)
+    raise_file_limit()
+    feed = Feed(OutboxConsumer(engine, 'feed'), engine, history=args.history, allow_origin=args.allow_origin)
+    try:
+        asyncio.run(serve(feed, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -9,15 +9,22 @@ from wtforms import (
     SelectField,
     SelectMultipleField,
     DateTimeField,
-    BooleanField
+    BooleanField,
+    IntegerField
 )
 from wtforms.validators import (
     DataRequired,
+    NumberRange,
+    Optional,
     URL,
     ValidationError
 )
 
 
+# longest bookable show in minutes, a day
+MAX_SHOW_DURATION = 24 * 60
+
+
 class ShowForm(Form):
     artist_id = StringField(
         'artist_id', validators=[DataRequired()]
@@ -30,6 +37,10 @@ class ShowForm(Form):
         validators=[DataRequired()],
         default=datetime.today()
     )
+    # in minutes
+    duration = IntegerField(
+        'duration', validators=[Optional(), NumberRange(min=1, max=MAX_SHOW_DURATION)]
+    )
 
 
 def validate_multiselect(form, field):
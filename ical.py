@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+# ----------------------------------------------------------------------------#
+# iCalendar (RFC 5545) helpers.
+# ----------------------------------------------------------------------------#
+
+DEFAULT_SHOW_DURATION = timedelta(hours=2)
+
+
+def escape_text(value):
+    return (value.replace('\\', '\\\\')
+            .replace(';', '\\;')
+            .replace(',', '\\,')
+            .replace('\n', '\\n'))
+
+
+def format_time(value):
+    # start times are stored as naive utc, emitted as utc times so every
+    # client shows them in its own timezone instead of as floating times
+    return value.strftime('%Y%m%dT%H%M%SZ')
+
+
+def fold(line):
+    # content lines are limited to 75 octets, continuations start with a space
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+
+    parts = []
+    while encoded:
+        limit = 75 if not parts else 74
+        # don't split a multi-byte character
+        while limit < len(encoded) and (encoded[limit] & 0xC0) == 0x80:
+            limit -= 1
+        parts.append(encoded[:limit].decode('utf-8'))
+        encoded = encoded[limit:]
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def stream_calendar(name, shows, host):
+    """
+    Yield an iCalendar document chunk by chunk.
+
+    `shows` is an iterable of rows with id, start_time, artist_name and
+    venue_name (and optionally duration), consumed lazily so the feed can be
+    streamed straight off a server side cursor.
+    """
+    yield fold('BEGIN:VCALENDAR')
+    yield fold('VERSION:2.0')
+    yield fold('PRODID:-//Fyyur//Shows//EN')
+    yield fold('X-WR-CALNAME:' + escape_text(name))
+
+    stamp = format_time(datetime.utcnow())
+    for show in shows:
+        end_time = show.start_time + (getattr(show, 'duration', None) or DEFAULT_SHOW_DURATION)
+        yield ''.join([
+            fold('BEGIN:VEVENT'),
+            fold(f'UID:show-{show.id}@{host}'),
+            fold('DTSTAMP:' + stamp),
+            fold('DTSTART:' + format_time(show.start_time)),
+            fold('DTEND:' + format_time(end_time)),
+            fold('SUMMARY:' + escape_text(f'{show.artist_name} at {show.venue_name}')),
+            fold('END:VEVENT'),
+        ])
+
+    yield fold('END:VCALENDAR')
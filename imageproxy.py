@@ -0,0 +1,288 @@
+import hashlib
+import http.client
+import ipaddress
+import os
+import socket
+import threading
+import time
+from io import BytesIO
+from urllib.parse import urljoin, urlsplit
+
+from itsdangerous import BadSignature, URLSafeSerializer
+from PIL import Image
+
+import metrics
+
+# ----------------------------------------------------------------------------#
+# Image proxy.
+# ----------------------------------------------------------------------------#
+
+# size name -> bounding box, thumbnails keep their aspect ratio
+THUMBNAIL_SIZES = {
+    'list': (80, 80),
+    'tile': (320, 320),
+    'detail': (640, 640),
+}
+
+
+REDIRECTS = {301, 302, 303, 307, 308}
+MAX_REDIRECTS = 5
+
+
+class ImageUnavailable(Exception):
+    pass
+
+
+class PinnedHTTPConnection(http.client.HTTPConnection):
+    # connects to the address that was vetted instead of resolving the host again
+    def __init__(self, host, address, **kw):
+        super().__init__(host, **kw)
+        self.address = address
+
+    def connect(self):
+        self.sock = socket.create_connection((self.address, self.port), self.timeout)
+
+
+class PinnedHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, host, address, **kw):
+        super().__init__(host, **kw)
+        self.address = address
+
+    def connect(self):
+        sock = socket.create_connection((self.address, self.port), self.timeout)
+        # certificate checked against the host name, not the address
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+
+class ImageProxy:
+    """
+    Serves `image_link` urls from a local cache of thumbnails.
+
+    Each source url is fetched once. The cache is content addressed: refs/
+    maps the hash of a url to the sha256 of the bytes fetched from it, and
+    sources/ and thumbs/ are keyed by that digest, so links to the same image
+    share their files. Files are touched whenever they're served and the least
+    recently used ones are evicted once the cache outgrows IMAGE_CACHE_MAX_BYTES.
+    """
+
+    def __init__(self, app):
+        config = app.config
+        # urls are signed so the proxy only ever fetches links we rendered
+        self.serializer = URLSafeSerializer(config['IMAGE_PROXY_SIGNING_KEY'] or config['SECRET_KEY'],
+                                            salt='image-proxy')
+        self.directory = config['IMAGE_CACHE_DIR']
+        self.max_bytes = config['IMAGE_CACHE_MAX_BYTES']
+        self.fetch_timeout = config['IMAGE_FETCH_TIMEOUT']
+        self.max_source_bytes = config['IMAGE_MAX_SOURCE_BYTES']
+        self.allow_private = config['IMAGE_PROXY_ALLOW_PRIVATE']
+        self._size = None
+        self._lock = threading.Lock()
+        self._fetching = {}
+
+    def token(self, url):
+        return self.serializer.dumps(url)
+
+    def source_url(self, token):
+        try:
+            return self.serializer.loads(token)
+        except BadSignature:
+            return None
+
+    def _path(self, kind, name):
+        return os.path.join(self.directory, kind, name[:2], name)
+
+    def _read_ref(self, url):
+        try:
+            with open(self._path('refs', hashlib.sha256(url.encode()).hexdigest())) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def thumbnail(self, url, size):
+        """
+        Return (file, digest) of the `size` thumbnail of `url`, fetching it if
+        needed. The file is open for reading, the caller closes it.
+        """
+        digest = self._read_ref(url)
+        if digest:
+            thumb = self._open(self._path('thumbs', f'{digest}-{size}.jpg'))
+            if thumb:
+                metrics.incr('images.hits')
+                return thumb, digest
+
+        # one fetch per url at a time, concurrent requests for it wait on it
+        with self._lock:
+            lock = self._fetching.setdefault(url, threading.Lock())
+        with lock:
+            try:
+                return self._build(url, size)
+            finally:
+                with self._lock:
+                    self._fetching.pop(url, None)
+
+    def _build(self, url, size):
+        digest = self._read_ref(url)
+        source = None
+        if digest:
+            thumb = self._open(self._path('thumbs', f'{digest}-{size}.jpg'))
+            if thumb:
+                metrics.incr('images.hits')
+                return thumb, digest
+            cached = self._open(self._path('sources', digest))
+            if cached:
+                with cached:
+                    source = cached.read()
+
+        if source is None:
+            source = self._fetch(url)
+            digest = hashlib.sha256(source).hexdigest()
+            self._write(self._path('sources', digest), source)
+            self._write(self._path('refs', hashlib.sha256(url.encode()).hexdigest()), digest.encode())
+
+        metrics.incr('images.misses')
+        data = self._resize(source, THUMBNAIL_SIZES[size])
+        self._write(self._path('thumbs', f'{digest}-{size}.jpg'), data)
+        # served from memory, the file may already be evicted again
+        return BytesIO(data), digest
+
+    def _is_public(self, address):
+        return ipaddress.ip_address(address).is_global
+
+    def _resolve(self, host, port):
+        # image links are user input, don't let them point the proxy at internal
+        # services. The vetted address is the one connected to, so the name
+        # can't be rebound to another address between the check and the fetch
+        addresses = [info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)]
+        if not self.allow_private:
+            for address in addresses:
+                if not self._is_public(address):
+                    raise ImageUnavailable(f'{host} resolves to a non public address')
+        return addresses[0]
+
+    def _get(self, url):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ImageUnavailable(f'unsupported image link {url!r}')
+
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        connection_class = PinnedHTTPSConnection if parts.scheme == 'https' else PinnedHTTPConnection
+        connection = connection_class(parts.hostname, self._resolve(parts.hostname, port), port=port,
+                                      timeout=self.fetch_timeout)
+        path = parts.path or '/'
+        connection.request('GET', f'{path}?{parts.query}' if parts.query else path,
+                           headers={"User-Agent": 'fyyur-image-proxy'})
+        return connection, connection.getresponse()
+
+    def _fetch(self, url):
+        started = time.perf_counter()
+        try:
+            # redirects are followed here, every hop goes through the same checks
+            for _ in range(MAX_REDIRECTS + 1):
+                connection, response = self._get(url)
+                try:
+                    if response.status in REDIRECTS and response.getheader('Location'):
+                        url = urljoin(url, response.getheader('Location'))
+                        continue
+                    if response.status != 200:
+                        raise ImageUnavailable(f'{url} answered {response.status}')
+                    content_type = response.getheader('Content-Type', '')
+                    if not content_type.startswith('image/'):
+                        raise ImageUnavailable(f'{url} is not an image ({content_type or "no content type"})')
+                    if int(response.getheader('Content-Length') or 0) > self.max_source_bytes:
+                        raise ImageUnavailable(f'{url} is larger than {self.max_source_bytes} bytes')
+                    data = response.read(self.max_source_bytes + 1)
+                    break
+                finally:
+                    connection.close()
+            else:
+                raise ImageUnavailable(f'{url} redirected more than {MAX_REDIRECTS} times')
+        except (OSError, ValueError, http.client.HTTPException) as e:
+            raise ImageUnavailable(f'fetching {url} failed: {e!r}') from e
+        finally:
+            metrics.observe('images.fetch', time.perf_counter() - started)
+
+        if len(data) > self.max_source_bytes:
+            raise ImageUnavailable(f'{url} is larger than {self.max_source_bytes} bytes')
+        metrics.incr('images.fetches')
+        return data
+
+    def _resize(self, source, box):
+        try:
+            image = Image.open(BytesIO(source))
+            # lets jpeg decoding skip straight to a smaller scale
+            image.draft('RGB', box)
+            image.thumbnail(box, Image.LANCZOS)
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.split()[-1])
+                image = background
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            raise ImageUnavailable(f'cannot decode image: {e!r}') from e
+
+        output = BytesIO()
+        image.save(output, 'JPEG', quality=85, optimize=True, progressive=True)
+        return output.getvalue()
+
+    def _open(self, path):
+        # serve from the open handle, another worker's eviction can remove the
+        # file any time but not take it away from a reader that has it open
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            # least recently served first out
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return f
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # rename into place so other workers never serve a partial file
+        temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._disk_usage()
+            self._size += len(data)
+            if self._size > self.max_bytes:
+                self._size = self._evict()
+
+    def _files(self):
+        for kind in ('sources', 'thumbs'):
+            for root, _, names in os.walk(os.path.join(self.directory, kind)):
+                for name in names:
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        # evicted by another worker
+                        continue
+                    yield stat.st_mtime, stat.st_size, path
+
+    def _disk_usage(self):
+        return sum(size for _, size, _ in self._files())
+
+    def _evict(self):
+        # other workers share the directory, so start from what is on disk
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        # evict down to 90% so a full cache doesn't rescan on every write
+        target = self.max_bytes * 0.9
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                metrics.incr('images.evictions')
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
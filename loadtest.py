@@ -0,0 +1,249 @@
+"""
+Local load generator for Fyyur.
+
+Launches the app as a single worker with the production profile (or targets
+--url), drives it with a scripted mix of page views from concurrent clients
+and writes p50/p95/p99 latency, throughput and error rate per route as JSON:
+
+    flask seed --venues 500 --artists 2000 --shows 20000
+    python loadtest.py --mix browse --concurrency 16 --duration 30 --output load-$(git rev-parse --short HEAD).json
+    python loadtest.py --mix browse --baseline load-abc1234.json
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlencode, urlsplit
+
+# ----------------------------------------------------------------------------#
+# User mixes.
+# ----------------------------------------------------------------------------#
+
+SEARCH_TERMS = ['the', 'jazz', 'room', 'collective', 'rock', 'blues', 'soul', 'x']
+
+# route name -> (method, path builder, form builder)
+ROUTES = {
+    'index': ('GET', lambda ids, rng: '/', None),
+    'venues': ('GET', lambda ids, rng: '/venues', None),
+    'artists': ('GET', lambda ids, rng: '/artists', None),
+    'shows': ('GET', lambda ids, rng: '/shows', None),
+    'show_venue': ('GET', lambda ids, rng: f'/venues/{rng.choice(ids["venues"])}', None),
+    'show_artist': ('GET', lambda ids, rng: f'/artists/{rng.choice(ids["artists"])}', None),
+    'search_venues': ('POST', lambda ids, rng: '/venues/search',
+                      lambda rng: {"search_term": rng.choice(SEARCH_TERMS)}),
+    'search_artists': ('POST', lambda ids, rng: '/artists/search',
+                       lambda rng: {"search_term": rng.choice(SEARCH_TERMS)}),
+    'calendar': ('GET', lambda ids, rng: '/calendar', None),
+    'autocomplete_venues': ('GET', lambda ids, rng: '/autocomplete/venues?q=' + rng.choice(SEARCH_TERMS)[:2], None),
+}
+
+# mix name -> route name -> weight
+MIXES = {
+    'browse': {
+        'index': 10, 'venues': 15, 'artists': 10, 'shows': 10, 'show_venue': 25, 'show_artist': 20,
+        'search_venues': 5, 'search_artists': 5,
+    },
+    'search': {'search_venues': 50, 'search_artists': 40, 'autocomplete_venues': 10},
+    'detail': {'show_venue': 50, 'show_artist': 50},
+    'lists': {'venues': 40, 'artists': 30, 'shows': 30},
+}
+
+
+# ----------------------------------------------------------------------------#
+# Load generation.
+# ----------------------------------------------------------------------------#
+
+def seeded_database():
+    # the database `flask seed` filled, it runs with the development profile
+    from config import DevelopmentConfig
+    return DevelopmentConfig.SQLALCHEMY_DATABASE_URI
+
+
+def load_ids(limit=1000):
+    # read ids straight from the seeded database, without loading the app and its profile
+    from sqlalchemy import create_engine, select
+    from models import Venue, Artist
+
+    engine = create_engine(seeded_database())
+    with engine.connect() as connection:
+        venues = [id for id, in connection.execute(select([Venue.id]).limit(limit))]
+        artists = [id for id, in connection.execute(select([Artist.id]).limit(limit))]
+    engine.dispose()
+
+    if not venues or not artists:
+        sys.exit('no venues or artists found, run `flask seed` first')
+    return {"venues": venues, "artists": artists}
+
+
+def launch_app(port):
+    # measured with the production profile, .flaskenv would otherwise pick the
+    # debug one, against the seeded database. A throwaway secret key is enough
+    # for a run. Every simulated client shares one address, keep rate limiting
+    # off unless asked for
+    env = dict(os.environ, FLASK_APP='app.py', FLASK_RUN_PORT=str(port),
+               FYYUR_ENV='production', FLASK_ENV='production', DATABASE_URL=seeded_database(),
+               SECRET_KEY=os.environ.get('SECRET_KEY') or secrets.token_hex(32),
+               RATE_LIMIT_STORAGE=os.environ.get('RATE_LIMIT_STORAGE', ''))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'flask', 'run', '--no-reload', '--without-threads', '--port', str(port)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    # wait for the worker to accept connections
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    sys.exit('app did not start')
+
+
+def client(base_url, mix, ids, stop_at, results, seed):
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    target = urlsplit(base_url)
+    connection = None
+
+    while time.time() < stop_at:
+        name = rng.choices(names, weights)[0]
+        method, path, form = ROUTES[name]
+        body = urlencode(form(rng)) if form else None
+        headers = {"Content-Type": 'application/x-www-form-urlencoded'} if form else {}
+
+        started = time.perf_counter()
+        try:
+            if connection is None:
+                connection = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+            connection.request(method, path(ids, rng), body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            ok = response.status < 400
+            if response.getheader('Connection', '').lower() == 'close' or response.version == 10:
+                connection.close()
+                connection = None
+        except (OSError, http.client.HTTPException):
+            ok = False
+            connection = None
+        results[name].append((time.perf_counter() - started, ok))
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(samples, duration):
+    latencies = sorted(latency for latency, _ in samples)
+    errors = sum(1 for _, ok in samples if not ok)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0,
+        "rps": round(len(samples) / duration, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+    }
+
+
+def run(base_url, mix_name, concurrency, duration, seed):
+    ids = load_ids()
+    results = defaultdict(list)
+    started = time.time()
+    stop_at = started + duration
+    threads = []
+
+    for i in range(concurrency):
+        # every client appends to its own dict, merged once they're done
+        thread_results = defaultdict(list)
+        thread = threading.Thread(target=client, args=(base_url, MIXES[mix_name], ids, stop_at, thread_results, seed + i))
+        thread.start()
+        threads.append((thread, thread_results))
+
+    for thread, thread_results in threads:
+        thread.join()
+        for name, samples in thread_results.items():
+            results[name].extend(samples)
+    elapsed = time.time() - started
+
+    return {
+        "mix": mix_name,
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 2),
+        "commit": git_commit(),
+        "routes": {name: summarize(samples, elapsed) for name, samples in sorted(results.items())},
+        "total": summarize([sample for samples in results.values() for sample in samples], elapsed),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    for name, current in sorted(report['routes'].items()):
+        previous = baseline['routes'].get(name)
+        if previous is None or not previous['p95_ms'] or not current['p95_ms']:
+            continue
+        change = (current['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] * 100
+        print(f'{name:22} p95 {previous["p95_ms"]:8.2f}ms -> {current["p95_ms"]:8.2f}ms ({change:+.1f}%)'
+              f'  rps {previous["rps"]:8.2f} -> {current["rps"]:8.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='target an already running app instead of launching one')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--mix', choices=sorted(MIXES), default='browse')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20, help='seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the json report here instead of stdout')
+    parser.add_argument('--baseline', help='json report to compare against')
+    args = parser.parse_args()
+
+    process = None
+    base_url = args.url
+    if base_url is None:
+        process = launch_app(args.port)
+        base_url = f'http://127.0.0.1:{args.port}'
+
+    try:
+        report = run(base_url, args.mix, args.concurrency, args.duration, args.seed)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+from sqlalchemy import text
+
+from models import db, is_postgresql, Venue, Artist
+
+# ----------------------------------------------------------------------------#
+# Genre matchmaking.
+# ----------------------------------------------------------------------------#
+
+# `genres && :genres` is answered by the (state, genres) GIN indexes of
+# migration d2f7a9c1e384, so only candidates sharing at least one genre are
+# ever looked at, they are then ranked by how many genres they share
+MATCHING_ARTISTS = text("""
+    SELECT id, name, city, state, genres,
+           (SELECT count(*) FROM unnest(genres) AS genre WHERE genre = ANY(:genres)) AS overlap
+    FROM artist
+    WHERE seeking_venue AND state = :state AND genres && CAST(:genres AS varchar[])
+    ORDER BY overlap DESC, id
+    LIMIT :limit
+""")
+
+MATCHING_VENUES = text("""
+    SELECT id, name, city, state, genres,
+           (SELECT count(*) FROM unnest(genres) AS genre WHERE genre = ANY(:genres)) AS overlap
+    FROM venue
+    WHERE seeking_talent AND deleted_at IS NULL AND state = :state AND genres && CAST(:genres AS varchar[])
+    ORDER BY overlap DESC, id
+    LIMIT :limit
+""")
+
+
+def _matches(query, record, limit):
+    rows = db.session.execute(query, {"state": record.state, "genres": list(record.genres), "limit": limit})
+    return [_match(row, row.overlap) for row in rows]
+
+
+def _ranked(query, record, limit):
+    # embedded sqlite has no array operators, rank the state's candidates here
+    genres = set(record.genres)
+    ranked = sorted(
+        ((len(genres.intersection(row.genres)), row) for row in query),
+        key=lambda item: (-item[0], item[1].id)
+    )
+    return [_match(row, overlap) for overlap, row in ranked if overlap][:limit]
+
+
+def _match(row, overlap):
+    return {
+        "id": row.id,
+        "name": row.name,
+        "city": row.city,
+        "state": row.state,
+        "genres": row.genres,
+        "shared_genres": overlap
+    }
+
+
+def matching_artists(venue, limit):
+    # seeking artists in the venue's state, most shared genres first
+    if is_postgresql():
+        return _matches(MATCHING_ARTISTS, venue, limit)
+    query = db.session.query(Artist.id, Artist.name, Artist.city, Artist.state, Artist.genres). \
+        filter(Artist.seeking_venue, Artist.state == venue.state)
+    return _ranked(query, venue, limit)
+
+
+def matching_venues(artist, limit):
+    if is_postgresql():
+        return _matches(MATCHING_VENUES, artist, limit)
+    query = db.session.query(Venue.id, Venue.name, Venue.city, Venue.state, Venue.genres). \
+        filter(Venue.seeking_talent, Venue.deleted_at.is_(None), Venue.state == artist.state)
+    return _ranked(query, artist, limit)
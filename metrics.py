@@ -0,0 +1,136 @@
+import glob
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+# ----------------------------------------------------------------------------#
+# In-process metrics.
+# ----------------------------------------------------------------------------#
+
+# counters and timings are kept per worker process, they are cheap to update
+# from request handlers. Each worker dumps them to METRICS_DIR every
+# METRICS_DUMP_INTERVAL seconds, `flask metrics` adds those up
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_timings = defaultdict(float)
+_dumped = {"at": 0.0}
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name, seconds):
+    with _lock:
+        _timings[name] += seconds
+
+
+def snapshot():
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "timings": dict(_timings)
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timings.clear()
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # someone else's process
+        return True
+    return True
+
+
+def dump(directory):
+    """Write this process' snapshot to `directory`/metrics.<pid>.json."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'metrics.{os.getpid()}.json')
+    temporary = f'{path}.{threading.get_ident()}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(dict(snapshot(), pid=os.getpid(), time=time.time()), f)
+    os.replace(temporary, path)
+
+
+def read_metrics(directory):
+    """Snapshots of the running processes, the dumps of exited ones are removed."""
+    snapshots = []
+    for path in sorted(glob.glob(os.path.join(directory, 'metrics.*.json'))):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            continue
+        if is_running(data['pid']):
+            snapshots.append(data)
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return snapshots
+
+
+def init_metrics(app):
+    directory = app.config['METRICS_DIR']
+    interval = app.config['METRICS_DUMP_INTERVAL']
+    if not directory:
+        return
+
+    @app.teardown_request
+    def dump_metrics(error=None):
+        now = time.monotonic()
+        if now - _dumped['at'] < interval:
+            return
+        _dumped['at'] = now
+        try:
+            dump(directory)
+        except OSError:
+            app.logger.exception('could not dump metrics to %s', directory)
+
+
+@click.command('metrics')
+@click.option('--per-process', is_flag=True, help='Show every worker instead of the totals.')
+@with_appcontext
+def metrics_command(per_process):
+    """Print the counters and timings of the running workers."""
+    directory = current_app.config['METRICS_DIR']
+    if not directory:
+        raise click.UsageError('METRICS_DIR is not set')
+
+    snapshots = read_metrics(directory)
+    if per_process:
+        groups = [(f"pid {data['pid']}", [data]) for data in snapshots]
+    else:
+        groups = [(f'{len(snapshots)} workers', snapshots)]
+
+    for title, members in groups:
+        counters = defaultdict(int)
+        timings = defaultdict(float)
+        for data in members:
+            for name, value in data['counters'].items():
+                counters[name] += value
+            for name, value in data['timings'].items():
+                timings[name] += value
+
+        click.echo(title)
+        for name, value in sorted(counters.items()):
+            click.echo(f'  {name:32} {value:12}')
+        for name, value in sorted(timings.items()):
+            click.echo(f'  {name:32} {value:11.3f}s')
+        click.echo()
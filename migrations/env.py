@@ -1,13 +1,17 @@
 from __future__ import with_statement
 
 import logging
+import time
+from contextlib import nullcontext
 from logging.config import fileConfig
 
 from sqlalchemy import engine_from_config
 from sqlalchemy import pool
+from sqlalchemy import text
 from flask import current_app
 
 from alembic import context
+from alembic.operations import MigrateOperation, Operations
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -32,6 +36,163 @@ target_metadata = current_app.extensions['migrate'].db.metadata
 # my_important_option = config.get_main_option("my_important_option")
 # ... etc.
 
+# `flask db upgrade -x dry_run=1` runs the pending revisions in a single
+# transaction, times them and rolls back, see run_migrations_dry()
+x_arguments = context.get_x_argument(as_dictionary=True)
+DRY_RUN = {"enabled": x_arguments.get('dry_run') in ('1', 'true', 'yes'), "pauses": 0.0}
+
+
+# ----------------------------------------------------------------------------#
+# Online-safe operations, available to revisions as op.<name>(...).
+# ----------------------------------------------------------------------------#
+
+def online_operation(fn):
+    # registers fn(operations, *args, **kw) as op.<fn name>(*args, **kw)
+    class Operation(MigrateOperation):
+        def __init__(self, args, kw):
+            self.args = args
+            self.kw = kw
+
+    def invoke(cls, operations, *args, **kw):
+        return operations.invoke(cls(args, kw))
+
+    # alembic builds op.<name> from the classmethod's name and signature
+    invoke.__name__ = fn.__name__
+    Operation.__name__ = ''.join(part.title() for part in fn.__name__.split('_')) + 'Op'
+    setattr(Operation, fn.__name__, classmethod(invoke))
+    Operations.register_operation(fn.__name__)(Operation)
+    Operations.implementation_for(Operation)(
+        lambda operations, operation: fn(operations, *operation.args, **operation.kw)
+    )
+    return fn
+
+
+def outside_transaction(operations):
+    # commits the revision's transaction so far and runs the block in
+    # autocommit. A dry run stays in its one transaction
+    if DRY_RUN['enabled']:
+        return nullcontext()
+    return operations.get_context().autocommit_block()
+
+
+@online_operation
+def set_timeouts(operations, lock_timeout=None, statement_timeout=None):
+    """Override the session's lock / statement timeouts, e.g. '2s', for the rest of the run."""
+    if lock_timeout is not None:
+        operations.execute(f"SET lock_timeout = '{lock_timeout}'")
+    if statement_timeout is not None:
+        operations.execute(f"SET statement_timeout = '{statement_timeout}'")
+
+
+@online_operation
+def create_index_concurrently(operations, index_name, table_name, columns, **kw):
+    """CREATE INDEX CONCURRENTLY, cleaning up an invalid index left by an earlier failed attempt."""
+    if DRY_RUN['enabled']:
+        # concurrent builds can't run in a transaction, a plain build is a lower bound
+        operations.create_index(index_name, table_name, columns, **kw)
+        return
+
+    def is_valid():
+        return operations.get_bind().execute(text(
+            'SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name'
+        ), name=index_name).scalar()
+
+    with outside_transaction(operations):
+        valid = is_valid()
+        if valid:
+            return
+        if valid is not None:
+            operations.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {index_name}')
+        operations.create_index(index_name, table_name, columns, postgresql_concurrently=True, **kw)
+        # a failed concurrent build leaves an invalid index behind that enforces
+        # nothing, never let the migration carry on as if it were there
+        if not is_valid():
+            raise RuntimeError(f'{index_name} was left invalid, fix the rows it rejects and rerun the upgrade')
+
+
+@online_operation
+def drop_index_concurrently(operations, index_name):
+    with outside_transaction(operations):
+        concurrently = '' if DRY_RUN['enabled'] else 'CONCURRENTLY '
+        operations.execute(f'DROP INDEX {concurrently}IF EXISTS {index_name}')
+
+
+@online_operation
+def add_check_not_valid(operations, constraint_name, table_name, condition):
+    """Add a CHECK constraint for new rows only, existing ones are checked by op.validate_constraint()."""
+    operations.execute(f'ALTER TABLE {table_name} ADD CONSTRAINT {constraint_name} CHECK ({condition}) NOT VALID')
+
+
+@online_operation
+def add_foreign_key_not_valid(operations, constraint_name, table_name, columns, referent_table, referent_columns,
+                              ondelete=None):
+    on_delete = f' ON DELETE {ondelete}' if ondelete else ''
+    operations.execute(
+        f'ALTER TABLE {table_name} ADD CONSTRAINT {constraint_name} FOREIGN KEY ({", ".join(columns)}) '
+        f'REFERENCES {referent_table} ({", ".join(referent_columns)}){on_delete} NOT VALID'
+    )
+
+
+@online_operation
+def validate_constraint(operations, constraint_name, table_name):
+    """
+    Check existing rows against a NOT VALID constraint. Runs in its own
+    transaction, so the lock taken when adding the constraint is released
+    first, and only takes SHARE UPDATE EXCLUSIVE while scanning, reads and
+    writes carry on.
+    """
+    with outside_transaction(operations):
+        operations.execute(f'ALTER TABLE {table_name} VALIDATE CONSTRAINT {constraint_name}')
+
+
+@online_operation
+def set_not_null(operations, table_name, column_name):
+    """
+    SET NOT NULL without scanning the table under an exclusive lock: a
+    validated CHECK (column IS NOT NULL) lets postgres (12+) skip the scan.
+    """
+    constraint_name = f'{table_name}_{column_name}_not_null'
+    add_check_not_valid(operations, constraint_name, table_name, f'{column_name} IS NOT NULL')
+    validate_constraint(operations, constraint_name, table_name)
+    operations.execute(f'ALTER TABLE {table_name} ALTER COLUMN {column_name} SET NOT NULL')
+    operations.execute(f'ALTER TABLE {table_name} DROP CONSTRAINT {constraint_name}')
+
+
+@online_operation
+def backfill(operations, table_name, set_clause, where='true', batch_size=1000, pause=0.1, key='id'):
+    """
+    UPDATE table SET <set_clause> for the rows matching `where`, `batch_size`
+    rows per transaction in `key` order, sleeping `pause` seconds between
+    batches so replication and other writers keep up.
+    """
+    statement = text(f'''
+        UPDATE {table_name} SET {set_clause}
+        WHERE {key} IN (
+            SELECT {key} FROM {table_name} WHERE {key} > :after AND ({where}) ORDER BY {key} LIMIT :batch_size
+        )
+        RETURNING {key}
+    ''')
+
+    total = 0
+    with outside_transaction(operations):
+        bind = operations.get_bind()
+        after = bind.execute(text(f'SELECT min({key}) FROM {table_name}')).scalar()
+        if after is None:
+            return
+        # min - 1 only works for numeric keys, which is what the batching assumes
+        after -= 1
+        while True:
+            keys = [row[0] for row in bind.execute(statement, after=after, batch_size=batch_size)]
+            if not keys:
+                break
+            total += len(keys)
+            after = max(keys)
+            if DRY_RUN['enabled']:
+                DRY_RUN['pauses'] += pause
+            else:
+                time.sleep(pause)
+    logger.info('Backfilled %d rows of %s.', total, table_name)
+
 
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
@@ -79,10 +240,21 @@ def run_migrations_online():
     )
 
     with connectable.connect() as connection:
+        # give up on a lock instead of queueing behind a long transaction,
+        # with every other query on the table queueing behind the migration
+        connection.execute(f"SET lock_timeout = '{current_app.config['MIGRATION_LOCK_TIMEOUT']}'")
+        connection.execute(f"SET statement_timeout = '{current_app.config['MIGRATION_STATEMENT_TIMEOUT']}'")
+
+        if DRY_RUN['enabled']:
+            run_migrations_dry(connection)
+            return
+
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
             process_revision_directives=process_revision_directives,
+            # one transaction per revision, locks are only held for one revision
+            transaction_per_migration=True,
             **current_app.extensions['migrate'].configure_args
         )
 
@@ -90,6 +262,41 @@ def run_migrations_online():
             context.run_migrations()
 
 
+def run_migrations_dry(connection):
+    """
+    Run the pending revisions in one transaction, print how long each took
+    and roll everything back. Meant for a scratch database holding a copy or
+    a seeded stand-in of production (`flask seed --venues 50000 ...`), it
+    takes the same locks as the real run.
+    """
+    timings = []
+    last = {"time": time.perf_counter(), "pauses": 0.0}
+
+    def on_version_apply(ctx, step, heads, run_args):
+        now = time.perf_counter()
+        pauses = DRY_RUN['pauses'] - last['pauses']
+        timings.append((step.up_revision_id, step.up_revision.doc, now - last['time'], pauses))
+        last.update(time=now, pauses=DRY_RUN['pauses'])
+
+    transaction = connection.begin()
+    try:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            on_version_apply=on_version_apply,
+            **current_app.extensions['migrate'].configure_args
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+    finally:
+        transaction.rollback()
+
+    for revision, doc, elapsed, pauses in timings:
+        print(f'{revision}  {elapsed:9.2f}s  + {pauses:8.2f}s backfill pauses  {doc}')
+    total = sum(elapsed + pauses for _, _, elapsed, pauses in timings)
+    print(f'estimated total {total:.2f}s (concurrent index builds take longer than the plain builds timed here)')
+
+
 if context.is_offline_mode():
     run_migrations_offline()
 else:
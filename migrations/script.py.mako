@@ -9,6 +9,15 @@ from alembic import op
 import sqlalchemy as sa
 ${imports if imports else ""}
 
+# On large tables use the online-safe operations from env.py instead of
+# whatever autogenerate wrote below:
+#   op.create_index_concurrently(name, table, columns) / op.drop_index_concurrently(name)
+#   op.add_check_not_valid(...) or op.add_foreign_key_not_valid(...), then op.validate_constraint(name, table)
+#   op.set_not_null(table, column) instead of op.alter_column(..., nullable=False)
+#   op.backfill(table, "column = ...", where="column IS NULL", batch_size=1000, pause=0.1)
+#   op.set_timeouts(lock_timeout='2s', statement_timeout='30s')
+# and time it first with `flask db upgrade -x dry_run=1` against a seeded scratch database.
+
 # revision identifiers, used by Alembic.
 revision = ${repr(up_revision)}
 down_revision = ${repr(down_revision)}
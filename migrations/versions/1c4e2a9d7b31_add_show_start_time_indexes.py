@@ -0,0 +1,33 @@
+"""add show start_time indexes
+
+Revision ID: 1c4e2a9d7b31
+Revises: 98684a4471e8
+Create Date: 2026-10-19 10:12:31.402518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1c4e2a9d7b31'
+down_revision = '98684a4471e8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.set_timeouts(lock_timeout='2s')
+    # built concurrently, show and venue stay writable meanwhile
+    op.create_index_concurrently('ix_show_start_time', 'show', ['start_time'], unique=False)
+    op.create_index_concurrently('ix_show_venue_id_start_time', 'show', ['venue_id', 'start_time'], unique=False)
+    op.create_index_concurrently('ix_show_artist_id_start_time', 'show', ['artist_id', 'start_time'], unique=False)
+    op.create_index_concurrently('ix_venue_state_city', 'venue', ['state', 'city'], unique=False)
+
+
+def downgrade():
+    op.set_timeouts(lock_timeout='2s')
+    op.drop_index_concurrently('ix_venue_state_city')
+    op.drop_index_concurrently('ix_show_artist_id_start_time')
+    op.drop_index_concurrently('ix_show_venue_id_start_time')
+    op.drop_index_concurrently('ix_show_start_time')
@@ -0,0 +1,46 @@
+"""prevent overlapping shows
+
+Revision ID: 4f8a1d2c9e60
+Revises: 1c4e2a9d7b31
+Create Date: 2026-10-19 11:03:48.117964
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f8a1d2c9e60'
+down_revision = '1c4e2a9d7b31'
+branch_labels = None
+depends_on = None
+
+# half-open, so a show may start the minute the previous one ends. Shows
+# without a duration are a single point in time, '[]' keeps them non-empty
+BOOKED_RANGE = ("CASE WHEN duration IS NULL THEN tsrange(start_time, start_time, '[]') "
+                "ELSE tsrange(start_time, start_time + duration, '[)') END")
+
+
+def upgrade():
+    op.set_timeouts(lock_timeout='2s')
+    op.add_column('show', sa.Column('duration', sa.Interval(), nullable=True))
+
+    # btree_gist lets the integer ids take part in a GiST index
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+
+    # Postgres can't add exclusion constraints NOT VALID nor build them
+    # concurrently, each one holds an ACCESS EXCLUSIVE lock on show while its
+    # index is built. The lock timeout makes it give up instead of queueing
+    # every query behind it, retry off-peak if it does. Fails if the table
+    # already holds overlapping bookings, clean those up first
+    op.execute(f"ALTER TABLE show ADD CONSTRAINT show_venue_no_overlap "
+               f"EXCLUDE USING gist (venue_id WITH =, ({BOOKED_RANGE}) WITH &&)")
+    op.execute(f"ALTER TABLE show ADD CONSTRAINT show_artist_no_overlap "
+               f"EXCLUDE USING gist (artist_id WITH =, ({BOOKED_RANGE}) WITH &&)")
+
+
+def downgrade():
+    op.set_timeouts(lock_timeout='2s')
+    op.drop_constraint('show_artist_no_overlap', 'show')
+    op.drop_constraint('show_venue_no_overlap', 'show')
+    op.drop_column('show', 'duration')
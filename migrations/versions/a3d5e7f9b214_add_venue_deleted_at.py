@@ -0,0 +1,30 @@
+"""add venue deleted_at
+
+Revision ID: a3d5e7f9b214
+Revises: 4f8a1d2c9e60
+Create Date: 2026-10-19 12:41:05.930214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3d5e7f9b214'
+down_revision = '4f8a1d2c9e60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.set_timeouts(lock_timeout='2s')
+    # a nullable column without a default only touches the catalog
+    op.add_column('venue', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.create_index_concurrently('ix_venue_deleted_at', 'venue', ['deleted_at'], unique=False,
+                                 postgresql_where=sa.text('deleted_at IS NOT NULL'))
+
+
+def downgrade():
+    op.set_timeouts(lock_timeout='2s')
+    op.drop_index_concurrently('ix_venue_deleted_at')
+    op.drop_column('venue', 'deleted_at')
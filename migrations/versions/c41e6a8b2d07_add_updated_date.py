@@ -0,0 +1,33 @@
+"""add updated_date
+
+Revision ID: c41e6a8b2d07
+Revises: b8c2f4d6e913
+Create Date: 2026-10-19 14:08:17.203395
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41e6a8b2d07'
+down_revision = 'b8c2f4d6e913'
+branch_labels = None
+depends_on = None
+
+
+# the app writes naive utc, now() alone would be the server's local time.
+# Stable, so postgres stores it once as the fast default without a rewrite
+UTC_NOW = sa.text("timezone('utc', now())")
+
+
+def upgrade():
+    op.set_timeouts(lock_timeout='2s')
+    op.add_column('artist', sa.Column('updated_date', sa.DateTime(), nullable=False, server_default=UTC_NOW))
+    op.add_column('venue', sa.Column('updated_date', sa.DateTime(), nullable=False, server_default=UTC_NOW))
+
+
+def downgrade():
+    op.set_timeouts(lock_timeout='2s')
+    op.drop_column('venue', 'updated_date')
+    op.drop_column('artist', 'updated_date')
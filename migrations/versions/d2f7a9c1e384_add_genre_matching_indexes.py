@@ -0,0 +1,33 @@
+"""add genre matching indexes
+
+Revision ID: d2f7a9c1e384
+Revises: c41e6a8b2d07
+Create Date: 2026-10-19 14:52:40.771906
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2f7a9c1e384'
+down_revision = 'c41e6a8b2d07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.set_timeouts(lock_timeout='2s')
+    # btree_gin lets the scalar state column share a GIN index with the genres array
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gin")
+    op.create_index_concurrently('ix_artist_seeking_state_genres', 'artist', ['state', 'genres'], unique=False,
+                                 postgresql_using='gin', postgresql_where=sa.text('seeking_venue'))
+    op.create_index_concurrently('ix_venue_seeking_state_genres', 'venue', ['state', 'genres'], unique=False,
+                                 postgresql_using='gin',
+                                 postgresql_where=sa.text('seeking_talent AND deleted_at IS NULL'))
+
+
+def downgrade():
+    op.set_timeouts(lock_timeout='2s')
+    op.drop_index_concurrently('ix_venue_seeking_state_genres')
+    op.drop_index_concurrently('ix_artist_seeking_state_genres')
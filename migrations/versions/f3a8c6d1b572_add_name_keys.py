@@ -0,0 +1,86 @@
+"""add name keys
+
+Revision ID: f3a8c6d1b572
+Revises: e5b1c3f7a920
+Create Date: 2026-10-19 17:12:46.203915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a8c6d1b572'
+down_revision = 'e5b1c3f7a920'
+branch_labels = None
+depends_on = None
+
+NAME_KEY = "fold_name(name) || '|' || fold_name(city) || '|' || fold_name(state)"
+
+
+def upgrade():
+    op.set_timeouts(lock_timeout='2s')
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute("""
+        CREATE OR REPLACE FUNCTION fold_name(value text) RETURNS text AS $$
+            SELECT btrim(regexp_replace(regexp_replace(lower(value), '[^[:alnum:][:space:]]+', '', 'g'),
+                                        '[[:space:]]+', ' ', 'g'))
+        $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION set_name_key() RETURNS trigger AS $$
+        BEGIN
+            NEW.name_key := fold_name(NEW.name) || '|' || fold_name(NEW.city) || '|' || fold_name(NEW.state);
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+
+    for table in ('venue', 'artist'):
+        op.add_column(table, sa.Column('name_key', sa.String(), nullable=True))
+        # rows written from here on get their key from the trigger, the backfill does the rest
+        op.execute(f"""
+            CREATE TRIGGER {table}_name_key BEFORE INSERT OR UPDATE OF name, city, state ON {table}
+            FOR EACH ROW EXECUTE PROCEDURE set_name_key()
+        """)
+        op.backfill(table, f'name_key = {NAME_KEY}', where='name_key IS NULL')
+
+    # duplicates already listed keep no key, so the unique indexes can be
+    # built. `flask find-duplicates` lists them for merging
+    op.execute("""
+        UPDATE venue SET name_key = NULL
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (PARTITION BY name_key ORDER BY id) AS n
+                FROM venue WHERE deleted_at IS NULL
+            ) ranked WHERE n > 1
+        )
+    """)
+    op.execute("""
+        UPDATE artist SET name_key = NULL
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (PARTITION BY name_key ORDER BY id) AS n FROM artist
+            ) ranked WHERE n > 1
+        )
+    """)
+
+    op.create_index_concurrently('ux_venue_name_key', 'venue', ['name_key'], unique=True,
+                                 postgresql_where=sa.text('deleted_at IS NULL'))
+    op.create_index_concurrently('ux_artist_name_key', 'artist', ['name_key'], unique=True)
+    op.create_index_concurrently('ix_venue_name_trgm', 'venue', [sa.text('fold_name(name) gin_trgm_ops')],
+                                 postgresql_using='gin')
+    op.create_index_concurrently('ix_artist_name_trgm', 'artist', [sa.text('fold_name(name) gin_trgm_ops')],
+                                 postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index_concurrently('ix_artist_name_trgm')
+    op.drop_index_concurrently('ix_venue_name_trgm')
+    op.drop_index_concurrently('ux_artist_name_key')
+    op.drop_index_concurrently('ux_venue_name_key')
+    for table in ('artist', 'venue'):
+        op.execute(f'DROP TRIGGER IF EXISTS {table}_name_key ON {table}')
+        op.drop_column(table, 'name_key')
+    op.execute('DROP FUNCTION IF EXISTS set_name_key()')
+    op.execute('DROP FUNCTION IF EXISTS fold_name(text)')
@@ -1,58 +1,303 @@
+import re
+import sqlite3
 from datetime import datetime
 
 from flask import Flask
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
 
 app = Flask(__name__)
 db = SQLAlchemy()
 migrate = Migrate(app, db)
 
 
+def is_postgresql():
+    # postgres only fast paths check this, everything else also runs on sqlite
+    return db.engine.dialect.name == 'postgresql'
+
+
+# ----------------------------------------------------------------------------#
+# Portable types.
+# ----------------------------------------------------------------------------#
+
+class Genres(db.TypeDecorator):
+    """
+    A list of genre names. A varchar[] on postgres, which the GIN indexes
+    and the array operators of matching.py rely on, JSON text elsewhere.
+    """
+    impl = db.JSON
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(ARRAY(db.String))
+        return dialect.type_descriptor(db.JSON())
+
+
+class transaction_id(FunctionElement):
+    type = db.BigInteger()
+
+
+@compiles(transaction_id)
+def _transaction_id(element, compiler, **kw):
+    # sqlite has no transaction ids, outbox consumers need postgres anyway
+    return '0'
+
+
+@compiles(transaction_id, 'postgresql')
+def _transaction_id_postgresql(element, compiler, **kw):
+    return 'txid_current()'
+
+
+class utc_now(FunctionElement):
+    type = db.DateTime()
+
+
+@compiles(utc_now)
+def _utc_now(element, compiler, **kw):
+    return 'CURRENT_TIMESTAMP'
+
+
+@compiles(utc_now, 'postgresql')
+def _utc_now_postgresql(element, compiler, **kw):
+    return "timezone('utc', now())"
+
+
+# ----------------------------------------------------------------------------#
+# Duplicate keys.
+# ----------------------------------------------------------------------------#
+
+def fold_name(value):
+    # lower case, punctuation dropped, whitespace collapsed. Mirrors the
+    # fold_name() SQL function below, sqlite calls this one directly
+    if value is None:
+        return None
+    return ' '.join(re.sub(r'[^\w\s]|_', '', value.lower()).split())
+
+
+@event.listens_for(Engine, 'connect')
+def _configure_sqlite(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function('fold_name', 1, fold_name, deterministic=True)
+        # off by default, the ON DELETE CASCADE of shows relies on it
+        dbapi_connection.execute('PRAGMA foreign_keys=ON')
+
+
+# venue.name_key / artist.name_key hold fold_name(name)|fold_name(city)|fold_name(state),
+# kept up to date by triggers so that Core updates and bulk inserts get them too.
+# Also created by migration f3a8c6d1b572
+FOLD_NAME_FUNCTION = DDL("""
+    CREATE OR REPLACE FUNCTION fold_name(value text) RETURNS text AS $$
+        SELECT btrim(regexp_replace(regexp_replace(lower(value), '[^[:alnum:][:space:]]+', '', 'g'),
+                                    '[[:space:]]+', ' ', 'g'))
+    $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE
+""")
+NAME_KEY_FUNCTION = DDL("""
+    CREATE OR REPLACE FUNCTION set_name_key() RETURNS trigger AS $$
+    BEGIN
+        NEW.name_key := fold_name(NEW.name) || '|' || fold_name(NEW.city) || '|' || fold_name(NEW.state);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+""")
+event.listen(db.metadata, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+event.listen(db.metadata, 'before_create', FOLD_NAME_FUNCTION.execute_if(dialect='postgresql'))
+event.listen(db.metadata, 'before_create', NAME_KEY_FUNCTION.execute_if(dialect='postgresql'))
+
+
+def listen_name_key(table):
+    event.listen(table, 'after_create', DDL("""
+        CREATE TRIGGER %(table)s_name_key BEFORE INSERT OR UPDATE OF name, city, state ON %(table)s
+        FOR EACH ROW EXECUTE PROCEDURE set_name_key()
+    """).execute_if(dialect='postgresql'))
+    # similar names for dedup.py
+    event.listen(table, 'after_create', DDL(
+        'CREATE INDEX ix_%(table)s_name_trgm ON %(table)s USING gin (fold_name(name) gin_trgm_ops)'
+    ).execute_if(dialect='postgresql'))
+
+    # sqlite triggers can't assign NEW, they update the row right after
+    for operation in ('INSERT', 'UPDATE OF name, city, state'):
+        event.listen(table, 'after_create', DDL(f"""
+            CREATE TRIGGER %(table)s_name_key_{operation.split()[0].lower()} AFTER {operation} ON %(table)s
+            BEGIN
+                UPDATE %(table)s SET name_key = fold_name(NEW.name) || '|' || fold_name(NEW.city) || '|' ||
+                                                fold_name(NEW.state)
+                WHERE id = NEW.id;
+            END
+        """).execute_if(dialect='sqlite'))
+
+
 # ----------------------------------------------------------------------------#
 # Models.
 # ----------------------------------------------------------------------------#
 
 class Venue(db.Model):
     __tablename__ = 'venue'
+    __table_args__ = (
+        db.Index('ix_venue_state_city', 'state', 'city'),
+        db.Index('ix_venue_deleted_at', 'deleted_at', postgresql_where=db.text('deleted_at IS NOT NULL')),
+        # genre matchmaking, see matching.py
+        db.Index('ix_venue_seeking_state_genres', 'state', 'genres', postgresql_using='gin',
+                 postgresql_where=db.text('seeking_talent AND deleted_at IS NULL')),
+        # one listing per name in a city, inserts of a duplicate fail with an IntegrityError
+        db.Index('ux_venue_name_key', 'name_key', unique=True,
+                 postgresql_where=db.text('deleted_at IS NULL'), sqlite_where=db.text('deleted_at IS NULL')),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
     city = db.Column(db.String(120), nullable=False)
     state = db.Column(db.String(120), nullable=False)
     address = db.Column(db.String(120), nullable=False)
-    genres = db.Column(db.ARRAY(db.String), nullable=False)
+    genres = db.Column(Genres, nullable=False)
     phone = db.Column(db.String(120), nullable=False)
     image_link = db.Column(db.String(500), nullable=False)
     facebook_link = db.Column(db.String(120), nullable=False)
     website = db.Column(db.String(120), nullable=False)
-    shows = db.relationship('Show', backref='venue', lazy=True)
+    # passive_deletes leaves removing the shows to the ON DELETE CASCADE
+    # instead of loading every one of them before deleting the venue
+    shows = db.relationship('Show', backref='venue', lazy=True, cascade='all', passive_deletes=True)
     seeking_talent = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String(500), nullable=True)
     created_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # bumped on edits and whenever one of its shows is added or removed
+    updated_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # set when a venue with a long history is deleted, its shows are purged in the background
+    deleted_at = db.Column(db.DateTime, nullable=True)
+    # bumped on every update, edits are rejected when it moved since the form was rendered
+    version = db.Column(db.Integer, nullable=False, default=1)
+    # set by the name_key triggers, null for the duplicates the migration found
+    name_key = db.Column(db.String, nullable=True, server_default=db.FetchedValue(), server_onupdate=db.FetchedValue())
+
+    __mapper_args__ = {'version_id_col': version}
+
+
+listen_name_key(Venue.__table__)
 
 
 class Artist(db.Model):
     __tablename__ = 'artist'
+    __table_args__ = (
+        db.Index('ix_artist_seeking_state_genres', 'state', 'genres', postgresql_using='gin',
+                 postgresql_where=db.text('seeking_venue')),
+        db.Index('ux_artist_name_key', 'name_key', unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
     city = db.Column(db.String(120), nullable=False)
     state = db.Column(db.String(120), nullable=False)
     phone = db.Column(db.String(120), nullable=False)
-    genres = db.Column(db.ARRAY(db.String), nullable=False)
+    genres = db.Column(Genres, nullable=False)
     image_link = db.Column(db.String(500), nullable=False)
     facebook_link = db.Column(db.String(120), nullable=False)
     website = db.Column(db.String(120), nullable=False)
-    shows = db.relationship('Show', backref='artist', lazy=True)
+    shows = db.relationship('Show', backref='artist', lazy=True, cascade='all', passive_deletes=True)
     seeking_venue = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String(500), nullable=True)
     created_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # bumped on edits and whenever one of its shows is added or removed
+    updated_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    name_key = db.Column(db.String, nullable=True, server_default=db.FetchedValue(), server_onupdate=db.FetchedValue())
+
+    __mapper_args__ = {'version_id_col': version}
+
+
+listen_name_key(Artist.__table__)
 
 
 class Show(db.Model):
     __tablename__ = 'show'
+    __table_args__ = (
+        # calendar windows are range scans on start_time, globally or per venue / artist
+        db.Index('ix_show_start_time', 'start_time'),
+        db.Index('ix_show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_show_artist_id_start_time', 'artist_id', 'start_time'),
+        # show_venue_no_overlap / show_artist_no_overlap are GiST exclusion
+        # constraints over tsrange(start_time, start_time + duration), they are
+        # created by migration 4f8a1d2c9e60. Sqlite gets the trigger below
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     venue_id = db.Column(db.Integer(), db.ForeignKey('venue.id', ondelete='CASCADE'), nullable=False)
     artist_id = db.Column(db.Integer(), db.ForeignKey('artist.id', ondelete='CASCADE'), nullable=False)
     start_time = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # shows without a duration only conflict with shows starting at the same time
+    duration = db.Column(db.Interval, nullable=True)
+
+
+# the exclusion constraints for embedded sqlite databases, raising an
+# IntegrityError mentioning show_no_overlap. Like there, bookings are
+# half-open [start, end) and shows without a duration a single point.
+# Intervals are stored as datetimes after the epoch (julian day 2440587.5)
+SHOW_NO_OVERLAP_TRIGGER = DDL("""
+    CREATE TRIGGER show_no_overlap BEFORE INSERT ON show
+    WHEN EXISTS (
+        SELECT 1 FROM show
+        WHERE (venue_id = NEW.venue_id OR artist_id = NEW.artist_id)
+          AND (julianday(start_time) < julianday(NEW.start_time) + coalesce(julianday(NEW.duration) - 2440587.5, 0)
+               OR (NEW.duration IS NULL AND julianday(start_time) = julianday(NEW.start_time)))
+          AND (julianday(NEW.start_time) < julianday(start_time) + coalesce(julianday(duration) - 2440587.5, 0)
+               OR (duration IS NULL AND julianday(start_time) = julianday(NEW.start_time)))
+    )
+    BEGIN
+        SELECT RAISE(ABORT, 'show_no_overlap');
+    END
+""").execute_if(dialect='sqlite')
+event.listen(Show.__table__, 'after_create', SHOW_NO_OVERLAP_TRIGGER)
+
+
+class OutboxEvent(db.Model):
+    """
+    A change to a venue, artist or show, written in the same transaction as
+    the change itself and read in order by outbox.OutboxConsumer.
+    """
+    __tablename__ = 'outbox_event'
+    __table_args__ = (
+        db.Index('ix_outbox_event_txid_id', 'txid', 'id'),
+    )
+
+    # sqlite only autoincrements INTEGER PRIMARY KEY columns
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    # ids are handed out before commit, so they don't follow commit order. The
+    # writing transaction's id lets consumers only read past the oldest one
+    # still running, see OutboxConsumer
+    txid = db.Column(db.BigInteger, nullable=False, server_default=transaction_id())
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(20), nullable=False)
+    payload = db.Column(db.JSON, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, server_default=utc_now())
+
+
+class OutboxPosition(db.Model):
+    # last event each named consumer acknowledged
+    __tablename__ = 'outbox_position'
+
+    name = db.Column(db.String(100), primary_key=True)
+    txid = db.Column(db.BigInteger, nullable=False)
+    event_id = db.Column(db.BigInteger, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# wakes up listening consumers once per inserting statement, delivered on commit.
+# Also created by migration e5b1c3f7a920
+OUTBOX_NOTIFY_FUNCTION = DDL("""
+    CREATE OR REPLACE FUNCTION outbox_event_notify() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('fyyur_outbox', '');
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+""")
+OUTBOX_NOTIFY_TRIGGER = DDL("""
+    CREATE TRIGGER outbox_event_notify AFTER INSERT ON outbox_event
+    FOR EACH STATEMENT EXECUTE PROCEDURE outbox_event_notify()
+""")
+event.listen(OutboxEvent.__table__, 'after_create', OUTBOX_NOTIFY_FUNCTION.execute_if(dialect='postgresql'))
+event.listen(OutboxEvent.__table__, 'after_create', OUTBOX_NOTIFY_TRIGGER.execute_if(dialect='postgresql'))
@@ -0,0 +1,166 @@
+import json
+import select
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from models import db, OutboxEvent
+
+# ----------------------------------------------------------------------------#
+# Transactional outbox.
+# ----------------------------------------------------------------------------#
+
+# notified by the outbox_event trigger, see models.py
+CHANNEL = 'fyyur_outbox'
+
+
+def event(entity, action, entity_id, payload=None):
+    return {"entity": entity, "action": action, "entity_id": entity_id, "payload": payload}
+
+
+def record(*events):
+    # staged on the current transaction, consumers see the events once (and
+    # only if) it commits
+    if events:
+        db.session.execute(OutboxEvent.__table__.insert(), list(events))
+
+
+# Events of transactions older than the oldest one still running can't
+# change anymore, reading only those (in txid order) never skips an event
+# whose transaction committed late.
+READ_EVENTS = text("""
+    SELECT id, txid, entity, entity_id, action, payload, created_at
+    FROM outbox_event
+    WHERE (txid, id) > (:txid, :event_id) AND txid < txid_snapshot_xmin(txid_current_snapshot())
+    ORDER BY txid, id
+    LIMIT :limit
+""")
+
+READ_POSITION = text("SELECT txid, event_id FROM outbox_position WHERE name = :name")
+
+SAVE_POSITION = text("""
+    INSERT INTO outbox_position (name, txid, event_id, updated_at)
+    VALUES (:name, :txid, :event_id, now())
+    ON CONFLICT (name) DO UPDATE SET txid = excluded.txid, event_id = excluded.event_id, updated_at = now()
+""")
+
+
+class OutboxConsumer:
+    """
+    Delivers outbox events in order to one named consumer, at least once.
+
+    The consumer resumes after the last event it acknowledged, its position
+    is kept in outbox_position. It waits on LISTEN fyyur_outbox between
+    batches and also polls every `poll_interval` seconds, which picks up
+    events held back by a long running transaction.
+
+        consumer = OutboxConsumer(db.engine, 'search-index')
+        consumer.run(lambda event: reindex(event.entity, event.entity_id))
+    """
+
+    def __init__(self, engine, name, batch_size=500, poll_interval=5):
+        self.engine = engine
+        self.name = name
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        # what has been read, which can be ahead of what has been acknowledged
+        self._read = None
+
+    def position(self):
+        with self.engine.connect() as connection:
+            row = connection.execute(READ_POSITION, {"name": self.name}).first()
+        return (row.txid, row.event_id) if row else (0, 0)
+
+    def skip_to_end(self):
+        # read from the newest event on instead of the saved position
+        with self.engine.connect() as connection:
+            self._read = tuple(connection.execute(
+                text('SELECT coalesce(max(txid), 0), coalesce(max(id), 0) FROM outbox_event')
+            ).first())
+
+    def poll(self):
+        """Return the next batch of events, possibly empty."""
+        if self._read is None:
+            self._read = self.position()
+
+        txid, event_id = self._read
+        with self.engine.connect() as connection:
+            events = connection.execute(READ_EVENTS, {
+                "txid": txid, "event_id": event_id, "limit": self.batch_size
+            }).fetchall()
+        if events:
+            self._read = (events[-1].txid, events[-1].id)
+        return events
+
+    def ack(self, event):
+        """Persist that everything up to and including `event` was handled."""
+        with self.engine.begin() as connection:
+            connection.execute(SAVE_POSITION, {"name": self.name, "txid": event.txid, "event_id": event.id})
+
+    @contextmanager
+    def listener(self):
+        """A psycopg2 connection listening on the outbox channel."""
+        connection = self.engine.raw_connection()
+        listener = connection.connection
+        try:
+            listener.autocommit = True
+            listener.cursor().execute(f'LISTEN {CHANNEL}')
+            yield listener
+        finally:
+            listener.cursor().execute(f'UNLISTEN {CHANNEL}')
+            listener.autocommit = False
+            connection.close()
+
+    def batches(self):
+        """Yield non empty batches of events forever, blocking in between."""
+        with self.listener() as listener:
+            while True:
+                events = self.poll()
+                if events:
+                    yield events
+                    if len(events) == self.batch_size:
+                        continue
+
+                select.select([listener], [], [], self.poll_interval)
+                listener.poll()
+                del listener.notifies[:]
+
+    def run(self, handler):
+        """Call `handler(event)` for every event, acknowledging after each batch."""
+        for events in self.batches():
+            for event in events:
+                handler(event)
+            self.ack(events[-1])
+
+
+@click.command('outbox-tail')
+@click.option('--consumer', default=None, help='Resume from and acknowledge as this consumer.')
+@with_appcontext
+def outbox_tail_command(consumer):
+    """Print outbox events as JSON lines as they are committed."""
+    reader = OutboxConsumer(db.engine, consumer or 'outbox-tail')
+    if consumer is None:
+        reader.skip_to_end()
+
+    for events in reader.batches():
+        for event in events:
+            click.echo(json.dumps(dict(event), default=str))
+        if consumer is not None:
+            reader.ack(events[-1])
+
+
+@click.command('outbox-prune')
+@click.option('--days', default=7, show_default=True, help='Keep events at least this long.')
+@with_appcontext
+def outbox_prune_command(days):
+    """Delete old events every consumer has acknowledged."""
+    deleted = db.session.execute(text("""
+        DELETE FROM outbox_event
+        WHERE created_at < :before
+          AND (txid, id) <= (SELECT txid, event_id FROM outbox_position ORDER BY txid, event_id LIMIT 1)
+    """), {"before": datetime.utcnow() - timedelta(days=days)}).rowcount
+    db.session.commit()
+    click.echo(f'Deleted {deleted} events.')
@@ -0,0 +1,226 @@
+import cProfile
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+import click
+from flask import current_app, g, request
+from flask.cli import with_appcontext
+from itsdangerous import BadSignature, TimestampSigner
+from sqlalchemy import event
+
+from models import db
+
+# ----------------------------------------------------------------------------#
+# Per-request profiling.
+# ----------------------------------------------------------------------------#
+
+PROFILE_HEADER = 'X-Fyyur-Profile'
+
+# (category, file suffix, function name or None for any function in the file)
+# when classifying a sample the innermost matching frame wins, so a lazy load
+# issued from a template counts as sql and format_datetime as filters
+MARKERS = [
+    ('sql', os.path.join('sqlalchemy', 'engine', 'default.py'), 'do_execute'),
+    ('sql', os.path.join('sqlalchemy', 'engine', 'default.py'), 'do_executemany'),
+    ('filters', 'app.py', 'format_datetime'),
+    ('orm', os.path.join('sqlalchemy', 'orm', 'loading.py'), None),
+    ('template', '.html', None),
+    ('template', os.path.join('jinja2', 'environment.py'), 'render'),
+]
+
+
+def classify(code):
+    for category, suffix, name in MARKERS:
+        if code.co_filename.endswith(suffix) and (name is None or code.co_name == name):
+            return category
+    return None
+
+
+class StackSampler:
+    """
+    Samples the stack of one thread at a fixed interval and keeps the
+    collapsed stacks ("root;caller;callee count") flame graph tools read.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.categories = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+
+            stack = []
+            category = None
+            while frame is not None:
+                code = frame.f_code
+                if category is None:
+                    category = classify(code)
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.categories[category or 'other'] += 1
+
+    def write(self, path, elapsed):
+        with open(path + '.folded', 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+        # share of samples per category scaled to the request's wall time
+        total = sum(self.categories.values()) or 1
+        return {category: round(count / total * elapsed, 6) for category, count in self.categories.items()}
+
+
+class DeterministicProfiler:
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def write(self, path, elapsed):
+        # .prof files load in snakeviz / flameprof / gprof2dot
+        self.profile.dump_stats(path + '.prof')
+
+        # cumulative time of the marker functions. Categories nest here (the
+        # template time includes its filters), and for markers covering a
+        # whole file the outermost function's cumulative time is used
+        split = Counter()
+        for (filename, line, name), (_, _, _, cumulative, _) in pstats.Stats(self.profile).stats.items():
+            for category, suffix, marker in MARKERS:
+                if filename.endswith(suffix) and (marker is None or name == marker):
+                    split[category] = max(split[category], cumulative)
+                    break
+        return {category: round(seconds, 6) for category, seconds in split.items()}
+
+
+def _requested_mode(app):
+    token = request.headers.get(PROFILE_HEADER)
+    key = app.config.get('PROFILE_SIGNING_KEY')
+
+    if token and key:
+        try:
+            mode = TimestampSigner(key).unsign(token, max_age=app.config['PROFILE_TOKEN_MAX_AGE']).decode()
+            if mode in ('sampling', 'deterministic'):
+                return mode
+        except BadSignature:
+            pass
+
+    if random.random() < app.config['PROFILE_SAMPLE_RATE']:
+        return 'sampling'
+    return None
+
+
+def _prune(directory, keep):
+    # bounded retention, drop the oldest profiles beyond `keep` requests
+    profiles = sorted(
+        (entry for entry in os.scandir(directory) if entry.name.endswith('.json')),
+        key=lambda entry: entry.stat().st_mtime
+    )
+    for entry in profiles[:max(0, len(profiles) - keep)]:
+        prefix = entry.path[:-len('.json')]
+        for suffix in ('.json', '.folded', '.prof'):
+            try:
+                os.remove(prefix + suffix)
+            except FileNotFoundError:
+                pass
+
+
+def init_profiling(app):
+    state = threading.local()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if getattr(state, 'sql', None) is not None:
+            context._profile_started = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_profile_started', None)
+        if started is not None and getattr(state, 'sql', None) is not None:
+            state.sql.append(time.perf_counter() - started)
+
+    @app.before_request
+    def start_profile():
+        mode = _requested_mode(app)
+        if mode is None:
+            return
+
+        engine = db.engine
+        if not event.contains(engine, 'before_cursor_execute', before_cursor_execute):
+            event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+        if mode == 'sampling':
+            profiler = StackSampler(threading.get_ident(), app.config['PROFILE_SAMPLE_INTERVAL'])
+        else:
+            profiler = DeterministicProfiler()
+
+        state.sql = []
+        g.profile = (mode, profiler, time.perf_counter())
+        profiler.start()
+
+    @app.teardown_request
+    def stop_profile(error=None):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+
+        mode, profiler, started = profile
+        profiler.stop()
+        elapsed = time.perf_counter() - started
+        sql = state.sql
+        state.sql = None
+
+        directory = app.config['PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{time.strftime("%Y%m%dT%H%M%S")}-{request.endpoint}-{os.getpid()}-{threading.get_ident()}')
+
+        split = profiler.write(path, elapsed)
+        # statement timings come from engine events, more precise than samples
+        split['sql_statements'] = round(sum(sql), 6)
+
+        with open(path + '.json', 'w') as f:
+            json.dump({
+                "method": request.method,
+                "path": request.full_path,
+                "endpoint": request.endpoint,
+                "mode": mode,
+                "elapsed": round(elapsed, 6),
+                "statements": len(sql),
+                "split": split,
+            }, f, indent=2, sort_keys=True)
+
+        _prune(directory, app.config['PROFILE_MAX_FILES'])
+
+
+@click.command('profile-token')
+@click.option('--mode', type=click.Choice(['sampling', 'deterministic']), default='sampling', show_default=True)
+@with_appcontext
+def profile_token_command(mode):
+    """Print a header that turns on profiling for a request."""
+    key = current_app.config.get('PROFILE_SIGNING_KEY')
+    if not key:
+        raise click.UsageError('PROFILE_SIGNING_KEY is not set')
+    click.echo(f'{PROFILE_HEADER}: {TimestampSigner(key).sign(mode).decode()}')
@@ -0,0 +1,75 @@
+import threading
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, text
+
+from models import db, Venue, Artist, Show
+
+# ----------------------------------------------------------------------------#
+# Purging soft-deleted venues.
+# ----------------------------------------------------------------------------#
+
+DELETE_SHOWS_CHUNK = text("""
+    DELETE FROM show
+    WHERE id IN (SELECT id FROM show WHERE venue_id = :venue_id LIMIT :chunk_size)
+""")
+
+
+def purge_venue(venue_id, chunk_size, pause):
+    """
+    Delete a soft-deleted venue's shows a chunk at a time, each chunk in its
+    own short transaction so no lock on `show` is held for long, then delete
+    the venue itself. Safe to re-run after an interruption.
+    """
+    # the artists' pages lose these shows, invalidate their validators
+    db.session.execute(
+        Artist.__table__.update().
+        where(Artist.id.in_(select([Show.artist_id]).where(Show.venue_id == venue_id))).
+        values(updated_date=datetime.utcnow())
+    )
+    db.session.commit()
+
+    while True:
+        deleted = db.session.execute(DELETE_SHOWS_CHUNK, {"venue_id": venue_id, "chunk_size": chunk_size}).rowcount
+        db.session.commit()
+        if deleted < chunk_size:
+            break
+        # give other writers on `show` room between chunks
+        time.sleep(pause)
+
+    db.session.query(Venue).filter(Venue.id == venue_id, Venue.deleted_at.isnot(None)). \
+        delete(synchronize_session=False)
+    db.session.commit()
+
+
+def purge_in_background(app, venue_id):
+    def run():
+        with app.app_context():
+            try:
+                purge_venue(venue_id, app.config['PURGE_CHUNK_SIZE'], app.config['PURGE_PAUSE'])
+            except Exception:
+                # `flask purge-deleted` picks up whatever is left over
+                db.session.rollback()
+                app.logger.exception('purging venue %s failed', venue_id)
+            finally:
+                db.session.remove()
+
+    thread = threading.Thread(target=run, daemon=True, name=f'purge-venue-{venue_id}')
+    thread.start()
+    return thread
+
+
+@click.command('purge-deleted')
+@with_appcontext
+def purge_deleted_command():
+    """Finish purging soft-deleted venues, e.g. after a worker restart."""
+    config = current_app.config
+    venue_ids = [id for id, in db.session.query(Venue.id).filter(Venue.deleted_at.isnot(None))]
+
+    for venue_id in venue_ids:
+        purge_venue(venue_id, config['PURGE_CHUNK_SIZE'], config['PURGE_PAUSE'])
+        click.echo(f'Purged venue {venue_id}.')
@@ -0,0 +1,230 @@
+import json
+import sys
+from collections import defaultdict
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event
+
+from config import engine_options
+from models import db, Artist, Show, Venue
+from seed import seed_database
+from slowlog import normalize_statement
+
+# ----------------------------------------------------------------------------#
+# Query budgets.
+# ----------------------------------------------------------------------------#
+
+VENUE_FORM = {
+    "name": 'Budget Hall',
+    "city": 'San Francisco',
+    "state": 'CA',
+    "address": '1 Market St',
+    "phone": '+1 650-253-0000',
+    "image_link": 'https://images.example.com/budget.jpg',
+    "genres": ['Jazz', 'Blues'],
+    "facebook_link": 'https://www.facebook.com/budget',
+    "website": 'https://budget.example.com',
+    "seeking_description": '',
+}
+
+ARTIST_FORM = {
+    "name": 'Budget Band',
+    "city": 'San Francisco',
+    "state": 'CA',
+    "phone": '+1 650-253-0000',
+    "image_link": 'https://images.example.com/band.jpg',
+    "genres": ['Jazz'],
+    "facebook_link": 'https://www.facebook.com/band',
+    "website": 'https://band.example.com',
+    "seeking_description": '',
+}
+
+# endpoint -> (method, url, extra test client arguments, max number of
+# statements, expected status) every route registered in app.py must be listed
+# here. The seeded dataset has many shows per venue and artist, so any lazy
+# load of venue.shows, show.venue or show.artist inside a loop blows through
+# these numbers.
+BUDGETS = {
+    'index': ('GET', '/', {}, 2, 200),
+    'venues': ('GET', '/venues', {}, 1, 200),
+    'search_venues': ('POST', '/venues/search', {"data": {"search_term": 'room'}}, 1, 200),
+    'show_venue': ('GET', '/venues/{venue_id}', {}, 3, 200),
+    'create_venue_form': ('GET', '/venues/create', {}, 0, 200),
+    'create_venue_submission': ('POST', '/venues/create', {"data": VENUE_FORM}, 4, 200),
+    'edit_venue': ('GET', '/venues/{venue_id}/edit', {}, 1, 200),
+    'edit_venue_submission': ('POST', '/venues/{venue_id}/edit', {"data": dict(VENUE_FORM, name='Budget Hall Annex', version='1')}, 3, 302),
+    'artists': ('GET', '/artists', {}, 1, 200),
+    'search_artists': ('POST', '/artists/search', {"data": {"search_term": 'collective'}}, 1, 200),
+    'show_artist': ('GET', '/artists/{artist_id}', {}, 3, 200),
+    'create_artist_form': ('GET', '/artists/create', {}, 0, 200),
+    'create_artist_submission': ('POST', '/artists/create', {"data": ARTIST_FORM}, 4, 200),
+    'edit_artist': ('GET', '/artists/{artist_id}/edit', {}, 1, 200),
+    'edit_artist_submission': ('POST', '/artists/{artist_id}/edit', {"data": dict(ARTIST_FORM, name='Budget Band Trio', version='1')}, 3, 302),
+    'shows': ('GET', '/shows', {}, 1, 200),
+    'create_shows': ('GET', '/shows/create', {}, 0, 200),
+    'create_show_submission': ('POST', '/shows/create', {"data": {
+        "artist_id": '{artist_id}', "venue_id": '{venue_id}', "start_time": '2031-01-01 20:00'
+    }}, 4, 200),
+    'create_shows_batch': ('POST', '/shows/batch', {"json": {"shows": [
+        {"artist_id": '{artist_id}', "venue_id": '{venue_id}', "start_time": '2032-01-01 20:00'},
+        {"artist_id": '{artist_id}', "venue_id": '{venue_id}', "start_time": '2032-01-02 20:00'},
+    ]}}, 5, 201),
+    'calendar': ('GET', '/calendar?city=Austin&state=TX', {}, 1, 200),
+    'venue_calendar': ('GET', '/venues/{venue_id}/calendar', {}, 1, 200),
+    'artist_calendar': ('GET', '/artists/{artist_id}/calendar', {}, 1, 200),
+    'venue_ical': ('GET', '/venues/{venue_id}/shows.ics', {}, 3, 200),
+    'artist_ical': ('GET', '/artists/{artist_id}/shows.ics', {}, 3, 200),
+    'venue_matches': ('GET', '/venues/{venue_id}/matches', {}, 2, 200),
+    'artist_matches': ('GET', '/artists/{artist_id}/matches', {}, 2, 200),
+    # a bad token never reaches the cache or the network
+    'image': ('GET', '/images/tile/not-a-token', {}, 0, 404),
+    'sitemap_index': ('GET', '/sitemap.xml', {}, 0, 404),
+    'sitemap': ('GET', '/sitemaps/sitemap-venues-1.xml.gz', {}, 0, 404),
+    'autocomplete_artists': ('GET', '/autocomplete/artists?q=jazz', {}, 1, 200),
+    'autocomplete_venues': ('GET', '/autocomplete/venues?q=the', {}, 1, 200),
+    # runs last, it removes the venue the other routes look at
+    'delete_venue': ('DELETE', '/venues/{venue_id}', {}, 5, 302),
+}
+
+# sqlite has no RETURNING for the batch insert, app.py inserts its shows one by one
+SQLITE_BUDGETS = {
+    'create_shows_batch': 6,
+}
+
+
+def _exists(model, *criteria):
+    return db.session.query(model.id).filter(*criteria).first() is not None
+
+
+def _batch_shows(ids):
+    return db.session.query(Show.id).filter(
+        Show.venue_id == ids['venue_id'], Show.start_time >= datetime(2032, 1, 1), Show.start_time < datetime(2032, 1, 3)
+    ).count()
+
+
+# endpoint -> (what the request must have done, check). Failed writes flash an
+# error and still answer 200 / 302, the status alone doesn't tell
+POSTCONDITIONS = {
+    'create_venue_submission': ('venue created', lambda ids: _exists(Venue, Venue.name == VENUE_FORM['name'])),
+    'edit_venue_submission': ('venue renamed', lambda ids: _exists(
+        Venue, Venue.id == ids['venue_id'], Venue.name == 'Budget Hall Annex')),
+    'create_artist_submission': ('artist created', lambda ids: _exists(Artist, Artist.name == ARTIST_FORM['name'])),
+    'edit_artist_submission': ('artist renamed', lambda ids: _exists(
+        Artist, Artist.id == ids['artist_id'], Artist.name == 'Budget Band Trio')),
+    'create_show_submission': ('show created', lambda ids: _exists(
+        Show, Show.venue_id == ids['venue_id'], Show.start_time == datetime(2031, 1, 1, 20))),
+    'create_shows_batch': ('2 shows created', lambda ids: _batch_shows(ids) == 2),
+    'delete_venue': ('venue deleted', lambda ids: not _exists(
+        Venue, Venue.id == ids['venue_id'], Venue.deleted_at.is_(None))),
+}
+
+
+class StatementRecorder:
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+
+def _format(value, ids):
+    # fill {venue_id} / {artist_id} placeholders anywhere in the request
+    if isinstance(value, str):
+        return value.format(**ids)
+    if isinstance(value, dict):
+        return {key: _format(item, ids) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_format(item, ids) for item in value]
+    return value
+
+
+def check_budgets(app, ids, routes=None):
+    # `routes` collects normalized statement -> endpoints issuing it
+    failures = []
+
+    endpoints = {rule.endpoint for rule in app.url_map.iter_rules() if rule.endpoint != 'static'}
+    for endpoint in sorted(endpoints - set(BUDGETS)):
+        failures.append(f'{endpoint}: no query budget declared')
+
+    client = app.test_client()
+    for endpoint, (method, url, kwargs, budget, expected_status) in BUDGETS.items():
+        if db.engine.dialect.name == 'sqlite':
+            budget = SQLITE_BUDGETS.get(endpoint, budget)
+        # requests share the cli's app context, start each one with a fresh session
+        db.session.remove()
+
+        with StatementRecorder(db.engine) as recorder:
+            response = client.open(_format(url, ids), method=method, **_format(kwargs, ids))
+            # streamed responses run their queries while being read
+            response.get_data()
+
+        if routes is not None:
+            for statement in recorder.statements:
+                routes[normalize_statement(statement)].add(endpoint)
+
+        problems = []
+        count = len(recorder.statements)
+        if count > budget:
+            problems.append(f'{count} statements (budget {budget})')
+        if response.status_code != expected_status:
+            problems.append(f'status {response.status_code} (expected {expected_status})')
+        if endpoint in POSTCONDITIONS:
+            # checked on a fresh session, outside the recorded statements
+            db.session.remove()
+            description, check = POSTCONDITIONS[endpoint]
+            if not check(ids):
+                problems.append(f'not {description}')
+
+        status = 'FAIL' if problems else 'ok'
+        click.echo(f'{status:4} {endpoint:28} {count:3}/{budget:<3} {method} {url} -> {response.status_code}')
+
+        if problems:
+            statements = '\n'.join(f'    {statement}' for statement in recorder.statements)
+            failures.append(f'{endpoint}: {", ".join(problems)}\n{statements}')
+
+    return failures
+
+
+@click.command('check-query-budgets')
+@click.option('--database-uri', envvar='QUERY_BUDGET_DATABASE_URI', required=True,
+              help='Scratch database, it gets dropped and re-seeded. sqlite:// works for a quick run.')
+@with_appcontext
+def check_query_budgets_command(database_uri):
+    """Request every route on a seeded database and check its query count."""
+    app = current_app._get_current_object()
+
+    if database_uri == app.config['SQLALCHEMY_DATABASE_URI']:
+        raise click.UsageError('refusing to drop the application database, use a scratch one')
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+        database_uri, app.config['STATEMENT_TIMEOUT'], app.config['LOCK_TIMEOUT']
+    )
+    app.config['TESTING'] = True
+
+    db.drop_all()
+    db.create_all()
+    venue_ids, artist_ids = seed_database(venues=20, artists=30, shows=400)
+    routes = defaultdict(set)
+    failures = check_budgets(app, {"venue_id": venue_ids[0], "artist_id": artist_ids[0]}, routes)
+    db.session.remove()
+    db.drop_all()
+
+    # read by `flask db-report` to name the routes behind pg_stat_statements entries
+    with open(app.config['STATEMENT_ROUTE_MAP'], 'w') as f:
+        json.dump({statement: sorted(endpoints) for statement, endpoints in routes.items()}, f, indent=1)
+
+    if failures:
+        click.echo('\n' + '\n\n'.join(failures), err=True)
+        sys.exit(1)
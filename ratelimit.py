@@ -0,0 +1,170 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+import click
+from flask import abort, current_app, g, request
+from flask.cli import with_appcontext
+
+import metrics
+
+# ----------------------------------------------------------------------------#
+# Rate limiting.
+# ----------------------------------------------------------------------------#
+
+# key hash, tokens left, last refill (unix time)
+SLOT = struct.Struct('<Qdd')
+
+
+class SharedMemoryBackend:
+    """
+    Token buckets in a memory mapped file, shared by every worker process on
+    the host. Keys are hashed into a fixed number of slots, each guarded by a
+    record lock on its byte range. A key landing on a slot held by another
+    key takes it over with a full bucket, which only ever errs on the lenient
+    side.
+    """
+
+    def __init__(self, path, slots=65536):
+        self.slots = slots
+        size = SLOT.size * slots
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        # record locks are per process, threads of a worker queue up here first
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little')
+        offset = digest % self.slots * SLOT.size
+
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, SLOT.size, offset)
+            try:
+                now = time.time()
+                stored, tokens, updated = SLOT.unpack_from(self._map, offset)
+                if stored != digest:
+                    tokens, updated = capacity, now
+                tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+                if tokens >= 1:
+                    tokens -= 1
+                    wait = 0.0
+                else:
+                    wait = (1 - tokens) / rate
+                SLOT.pack_into(self._map, offset, digest, tokens, now)
+                return wait
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, SLOT.size, offset)
+
+
+# refills and takes in one round trip, using the server's clock so that app
+# servers with skewed clocks agree on the buckets
+TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisBackend:
+    """Token buckets in Redis (or anything speaking its protocol), shared across hosts."""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RATE_LIMIT_STORAGE points at redis but the redis package is not installed')
+        self._take = redis.Redis.from_url(url).register_script(TAKE_SCRIPT)
+
+    def take(self, key, capacity, rate):
+        return float(self._take(keys=[f'fyyur:ratelimit:{key}'], args=[capacity, rate]))
+
+
+def create_backend(storage):
+    if storage.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(storage)
+    return SharedMemoryBackend(storage)
+
+
+class RateLimiter:
+    def __init__(self, backend, limits):
+        self.backend = backend
+        # endpoint -> (bucket capacity, tokens added per second)
+        self.limits = {endpoint: (requests, requests / seconds) for endpoint, (requests, seconds) in limits.items()}
+
+    def check(self, endpoint, client):
+        """Take a token for `client` on `endpoint`, return how long to wait (0 when allowed)."""
+        limit = self.limits.get(endpoint)
+        if limit is None:
+            return 0.0
+
+        started = time.perf_counter()
+        try:
+            return self.backend.take(f'{endpoint}:{client}', *limit)
+        finally:
+            metrics.incr('ratelimit.checks')
+            metrics.observe('ratelimit.check', time.perf_counter() - started)
+
+
+def init_rate_limits(app):
+    storage = app.config['RATE_LIMIT_STORAGE']
+    if not storage or not app.config['RATE_LIMITS']:
+        return None
+
+    limiter = RateLimiter(create_backend(storage), app.config['RATE_LIMITS'])
+
+    @app.before_request
+    def enforce_rate_limit():
+        try:
+            # behind a reverse proxy, remote_addr needs ProxyFix to be the client's
+            wait = limiter.check(request.endpoint, request.remote_addr)
+        except Exception:
+            # an unreachable backend must not take the site down with it
+            metrics.incr('ratelimit.errors')
+            app.logger.exception('rate limit check failed')
+            return
+        if wait:
+            metrics.incr('ratelimit.limited')
+            g.retry_after = wait
+            abort(429)
+
+    app.extensions['rate_limiter'] = limiter
+    return limiter
+
+
+@click.command('bench-rate-limit')
+@click.option('--checks', default=100000, show_default=True, help='Checks to time.')
+@click.option('--clients', default=1000, show_default=True, help='Distinct clients to spread them over.')
+@with_appcontext
+def bench_rate_limit_command(checks, clients):
+    """Time rate limit checks against the configured backend."""
+    storage = current_app.config['RATE_LIMIT_STORAGE']
+    if not storage:
+        raise click.UsageError('RATE_LIMIT_STORAGE is not set')
+
+    # a generous limit so every check goes through the full refill / take path
+    limiter = RateLimiter(create_backend(storage), {"bench": (checks, 1)})
+    started = time.perf_counter()
+    for i in range(checks):
+        limiter.check('bench', f'bench-client-{i % clients}')
+    elapsed = time.perf_counter() - started
+    click.echo(f'{checks} checks in {elapsed:.3f}s, {elapsed / checks * 1e6:.1f}us per check ({storage})')
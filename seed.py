@@ -0,0 +1,112 @@
+import random
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import with_appcontext
+
+from models import db, Venue, Artist, Show
+
+# ----------------------------------------------------------------------------#
+# Seed data.
+# ----------------------------------------------------------------------------#
+
+CITIES = [
+    ('San Francisco', 'CA'),
+    ('Los Angeles', 'CA'),
+    ('New York', 'NY'),
+    ('Austin', 'TX'),
+    ('Seattle', 'WA'),
+    ('Chicago', 'IL'),
+    ('Nashville', 'TN'),
+    ('New Orleans', 'LA'),
+]
+
+GENRES = [
+    'Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk', 'Hip-Hop',
+    'Heavy Metal', 'Instrumental', 'Jazz', 'Musical Theatre', 'Pop', 'Punk', 'R&B', 'Reggae',
+    'Rock n Roll', 'Soul', 'Other',
+]
+
+BATCH_SIZE = 5000
+
+
+def _insert(table, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(table.insert(), rows[start:start + BATCH_SIZE])
+
+
+def seed_database(venues=50, artists=100, shows=500, seed=0):
+    """
+    Insert a deterministic catalog of fake venues, artists and shows.
+
+    Every show gets its own start time an hour apart from the previous one,
+    spread around today, so half of them are upcoming and none of them
+    overlap. Returns the ids of the inserted venues and artists.
+    """
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+
+    venue_rows = []
+    for i in range(venues):
+        city, state = rng.choice(CITIES)
+        venue_rows.append({
+            "name": f'The {rng.choice(GENRES)} Room {i}',
+            "city": city,
+            "state": state,
+            "address": f'{rng.randint(1, 9999)} Main St',
+            "genres": rng.sample(GENRES, rng.randint(1, 3)),
+            "phone": '+1 650-253-0000',
+            "image_link": f'https://images.example.com/venues/{i}.jpg',
+            "facebook_link": f'https://www.facebook.com/venue{i}',
+            "website": f'https://venue{i}.example.com',
+            "seeking_talent": rng.random() < 0.5,
+            "seeking_description": 'Looking for local acts',
+            "created_date": now - timedelta(minutes=i),
+        })
+
+    artist_rows = []
+    for i in range(artists):
+        city, state = rng.choice(CITIES)
+        artist_rows.append({
+            "name": f'{rng.choice(GENRES)} Collective {i}',
+            "city": city,
+            "state": state,
+            "genres": rng.sample(GENRES, rng.randint(1, 3)),
+            "phone": '+1 650-253-0000',
+            "image_link": f'https://images.example.com/artists/{i}.jpg',
+            "facebook_link": f'https://www.facebook.com/artist{i}',
+            "website": f'https://artist{i}.example.com',
+            "seeking_venue": rng.random() < 0.5,
+            "seeking_description": 'Looking for a stage',
+            "created_date": now - timedelta(minutes=i),
+        })
+
+    _insert(Venue.__table__, venue_rows)
+    _insert(Artist.__table__, artist_rows)
+    db.session.flush()
+
+    venue_ids = [id for id, in db.session.query(Venue.id).order_by(Venue.id.desc()).limit(venues)]
+    artist_ids = [id for id, in db.session.query(Artist.id).order_by(Artist.id.desc()).limit(artists)]
+
+    if venue_ids and artist_ids:
+        first_start = now - timedelta(hours=shows // 2)
+        _insert(Show.__table__, [{
+            "venue_id": rng.choice(venue_ids),
+            "artist_id": rng.choice(artist_ids),
+            "start_time": first_start + timedelta(hours=i),
+        } for i in range(shows)])
+
+    db.session.commit()
+    return venue_ids, artist_ids
+
+
+@click.command('seed')
+@click.option('--venues', default=50, show_default=True)
+@click.option('--artists', default=100, show_default=True)
+@click.option('--shows', default=500, show_default=True)
+@click.option('--seed', default=0, show_default=True, help='Random seed.')
+@with_appcontext
+def seed_command(venues, artists, shows, seed):
+    """Fill the database with fake venues, artists and shows."""
+    seed_database(venues, artists, shows, seed)
+    click.echo(f'Inserted {venues} venues, {artists} artists and {shows} shows.')
@@ -0,0 +1,79 @@
+import secrets
+
+from flask.sessions import SecureCookieSession, SessionInterface, session_json_serializer
+from itsdangerous import BadSignature, Signer
+
+# ----------------------------------------------------------------------------#
+# Server-side sessions.
+# ----------------------------------------------------------------------------#
+
+
+class ServerSideSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None):
+        super().__init__(initial)
+        self.sid = sid
+
+
+class RedisSessionInterface(SessionInterface):
+    """
+    Keeps session data in redis, shared by every worker and node, the cookie
+    only carries a signed random id. Data expires with the session lifetime.
+    """
+
+    serializer = session_json_serializer
+
+    def __init__(self, url, prefix='fyyur:session:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('SESSION_STORE_URL is set but the redis package is not installed')
+        self.redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='fyyur-session')
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(app.session_cookie_name)
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            data = sid and self.redis.get(self.prefix + sid)
+            if data:
+                return ServerSideSession(self.serializer.loads(data.decode()), sid=sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(32))
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            # e.g. the last flash message was read, drop it all
+            if session.modified:
+                self.redis.delete(self.prefix + session.sid)
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+
+        if not self.should_set_cookie(app, session):
+            return
+
+        lifetime = app.permanent_session_lifetime
+        self.redis.setex(self.prefix + session.sid, lifetime, self.serializer.dumps(dict(session)))
+        response.set_cookie(
+            app.session_cookie_name,
+            self._signer(app).sign(session.sid.encode()).decode(),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+def init_session_store(app):
+    url = app.config['SESSION_STORE_URL']
+    if url:
+        app.session_interface = RedisSessionInterface(url)
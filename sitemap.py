@@ -0,0 +1,147 @@
+import gzip
+import json
+import os
+from xml.sax.saxutils import escape
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import and_, func, select
+
+from models import db, Venue, Artist
+
+# ----------------------------------------------------------------------------#
+# Sitemaps.
+# ----------------------------------------------------------------------------#
+
+INDEX = 'sitemap.xml'
+MANIFEST = 'manifest.json'
+
+# name -> (model, criteria, page path). Shards cover fixed id ranges, so a
+# change only ever touches the one shard holding the row
+SOURCES = {
+    'venues': (Venue, lambda: [Venue.deleted_at.is_(None)], '/venues/{}'),
+    'artists': (Artist, lambda: [], '/artists/{}'),
+}
+
+
+def is_shard(filename):
+    return filename.startswith('sitemap-') and filename.endswith('.xml.gz')
+
+
+def lastmod(value):
+    # W3C datetime, the columns hold utc
+    return value.replace(microsecond=0).isoformat() + '+00:00'
+
+
+def shard_fingerprints(model, criteria, shard_size):
+    # number of rows and latest update per shard, edits bump updated_date and
+    # deletes change the count, so an unchanged fingerprint means an unchanged shard
+    shard = ((model.id - 1) / shard_size).label('shard')
+    rows = db.session.execute(
+        select([shard, func.count(), func.max(model.updated_date)]).
+        where(and_(*criteria)).group_by(shard)
+    )
+    return {shard: (count, last) for shard, count, last in rows}
+
+
+def _replace(path, write):
+    temporary = path + '.tmp'
+    write(temporary)
+    os.replace(temporary, path)
+
+
+def write_shard(path, rows, base_url, page):
+    def write(temporary):
+        # mtime=0 keeps unchanged shards byte for byte identical
+        with gzip.GzipFile(temporary, 'wb', mtime=0) as f:
+            f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                    b'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+            for id, updated in rows:
+                f.write(f'<url><loc>{base_url}{page.format(id)}</loc>'
+                        f'<lastmod>{lastmod(updated)}</lastmod></url>\n'.encode())
+            f.write(b'</urlset>\n')
+
+    _replace(path, write)
+
+
+def write_index(path, shards, base_url):
+    def write(temporary):
+        with open(temporary, 'w', encoding='utf-8') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+            for filename, (_, last) in sorted(shards.items()):
+                f.write(f'<sitemap><loc>{base_url}/sitemaps/{filename}</loc>'
+                        f'<lastmod>{last}</lastmod></sitemap>\n')
+            f.write('</sitemapindex>\n')
+
+    _replace(path, write)
+
+
+def write_manifest(path, shards):
+    def write(temporary):
+        with open(temporary, 'w') as f:
+            json.dump(shards, f)
+
+    _replace(path, write)
+
+
+def generate_sitemaps(directory, base_url, shard_size, full=False):
+    """
+    Write one gzipped sitemap per `shard_size` ids of venues and artists and
+    an index of them. Only shards whose fingerprint changed since the last
+    run are rewritten, unless `full`. Returns (shards written, shards total).
+    """
+    os.makedirs(directory, exist_ok=True)
+    base_url = escape(base_url.rstrip('/'))
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            previous = json.load(f)
+    except (FileNotFoundError, ValueError):
+        previous = {}
+
+    shards = {}
+    written = 0
+    for name, (model, criteria, page) in SOURCES.items():
+        for shard, (count, last) in sorted(shard_fingerprints(model, criteria(), shard_size).items()):
+            filename = f'sitemap-{name}-{shard + 1}.xml.gz'
+            shards[filename] = [count, lastmod(last)]
+            path = os.path.join(directory, filename)
+            if not full and previous.get(filename) == shards[filename] and os.path.exists(path):
+                continue
+
+            # stream the rows off a server side cursor instead of loading the shard
+            rows = db.session.connection().execution_options(stream_results=True).execute(
+                select([model.id, model.updated_date]).
+                where(and_(model.id > shard * shard_size, model.id <= (shard + 1) * shard_size, *criteria())).
+                order_by(model.id)
+            )
+            write_shard(path, rows, base_url, page)
+            written += 1
+
+    for filename in set(previous) - set(shards):
+        # every row of the shard is gone
+        try:
+            os.remove(os.path.join(directory, filename))
+        except FileNotFoundError:
+            pass
+
+    write_index(os.path.join(directory, INDEX), shards, base_url)
+    write_manifest(os.path.join(directory, MANIFEST), shards)
+    db.session.remove()
+    return written, len(shards)
+
+
+@click.command('sitemaps')
+@click.option('--base-url', default=None, help='Site url, defaults to SITEMAP_BASE_URL.')
+@click.option('--full', is_flag=True, help='Rewrite every shard, not only the changed ones.')
+@with_appcontext
+def sitemaps_command(base_url, full):
+    """Regenerate the sitemaps of changed venues and artists, run it from cron."""
+    config = current_app.config
+    base_url = base_url or config['SITEMAP_BASE_URL']
+    if not base_url:
+        raise click.UsageError('pass --base-url or set SITEMAP_BASE_URL')
+
+    written, total = generate_sitemaps(config['SITEMAP_DIR'], base_url, config['SITEMAP_SHARD_SIZE'], full)
+    click.echo(f'Wrote {written} of {total} sitemap shards.')
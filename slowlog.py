@@ -0,0 +1,257 @@
+import glob
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+import click
+from flask import current_app, has_request_context, request
+from flask.cli import with_appcontext
+from sqlalchemy import event
+
+import metrics
+from metrics import is_running
+from models import db
+
+# ----------------------------------------------------------------------------#
+# Slow query log.
+# ----------------------------------------------------------------------------#
+
+logger = logging.getLogger('fyyur.slow_queries')
+
+
+def normalize_statement(statement):
+    # group statements that only differ by their literals / bound values
+    statement = re.sub(r"'(?:[^']|'')*'", '?', statement)
+    statement = re.sub(r'%\(\w+\)s|%s|\$\d+|\b\d+(?:\.\d+)?\b', '?', statement)
+    statement = re.sub(r'\(\s*\?(?:\s*,\s*\?)+\s*\)', '(?, ...)', statement)
+    return re.sub(r'\s+', ' ', statement).strip()
+
+
+def redact(parameters):
+    # keep types and shapes so the plan can be reasoned about, drop every value
+    if isinstance(parameters, dict):
+        return {key: redact(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(value) for value in parameters]
+    if parameters is None:
+        return None
+    if isinstance(parameters, (str, bytes)):
+        return f'<{type(parameters).__name__} len={len(parameters)}>'
+    return f'<{type(parameters).__name__}>'
+
+
+def _mtime(filename):
+    try:
+        return os.path.getmtime(filename)
+    except FileNotFoundError:
+        return 0
+
+
+def prune_exited(path, keep):
+    """Remove all but the `keep` newest logs and backups of processes that have exited."""
+    exited = []
+    for filename in glob.glob(path + '.*'):
+        pid = filename[len(path) + 1:].split('.')[0]
+        if pid.isdigit() and not is_running(int(pid)):
+            exited.append(filename)
+
+    # recycled workers (e.g. gunicorn max_requests) would otherwise leave theirs forever
+    for filename in sorted(exited, key=_mtime, reverse=True)[keep:]:
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+
+
+class SlowQueryLog:
+    """
+    Times every statement on the engine and hands the slow ones to a
+    background thread, which runs EXPLAIN (ANALYZE, BUFFERS) for them on its
+    own connection and writes one JSON line per statement to a rotating log.
+
+    Each process writes its own `<path>.<pid>` log from its own thread, both
+    started on its first slow statement, so workers forked from a preloaded
+    app never share a file or lose the thread to the fork. Only the newest
+    `keep_exited` logs of exited processes are kept.
+    """
+
+    def __init__(self, engine, threshold, path, explain=True, explain_every=300,
+                 max_bytes=10 * 1024 * 1024, backup_count=5, keep_exited=10):
+        self.engine = engine
+        self.threshold = threshold
+        self.explain = explain
+        # explain each normalized statement at most once per `explain_every` seconds
+        self.explain_every = explain_every
+        self._explained = {}
+        self._local = threading.local()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        # logs of exited processes kept for `flask slow-queries`
+        self.keep_exited = keep_exited
+
+        # the process the handler, queue and worker thread below belong to
+        self._pid = None
+        self._handler = None
+        self._queue = None
+        self._starting = threading.Lock()
+        # a lock held by another thread at fork time would never be released in the child
+        os.register_at_fork(after_in_child=self._forked)
+
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+        event.listen(engine, 'before_cursor_execute', self._before)
+        event.listen(engine, 'after_cursor_execute', self._after)
+
+    def _forked(self):
+        self._starting = threading.Lock()
+
+    def _start(self):
+        with self._starting:
+            pid = os.getpid()
+            if self._pid == pid:
+                return
+            if self._handler is not None:
+                # the parent's, inherited through the fork
+                logger.removeHandler(self._handler)
+                self._handler.close()
+
+            prune_exited(self.path, self.keep_exited)
+            self._handler = RotatingFileHandler(f'{self.path}.{pid}', maxBytes=self.max_bytes,
+                                                backupCount=self.backup_count)
+            self._handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(self._handler)
+            self._queue = queue.Queue(maxsize=1000)
+            self._explained = {}
+            threading.Thread(target=self._worker, args=(self._queue,), daemon=True, name='slow-query-log').start()
+            self._pid = pid
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        context._slowlog_started = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        if getattr(self._local, 'explaining', False):
+            return
+
+        elapsed = time.perf_counter() - context._slowlog_started
+        if elapsed < self.threshold:
+            return
+
+        entry = {
+            "time": datetime.utcnow().isoformat(),
+            "duration_ms": round(elapsed * 1000, 3),
+            "route": request.endpoint if has_request_context() else None,
+            "statement": statement,
+            "parameters": redact(parameters),
+            "executemany": executemany,
+        }
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            # the raw parameters are only kept in memory until the plan is captured
+            self._queue.put_nowait((entry, None if executemany else parameters))
+        except queue.Full:
+            metrics.incr('slow_queries.dropped')
+
+    def _should_explain(self, entry):
+        if not self.explain or entry['executemany']:
+            return False
+        # EXPLAIN ANALYZE runs the statement, never do that for writes
+        if not re.match(r'\s*(SELECT|WITH)\b', entry['statement'], re.IGNORECASE):
+            return False
+
+        key = normalize_statement(entry['statement'])
+        now = time.time()
+        if now - self._explained.get(key, 0) < self.explain_every:
+            return False
+        self._explained[key] = now
+        return True
+
+    def _capture_plan(self, statement, parameters):
+        self._local.explaining = True
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + statement, parameters)
+            return cursor.fetchone()[0]
+        finally:
+            connection.rollback()
+            connection.close()
+            self._local.explaining = False
+
+    def _worker(self, entries):
+        while True:
+            entry, parameters = entries.get()
+            if self._should_explain(entry):
+                try:
+                    entry['plan'] = self._capture_plan(entry['statement'], parameters)
+                except Exception as e:
+                    entry['plan_error'] = repr(e)
+            metrics.incr('slow_queries.logged')
+            logger.info(json.dumps(entry, default=str))
+
+
+def init_slow_query_log(app):
+    if app.config['SLOW_QUERY_THRESHOLD_MS'] is None:
+        return None
+
+    with app.app_context():
+        engine = db.engine
+
+    return SlowQueryLog(
+        engine,
+        threshold=app.config['SLOW_QUERY_THRESHOLD_MS'] / 1000,
+        path=app.config['SLOW_QUERY_LOG'],
+        # EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) is postgres syntax
+        explain=app.config['SLOW_QUERY_EXPLAIN'] and engine.dialect.name == 'postgresql',
+    )
+
+
+def read_slow_log(path):
+    """Group the entries of every process' slow query log and backups by normalized statement."""
+    groups = defaultdict(lambda: {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "routes": defaultdict(int), "plan": None})
+
+    for filename in sorted(glob.glob(path + '*')):
+        with open(filename) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                group = groups[normalize_statement(entry['statement'])]
+                group['count'] += 1
+                group['total_ms'] += entry['duration_ms']
+                group['routes'][entry['route'] or '-'] += 1
+                if entry['duration_ms'] >= group['max_ms']:
+                    group['max_ms'] = entry['duration_ms']
+                    group['plan'] = entry.get('plan') or group['plan']
+
+    return groups
+
+
+@click.command('slow-queries')
+@click.option('--limit', default=20, show_default=True, help='Number of statements to show.')
+@click.option('--plans/--no-plans', default=False, help='Print the slowest captured plan of each statement.')
+@with_appcontext
+def slow_queries_command(limit, plans):
+    """Summarize the slow query log by normalized statement."""
+    groups = read_slow_log(current_app.config['SLOW_QUERY_LOG'])
+    ranked = sorted(groups.items(), key=lambda item: item[1]['total_ms'], reverse=True)
+    for statement, group in ranked[:limit]:
+        routes = ', '.join(f'{route} x{count}' for route, count in
+                           sorted(group['routes'].items(), key=lambda item: -item[1]))
+        click.echo(f"{group['total_ms']:10.1f}ms total  {group['count']:6} calls  "
+                   f"{group['total_ms'] / group['count']:8.1f}ms avg  {group['max_ms']:8.1f}ms max")
+        click.echo(f'  routes: {routes}')
+        click.echo(f'  {statement}')
+        if plans and group['plan']:
+            click.echo('  ' + json.dumps(group['plan'], indent=2).replace('\n', '\n  '))
+        click.echo()
@@ -0,0 +1,83 @@
+import os
+import time
+
+from jinja2 import FileSystemBytecodeCache
+
+import metrics
+
+
+# ----------------------------------------------------------------------------#
+# Template bytecode cache.
+# ----------------------------------------------------------------------------#
+
+class TimedBytecodeCache(FileSystemBytecodeCache):
+    """
+    Filesystem bytecode cache shared by every worker pointing at the same
+    directory. Next to each cached template we keep how long it took to
+    compile, so every cache hit can be counted as compile time saved.
+    """
+
+    def _get_cost_filename(self, bucket):
+        return self._get_cache_filename(bucket) + '.cost'
+
+    def load_bytecode(self, bucket):
+        super().load_bytecode(bucket)
+
+        if bucket.code is None:
+            # jinja compiles the template between this call and dump_bytecode
+            metrics.incr('templates.cache_miss')
+            bucket.compile_started = time.perf_counter()
+            return
+
+        metrics.incr('templates.cache_hit')
+        try:
+            with open(self._get_cost_filename(bucket)) as f:
+                metrics.observe('templates.compile_saved', float(f.read()))
+        except (OSError, ValueError):
+            pass
+
+    def dump_bytecode(self, bucket):
+        started = getattr(bucket, 'compile_started', None)
+        super().dump_bytecode(bucket)
+
+        if started is None:
+            return
+
+        cost = time.perf_counter() - started
+        metrics.observe('templates.compile', cost)
+        try:
+            with open(self._get_cost_filename(bucket), 'w') as f:
+                f.write(repr(cost))
+        except OSError:
+            pass
+
+
+def init_template_cache(app):
+    cache_dir = app.config['JINJA_BYTECODE_CACHE_DIR']
+    os.makedirs(cache_dir, exist_ok=True)
+
+    app.jinja_env.bytecode_cache = TimedBytecodeCache(cache_dir)
+    # only check template mtimes when we expect templates to change under us
+    app.jinja_env.auto_reload = app.config['TEMPLATES_AUTO_RELOAD']
+
+
+def precompile_templates(app):
+    # load every html template once so the first request a worker serves
+    # doesn't pay for compiling layouts/main.html and friends
+    started = time.perf_counter()
+    names = app.jinja_env.list_templates(extensions=['html'])
+
+    for name in names:
+        app.jinja_env.get_template(name)
+
+    elapsed = time.perf_counter() - started
+    stats = metrics.snapshot()
+    app.logger.info(
+        'precompiled %d templates in %.3fs (hits=%d, misses=%d, compile time saved=%.3fs)',
+        len(names),
+        elapsed,
+        stats['counters'].get('templates.cache_hit', 0),
+        stats['counters'].get('templates.cache_miss', 0),
+        stats['timings'].get('templates.compile_saved', 0.0)
+    )
+    return names
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+# the embedded sqlite profile, set before app.py loads its configuration
+os.environ['FYYUR_ENV'] = 'test'
+os.environ.pop('DATABASE_URL', None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def app():
+    from app import app
+    from models import db
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,36 @@
+from autocomplete import PrefixIndex
+
+
+def test_stale_index_reloads_changes_from_other_workers():
+    rows = [(1, 'The Blues Bar')]
+    index = PrefixIndex(lambda: list(rows), max_age=0)
+    assert index.search('blues') == [{"id": 1, "name": 'The Blues Bar'}]
+
+    # written through another worker, this index never saw the add
+    rows.append((2, 'Blues Cellar'))
+    assert [match['id'] for match in index.search('blues')] == [1, 2]
+
+
+def test_fresh_index_answers_from_memory():
+    loads = []
+    index = PrefixIndex(lambda: loads.append(1) or [(1, 'Jazz Room')], max_age=3600)
+    index.search('jazz')
+    index.search('room')
+    assert len(loads) == 1
+
+
+def test_changes_made_during_a_reload_survive_it():
+    rows = [(1, 'Jazz Room'), (2, 'Jazz Cellar')]
+    index = PrefixIndex(lambda: list(rows), max_age=3600)
+    index.search('jazz')
+    index.max_age = 0
+
+    def snapshot():
+        # read before this worker's add and remove below were committed
+        taken = list(rows)
+        index.add(3, 'Jazz Loft')
+        index.remove(2)
+        return taken
+
+    index._loader = snapshot
+    assert [match['id'] for match in index.search('jazz')] == [3, 1]
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+
+from models import db, Artist, Show, Venue
+from querybudget import ARTIST_FORM, VENUE_FORM
+
+
+def test_window_with_mixed_offsets(client):
+    response = client.get('/calendar?from=2031-01-01T00:00%2B02:00&to=2031-01-10T00:00')
+    assert response.status_code == 200
+
+
+def test_window_bounds_are_compared_in_utc(client):
+    # 01:00+02:00 is 23:00 utc the day before, so this window is empty
+    response = client.get('/calendar?from=2031-01-01T01:00%2B02:00&to=2030-12-31T22:00')
+    assert response.status_code == 400
+
+
+def booked(client, start=None):
+    client.post('/venues/create', data=VENUE_FORM)
+    client.post('/artists/create', data=ARTIST_FORM)
+    venue, artist = Venue.query.one(), Artist.query.one()
+    db.session.add(Show(venue_id=venue.id, artist_id=artist.id, start_time=start or datetime.utcnow() + timedelta(days=7)))
+    db.session.commit()
+    return venue.id, artist.id
+
+
+def test_feed_times_are_utc(client):
+    venue_id, _ = booked(client, datetime(2031, 1, 1, 20))
+    body = client.get(f'/venues/{venue_id}/shows.ics').data.decode()
+    assert 'DTSTART:20310101T200000Z\r\n' in body
+    assert 'DTEND:20310101T220000Z\r\n' in body
+
+
+def test_renaming_an_artist_changes_the_venue_feed(client):
+    venue_id, artist_id = booked(client)
+    etag = client.get(f'/venues/{venue_id}/shows.ics').headers['ETag']
+    client.post(f'/artists/{artist_id}/edit', data=dict(ARTIST_FORM, name='Renamed Band', version='1'))
+
+    response = client.get(f'/venues/{venue_id}/shows.ics', headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert b'Renamed Band' in response.data
+
+
+def test_deleting_a_venue_changes_the_artist_feed(client):
+    venue_id, artist_id = booked(client)
+    etag = client.get(f'/artists/{artist_id}/shows.ics').headers['ETag']
+    Venue.query.filter_by(id=venue_id).update({"deleted_at": datetime.utcnow()})
+    db.session.commit()
+
+    response = client.get(f'/artists/{artist_id}/shows.ics', headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert b'VEVENT' not in response.data
@@ -0,0 +1,27 @@
+import threading
+
+import pytest
+from flask import Flask
+
+from config import load_config, read_secret_key
+
+
+def test_defaults_to_the_production_profile(monkeypatch):
+    for name in ('FYYUR_ENV', 'FLASK_ENV', 'DATABASE_URL', 'DB_PASSWORD', 'SECRET_KEY'):
+        monkeypatch.delenv(name, raising=False)
+    with pytest.raises(RuntimeError, match='production profile'):
+        load_config(Flask(__name__))
+
+
+def test_concurrent_workers_share_one_secret_key(tmp_path):
+    path = str(tmp_path / 'secret_key')
+    keys = []
+    threads = [threading.Thread(target=lambda: keys.append(read_secret_key(path, create=True))) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(keys)) == 1
+    assert len(keys[0]) == 64
+    assert [p.name for p in tmp_path.iterdir()] == ['secret_key']
@@ -0,0 +1,23 @@
+from datetime import datetime
+
+from models import db, Artist, Show, Venue
+from querybudget import ARTIST_FORM, VENUE_FORM
+
+
+def test_renaming_an_artist_changes_the_venue_page(client):
+    client.post('/venues/create', data=VENUE_FORM)
+    client.post('/artists/create', data=ARTIST_FORM)
+    venue = Venue.query.one()
+    artist = Artist.query.one()
+    db.session.add(Show(venue_id=venue.id, artist_id=artist.id, start_time=datetime(2031, 1, 1, 20)))
+    # validators have a one second resolution
+    Venue.query.update({"updated_date": datetime(2020, 1, 1)})
+    db.session.commit()
+    venue_id, artist_id = venue.id, artist.id
+
+    etag = client.get(f'/venues/{venue_id}').headers['ETag']
+    client.post(f'/artists/{artist_id}/edit', data=dict(ARTIST_FORM, name='Renamed Band', version='1'))
+
+    response = client.get(f'/venues/{venue_id}', headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert b'Renamed Band' in response.data
@@ -0,0 +1,34 @@
+from dedup import find_duplicates_command
+from models import db, Venue
+from querybudget import VENUE_FORM
+
+
+def listed_before_the_unique_index(name):
+    # what migration f3a8c6d1b572 leaves behind for a duplicate: a row with no key
+    index = next(index for index in Venue.__table__.indexes if index.name == 'ux_venue_name_key')
+    index.drop(db.engine)
+    db.session.execute(Venue.__table__.update().where(Venue.name == name).values(name=VENUE_FORM['name']))
+    db.session.execute(Venue.__table__.update().where(Venue.id == 2).values(name_key=None))
+    db.session.commit()
+    index.create(db.engine)
+
+
+def test_unkeyed_duplicates_are_listed_for_merging(app, client):
+    client.post('/venues/create', data=VENUE_FORM)
+    client.post('/venues/create', data=dict(VENUE_FORM, name='Budget Hall Annex'))
+    listed_before_the_unique_index('Budget Hall Annex')
+
+    result = app.test_cli_runner().invoke(find_duplicates_command, ['venues'])
+    assert result.exit_code == 0
+    assert result.output.splitlines()[0].startswith('merge\t1\t2\tBudget Hall\tBudget Hall\t')
+    assert sum(line.split('\t')[1:3] == ['1', '2'] for line in result.output.splitlines()) == 1
+
+
+def test_editing_an_unkeyed_duplicate_explains_the_conflict(client):
+    client.post('/venues/create', data=VENUE_FORM)
+    client.post('/venues/create', data=dict(VENUE_FORM, name='Budget Hall Annex'))
+    listed_before_the_unique_index('Budget Hall Annex')
+
+    response = client.post('/venues/2/edit', data=dict(VENUE_FORM, name='Budget Hall!', version='1'))
+    assert response.status_code == 409
+    assert b'have to be merged' in response.data
@@ -0,0 +1,146 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from imageproxy import ImageProxy, ImageUnavailable
+
+
+def jpeg(size=(400, 300)):
+    output = BytesIO()
+    Image.new('RGB', size, (200, 40, 40)).save(output, 'JPEG')
+    return output.getvalue()
+
+
+# path -> (status, headers, body), served by the stand-in origin
+ROUTES = {
+    '/image.jpg': (200, {"Content-Type": 'image/jpeg'}, jpeg()),
+    '/page.html': (200, {"Content-Type": 'text/html'}, b'<html></html>'),
+    '/large.jpg': (200, {"Content-Type": 'image/jpeg'}, b'\xff' * 4096),
+    '/moved': (302, {"Location": '/image.jpg'}, b''),
+    '/to-loopback': (302, {"Location": 'http://127.0.0.2:9/image.jpg'}, b''),
+    '/to-metadata': (302, {"Location": 'http://169.254.169.254/latest/meta-data/'}, b''),
+    '/to-private': (301, {"Location": 'http://10.0.0.1/image.jpg'}, b''),
+    '/loop': (302, {"Location": '/loop'}, b''),
+}
+
+
+class Origin(BaseHTTPRequestHandler):
+    def do_GET(self):
+        status, headers, body = ROUTES.get(self.path, (404, {}, b''))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def origin():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Origin)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+
+
+class StandInProxy(ImageProxy):
+    # the stand-in origin listens on loopback, treat exactly that as public
+    def __init__(self, app, origin_address):
+        super().__init__(app)
+        self.origin_address = origin_address
+
+    def _is_public(self, address):
+        return address == self.origin_address or super()._is_public(address)
+
+
+@pytest.fixture
+def proxy(tmp_path):
+    app = SimpleNamespace(config={
+        "IMAGE_PROXY_SIGNING_KEY": 'test',
+        "SECRET_KEY": 'test',
+        "IMAGE_CACHE_DIR": str(tmp_path),
+        "IMAGE_CACHE_MAX_BYTES": 10 * 1024 * 1024,
+        "IMAGE_FETCH_TIMEOUT": 5,
+        "IMAGE_MAX_SOURCE_BYTES": 1024 * 1024,
+        "IMAGE_PROXY_ALLOW_PRIVATE": False,
+    })
+    return StandInProxy(app, '127.0.0.1')
+
+
+def test_thumbnail_of_an_image(proxy, origin):
+    thumb, digest = proxy.thumbnail(f'{origin}/image.jpg', 'tile')
+    with Image.open(thumb) as image:
+        assert image.size == (320, 240)
+
+
+def test_follows_redirects_to_public_hosts(proxy, origin):
+    thumb, _ = proxy.thumbnail(f'{origin}/moved', 'list')
+    with Image.open(thumb) as image:
+        assert max(image.size) == 80
+
+
+def evict_thumbnails(tmp_path):
+    for path in (tmp_path / 'thumbs').rglob('*.jpg'):
+        path.unlink()
+
+
+def test_cached_thumbnails_are_served_from_the_open_file(proxy, origin, tmp_path):
+    proxy.thumbnail(f'{origin}/image.jpg', 'tile')
+    thumb, _ = proxy.thumbnail(f'{origin}/image.jpg', 'tile')
+    # another worker's eviction pass between the lookup and the response
+    evict_thumbnails(tmp_path)
+    with thumb, Image.open(thumb) as image:
+        assert image.size == (320, 240)
+
+
+def test_evicted_thumbnails_are_rebuilt(proxy, origin, tmp_path):
+    proxy.thumbnail(f'{origin}/image.jpg', 'tile')
+    evict_thumbnails(tmp_path)
+    thumb, _ = proxy.thumbnail(f'{origin}/image.jpg', 'tile')
+    with Image.open(thumb) as image:
+        assert image.size == (320, 240)
+
+
+def test_image_route_serves_the_thumbnail(client, monkeypatch):
+    from app import image_proxy
+
+    monkeypatch.setattr(image_proxy, 'thumbnail', lambda url, size: (BytesIO(jpeg()), 'abc'))
+    response = client.get(f"/images/tile/{image_proxy.token('https://images.example.com/a.jpg')}")
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    assert response.data == jpeg()
+    assert response.headers['ETag'] == '"abc-tile"'
+
+
+@pytest.mark.parametrize('route', ['/to-loopback', '/to-metadata', '/to-private'])
+def test_refuses_redirects_to_private_addresses(proxy, origin, route):
+    with pytest.raises(ImageUnavailable, match='non public address'):
+        proxy.thumbnail(f'{origin}{route}', 'tile')
+
+
+def test_refuses_private_links(proxy):
+    with pytest.raises(ImageUnavailable, match='non public address'):
+        proxy.thumbnail('http://[::1]:9/image.jpg', 'tile')
+
+
+def test_refuses_redirect_loops(proxy, origin):
+    with pytest.raises(ImageUnavailable, match='redirected more than'):
+        proxy.thumbnail(f'{origin}/loop', 'tile')
+
+
+def test_refuses_oversized_bodies(proxy, origin):
+    proxy.max_source_bytes = 1024
+    with pytest.raises(ImageUnavailable, match='larger than'):
+        proxy.thumbnail(f'{origin}/large.jpg', 'tile')
+
+
+def test_refuses_non_image_content_types(proxy, origin):
+    with pytest.raises(ImageUnavailable, match='not an image'):
+        proxy.thumbnail(f'{origin}/page.html', 'tile')
@@ -0,0 +1,51 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import metrics
+from metrics import dump, metrics_command, read_metrics
+from unitofwork import run_in_transaction
+
+
+def test_metrics_adds_up_the_running_workers(app, tmp_path):
+    app.config['METRICS_DIR'] = str(tmp_path)
+    metrics.incr('db.retries', 2)
+    dump(str(tmp_path))
+    # a worker that has exited since its last dump
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    (tmp_path / f'metrics.{exited.pid}.json').write_text(json.dumps(
+        {"pid": exited.pid, "time": 0, "counters": {"db.retries": 5}, "timings": {}}
+    ))
+
+    assert [data['pid'] for data in read_metrics(str(tmp_path))] == [os.getpid()]
+    assert not (tmp_path / f'metrics.{exited.pid}.json').exists()
+
+    result = app.test_cli_runner().invoke(metrics_command)
+    assert result.exit_code == 0
+    assert '1 workers' in result.output
+    retries = next(line for line in result.output.splitlines() if 'db.retries' in line)
+    assert int(retries.split()[-1]) == metrics.snapshot()['counters']['db.retries']
+
+
+def test_retries_and_failures_are_logged(app, caplog):
+    app.config['DB_RETRY_BACKOFF'] = 0
+
+    def failover():
+        raise OperationalError('SELECT 1', {}, Exception('server closed the connection'),
+                               connection_invalidated=True)
+
+    with caplog.at_level(logging.WARNING), pytest.raises(OperationalError):
+        run_in_transaction(failover)
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert [message.split(',')[0] for message in messages] == [
+        'retrying transaction after attempt 1',
+        'retrying transaction after attempt 2',
+        'transaction failed after 3 attempt(s)',
+    ]
@@ -0,0 +1,8 @@
+from querybudget import check_budgets
+from seed import seed_database
+
+
+def test_every_route_stays_within_its_query_budget(app):
+    # what `flask check-query-budgets` runs, on the test profile's sqlite database
+    venue_ids, artist_ids = seed_database(venues=20, artists=30, shows=400)
+    assert check_budgets(app, {"venue_id": venue_ids[0], "artist_id": artist_ids[0]}) == []
@@ -0,0 +1,65 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import ratelimit
+from ratelimit import SharedMemoryBackend, init_rate_limits
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(ratelimit, 'time', SimpleNamespace(time=lambda: now[0], perf_counter=time.perf_counter))
+    return now
+
+
+@pytest.fixture
+def limited(app, monkeypatch, tmp_path):
+    # the test profile runs without limits, hook them up for this test only
+    monkeypatch.setitem(app.before_request_funcs, None, list(app.before_request_funcs.get(None, [])))
+    monkeypatch.setattr(app, 'extensions', dict(app.extensions))
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_STORAGE', str(tmp_path / 'ratelimit'))
+    # two searches, then one more every 30 seconds
+    monkeypatch.setitem(app.config, 'RATE_LIMITS', {"search_venues": (2, 60)})
+    init_rate_limits(app)
+    return app.test_client()
+
+
+def search(client):
+    return client.post('/venues/search', data={"search_term": 'hall'})
+
+
+def test_exhausted_buckets_answer_429_with_retry_after(limited, clock):
+    assert search(limited).status_code == 200
+    assert search(limited).status_code == 200
+
+    response = search(limited)
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '30'
+
+
+def test_buckets_refill_as_time_passes(limited, clock):
+    for _ in range(2):
+        search(limited)
+    assert search(limited).status_code == 429
+
+    clock[0] += 15
+    response = search(limited)
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '15'
+
+    clock[0] += 15
+    assert search(limited).status_code == 200
+    assert search(limited).status_code == 429
+
+
+def test_workers_share_the_buckets(tmp_path, clock):
+    # two backends on one file, as two worker processes on a host
+    path = str(tmp_path / 'ratelimit')
+    first, second = SharedMemoryBackend(path, slots=64), SharedMemoryBackend(path, slots=64)
+    assert first.take('search:1.2.3.4', 2, 1 / 30) == 0
+    assert second.take('search:1.2.3.4', 2, 1 / 30) == 0
+    assert first.take('search:1.2.3.4', 2, 1 / 30) == pytest.approx(30)
+    # other clients have buckets of their own
+    assert second.take('search:5.6.7.8', 2, 1 / 30) == 0
@@ -0,0 +1,72 @@
+from models import Artist, Show, Venue
+from querybudget import ARTIST_FORM, VENUE_FORM
+
+
+def book(client, start_time, duration=''):
+    venue = Venue.query.one()
+    artist = Artist.query.one()
+    return client.post('/shows/create', data={
+        "venue_id": venue.id, "artist_id": artist.id, "start_time": start_time, "duration": duration
+    })
+
+
+def setup_listings(client):
+    client.post('/venues/create', data=VENUE_FORM)
+    client.post('/artists/create', data=ARTIST_FORM)
+
+
+def test_back_to_back_shows_are_allowed(client):
+    setup_listings(client)
+    assert book(client, '2031-01-01 20:00', '60').status_code == 200
+    assert book(client, '2031-01-01 21:00', '60').status_code == 200
+    # a show without a duration at the end of another one
+    assert book(client, '2031-01-01 22:00').status_code == 200
+    assert Show.query.count() == 3
+
+
+def test_overlapping_shows_conflict(client):
+    setup_listings(client)
+    assert book(client, '2031-01-01 20:00', '60').status_code == 200
+    assert book(client, '2031-01-01 20:59', '60').status_code == 409
+    assert book(client, '2031-01-01 20:30').status_code == 409
+    assert Show.query.count() == 1
+
+
+def test_shows_without_duration_conflict_at_the_same_time(client):
+    setup_listings(client)
+    assert book(client, '2031-01-01 20:00').status_code == 200
+    assert book(client, '2031-01-01 20:00').status_code == 409
+    assert book(client, '2031-01-01 19:00', '60').status_code == 200
+
+
+def test_invalid_durations_are_rejected(client):
+    setup_listings(client)
+    for duration in ('abc', '0', '-30', '1441', '99999999999999'):
+        assert book(client, '2031-01-01 20:00', duration).status_code == 400
+    assert Show.query.count() == 0
+
+
+def test_batch_rejects_non_positive_durations(client):
+    setup_listings(client)
+    venue = Venue.query.one()
+    artist = Artist.query.one()
+    response = client.post('/shows/batch', json={"shows": [
+        {"venue_id": venue.id, "artist_id": artist.id, "start_time": '2031-01-01 20:00', "duration": -5},
+    ]})
+    assert response.status_code == 400
+    assert response.get_json()['errors'][0]['index'] == 0
+    assert Show.query.count() == 0
+
+
+def test_batch_rejects_bodies_that_are_not_objects(client):
+    for body in ([{"venue_id": 1, "artist_id": 1, "start_time": '2031-01-01 20:00'}], 5, 'shows', None):
+        response = client.post('/shows/batch', json=body)
+        assert response.status_code == 400
+        assert response.get_json() == {"error": "expected a list of shows"}
+
+
+def test_invalid_start_times_are_rejected(client):
+    setup_listings(client)
+    for start_time in ('', 'tomorrowish', '2031-13-45 20:00', '99999999999-01-01'):
+        assert book(client, start_time).status_code == 400
+    assert Show.query.count() == 0
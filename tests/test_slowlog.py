@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+import time
+from datetime import date
+
+from sqlalchemy import create_engine
+
+from slowlog import SlowQueryLog, prune_exited, read_slow_log, redact
+
+
+def wait_for(path):
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        if os.path.exists(path) and os.path.getsize(path):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_each_process_writes_its_own_log(tmp_path):
+    path = str(tmp_path / 'slow_queries.log')
+    engine = create_engine('sqlite://')
+    SlowQueryLog(engine, threshold=0, path=path, explain=False)
+
+    engine.execute('SELECT 1')
+    assert wait_for(f'{path}.{os.getpid()}')
+
+    # the worker thread doesn't survive a fork, like that of a gunicorn --preload master
+    pid = os.fork()
+    if pid == 0:
+        engine.dispose()
+        engine.execute('SELECT 2')
+        os._exit(0 if wait_for(f'{path}.{os.getpid()}') else 1)
+
+    assert os.waitpid(pid, 0)[1] == 0
+    assert wait_for(f'{path}.{pid}')
+    assert set(read_slow_log(path)) == {'SELECT ?'}
+    assert read_slow_log(path)['SELECT ?']['count'] == 2
+
+
+def test_only_the_newest_logs_of_exited_processes_are_kept(tmp_path):
+    path = str(tmp_path / 'slow_queries.log')
+    exited = []
+    for _ in range(3):
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        exited.append(process.pid)
+    for age, pid in enumerate(reversed(exited)):
+        for filename in (f'{path}.{pid}', f'{path}.{pid}.1'):
+            open(filename, 'w').close()
+            os.utime(filename, (1000 - age, 1000 - age))
+    open(f'{path}.{os.getpid()}', 'w').close()
+
+    prune_exited(path, keep=2)
+    assert sorted(os.listdir(tmp_path)) == sorted([
+        f'slow_queries.log.{exited[-1]}', f'slow_queries.log.{exited[-1]}.1', f'slow_queries.log.{os.getpid()}'
+    ])
+
+
+def test_every_bound_value_is_redacted():
+    assert redact({"name": 'secret', "id": 42, "price": 1.5, "blob": b'\x00\x01', "day": date(2031, 1, 1),
+                   "ids": (1, None)}) == {
+        "name": '<str len=6>', "id": '<int>', "price": '<float>', "blob": '<bytes len=2>', "day": '<date>',
+        "ids": ['<int>', None],
+    }
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+from models import db, Artist, OutboxEvent, Show, Venue
+from querybudget import ARTIST_FORM, VENUE_FORM
+
+
+def test_create_venue_and_read_it_back(client):
+    response = client.post('/venues/create', data=VENUE_FORM)
+    assert response.status_code == 200
+
+    venue = Venue.query.filter_by(name=VENUE_FORM['name']).one()
+    assert venue.name_key == 'budget hall|san francisco|ca'
+    assert OutboxEvent.query.filter_by(entity='venue', entity_id=venue.id).count() == 1
+
+    response = client.get(f'/venues/{venue.id}')
+    assert response.status_code == 200
+    assert VENUE_FORM['name'].encode() in response.data
+
+
+def test_delete_venue_cascades_to_shows(client):
+    client.post('/venues/create', data=VENUE_FORM)
+    client.post('/artists/create', data=ARTIST_FORM)
+    venue = Venue.query.one()
+    artist = Artist.query.one()
+    start = datetime(2031, 1, 1, 20)
+    db.session.add_all([
+        Show(venue_id=venue.id, artist_id=artist.id, start_time=start),
+        Show(venue_id=venue.id, artist_id=artist.id, start_time=start + timedelta(days=1)),
+    ])
+    db.session.commit()
+
+    response = client.delete(f'/venues/{venue.id}')
+    assert response.status_code == 302
+    db.session.remove()
+    assert Venue.query.count() == 0
+    assert Show.query.count() == 0
+
+
+def test_matches_limit_is_clamped(client):
+    client.post('/venues/create', data=VENUE_FORM)
+    venue = Venue.query.one()
+    response = client.get(f'/venues/{venue.id}/matches?limit=-1')
+    assert response.status_code == 200
@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta
+
+from app import artist_rows
+from models import db, Artist, Show, Venue
+from querybudget import ARTIST_FORM, VENUE_FORM
+
+
+def soft_deleted_venue(client):
+    # what delete_venue leaves behind for a venue with a large history
+    client.post('/venues/create', data=VENUE_FORM)
+    client.post('/artists/create', data=ARTIST_FORM)
+    venue, artist = Venue.query.one(), Artist.query.one()
+    db.session.add(Show(venue_id=venue.id, artist_id=artist.id, start_time=datetime.utcnow() + timedelta(days=7)))
+    venue.deleted_at = datetime.utcnow()
+    db.session.commit()
+    return venue.id, artist.id
+
+
+def test_shows_cannot_be_booked_at_a_deleted_venue(client):
+    venue_id, artist_id = soft_deleted_venue(client)
+    response = client.post('/shows/create', data={
+        "venue_id": venue_id, "artist_id": artist_id, "start_time": '2031-01-01 20:00'
+    })
+    assert response.status_code == 400
+    assert Show.query.count() == 1
+
+
+def test_deleted_venues_cannot_be_edited(client):
+    venue_id, _ = soft_deleted_venue(client)
+    response = client.post(f'/venues/{venue_id}/edit', data=dict(VENUE_FORM, name='Revived Hall', version='1'))
+    assert response.status_code == 404
+    assert db.session.query(Venue.name).filter_by(id=venue_id).scalar() == VENUE_FORM['name']
+
+
+def test_artist_rows_skip_shows_at_deleted_venues(client):
+    soft_deleted_venue(client)
+    assert [row.num_upcoming_shows for row in artist_rows()] == [0]
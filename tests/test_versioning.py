@@ -0,0 +1,17 @@
+from models import Venue
+from querybudget import VENUE_FORM
+
+
+def resubmit(client, venue_id, version):
+    # the edit page posts the fields the user touched, none here
+    return client.post(f'/venues/{venue_id}/edit', data=dict(VENUE_FORM, version=str(version), changed=''))
+
+
+def test_unchanged_resubmits_check_the_version(client):
+    client.post('/venues/create', data=VENUE_FORM)
+    venue_id = Venue.query.one().id
+    client.post(f'/venues/{venue_id}/edit', data=dict(VENUE_FORM, phone='+1 650-253-0001', version='1'))
+
+    assert resubmit(client, venue_id, 2).status_code == 302
+    assert resubmit(client, venue_id, 1).status_code == 409
+    assert resubmit(client, venue_id + 1, 1).status_code == 404
@@ -0,0 +1,65 @@
+import random
+import time
+
+from flask import current_app
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+
+import metrics
+from models import db
+
+# ----------------------------------------------------------------------------#
+# Unit of work.
+# ----------------------------------------------------------------------------#
+
+# serialization_failure, deadlock_detected, admin_shutdown, crash_shutdown,
+# cannot_connect_now and the connection exception class
+RETRYABLE_PGCODES = {'40001', '40P01', '57P01', '57P02', '57P03', '08000', '08003', '08006'}
+
+
+def is_retryable(error):
+    if not isinstance(error, DBAPIError):
+        return False
+    # set by sqlalchemy when the connection dropped (e.g. a failover), the pool
+    # has already been invalidated so the next attempt gets a fresh connection
+    if error.connection_invalidated:
+        return True
+    return getattr(error.orig, 'pgcode', None) in RETRYABLE_PGCODES
+
+
+def run_in_transaction(work):
+    """
+    Call `work()` and commit, retrying the whole transaction with jittered
+    exponential backoff when it fails for a transient reason.
+
+    `work` must only stage changes on db.session (no commit) and be safe to
+    call again, every attempt starts from a rolled back session. Whatever it
+    returns is returned after the commit. Non-retryable errors and the last
+    failed attempt are re-raised after rolling back.
+    """
+    config = current_app.config
+    attempts = config['DB_RETRY_ATTEMPTS']
+
+    for attempt in range(1, attempts + 1):
+        try:
+            result = work()
+            db.session.commit()
+            metrics.incr('db.transactions')
+            return result
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            error = getattr(e, 'orig', e)
+            pgcode = getattr(error, 'pgcode', None)
+            if attempt == attempts or not is_retryable(e):
+                metrics.incr('db.failures')
+                current_app.logger.warning('transaction failed after %d attempt(s), pgcode %s: %r',
+                                           attempt, pgcode, error)
+                raise
+            metrics.incr('db.retries')
+            current_app.logger.warning('retrying transaction after attempt %d, pgcode %s: %r',
+                                       attempt, pgcode, error)
+            # full jitter keeps workers that failed together from retrying together
+            time.sleep(random.uniform(0, config['DB_RETRY_BACKOFF'] * 2 ** (attempt - 1)))
+        except BaseException:
+            # e.g. abort(404) raised by `work`
+            db.session.rollback()
+            raise